@@ -1,15 +1,40 @@
-from flask import Blueprint
+import math
+from functools import wraps
+from flask import Blueprint, current_app, request, abort
 from flask_restx import Api
 import logging
+from services.errors import MailgunUnavailable
 
 # Import namespaces
 from .mail_list import api as mail_list_ns
+from .health import api as health_ns
+from .jobs import api as jobs_ns
+from .auth import api as auth_ns
+from .webhooks import api as webhooks_ns
+from .lists import api as lists_ns
 # Add other namespaces here if any
+from . import throttling, http_cache
 
 log = logging.getLogger(__name__)
 
 blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
 
+# Per-client rate limiting runs before any view or service code (RateLimit-* headers, 429)
+throttling.init_blueprint(blueprint)
+
+# Cache-Control per route, ETag / If-None-Match (304) and gzip/brotli for GET responses of every namespace
+http_cache.init_blueprint(blueprint)
+
+# Swagger UI page and the spec it loads; flask-restx builds the spec on the first request for it
+DOC_ENDPOINTS = ('api.doc', 'api.specs')
+
+
+@blueprint.before_request
+def docs_enabled():
+    """404 for the Swagger UI and spec when API_DOCS_ENABLED is off, so the spec is never generated."""
+    if request.endpoint in DOC_ENDPOINTS and not current_app.config.get('API_DOCS_ENABLED', True):
+        abort(404)
+
 # Define security scheme for Swagger UI
 authorizations = {
     'apiKey': {
@@ -20,6 +45,27 @@ authorizations = {
     }
 }
 
+
+def upstream_unavailable_handler(view):
+    """
+    Turns Mailgun calls refused locally (e.g. open circuit breaker) into 503 + Retry-After.
+
+    Applied as an Api-wide view decorator rather than an errorhandler, so these
+    expected fast failures don't log a full traceback per request.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        except MailgunUnavailable as error:
+            log.warning("Mailgun unavailable: %s", error.message)
+            headers = {}
+            if error.retry_after is not None:
+                headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+            return {"message": error.message}, 503, headers
+    return wrapper
+
+
 # Initialize API with blueprint, title, description, and security definitions
 api = Api(
     blueprint,
@@ -28,11 +74,23 @@ api = Api(
     description='API for Ephergent mailing list subscriber management.',
     doc='/doc/', # Path for Swagger UI relative to blueprint prefix (/api/v1/doc/)
     authorizations=authorizations,
+    decorators=[upstream_unavailable_handler],
     # security='apiKey' # Optional: Apply globally if ALL endpoints need auth
 )
 
+# JSON bodies are serialized through the HTTP cache, which memoizes them (with their ETag and
+# compressed variants) for results handed out repeatedly by the subscriber cache
+api.representation('application/json')(http_cache.output_json)
+
+
 # Add namespaces to the API
 # Ensure this matches the path used in the HTML form
 api.add_namespace(mail_list_ns, path='/mail/subscribers')
+api.add_namespace(jobs_ns, path='/mail/jobs')
+api.add_namespace(health_ns, path='/health')
+api.add_namespace(auth_ns, path='/auth')
+api.add_namespace(webhooks_ns, path='/webhooks')
+# Per-list subscriber routes (/mail/lists/<list>/subscribers) and fan-out operations across lists
+api.add_namespace(lists_ns, path='/mail')
 
 log.info("API Blueprint created with namespaces and security definitions.")
@@ -0,0 +1,47 @@
+import time
+from flask_restx import Namespace, Resource, reqparse, fields
+import logging
+from auth.tokens import TOKEN_HEADER, get_minter
+
+# Setup logging
+log = logging.getLogger(__name__)
+
+api = Namespace('auth', description='Short-lived tokens for public forms')
+
+token_parser = reqparse.RequestParser()
+token_parser.add_argument('action', type=str, required=True, location='args',
+                          help='Action the token is for (e.g. subscribe-add)')
+
+token_model = api.model('Token', {
+    'action': fields.String(description='Action the token is valid for'),
+    'token': fields.String(description=f'Send as the {TOKEN_HEADER} header'),
+    'header': fields.String(description='Name of the request header to send the token in'),
+    'expires': fields.Integer(description='Expiry (Unix epoch seconds)'),
+})
+
+
+@api.route('/token')
+class Token(Resource):
+    """Mint a signed token for a public action."""
+
+    @api.doc('get_token')
+    @api.expect(token_parser)
+    @api.response(200, 'Success', token_model)
+    @api.response(400, 'Tokens are not available for this action')
+    @api.response(503, 'Token minting not configured')
+    def get(self):
+        """Get a short-lived token (shared by all callers within one time bucket)"""
+        args = token_parser.parse_args()
+        minter = get_minter()
+        if minter is None:
+            log.error("API_SECRET not configured; cannot mint tokens.")
+            return {"message": "Authentication configuration error."}, 503
+        now = int(time.time())
+        try:
+            token, expires = minter.mint(args['action'], now=now)
+        except ValueError as e:
+            return {"message": str(e)}, 400
+        # Caches (browser/CDN) may share the token until the next bucket starts
+        max_age = minter.bucket_seconds - now % minter.bucket_seconds
+        headers = {'Cache-Control': f'public, max-age={max_age}'}
+        return {'action': args['action'], 'token': token, 'header': TOKEN_HEADER, 'expires': expires}, 200, headers
@@ -0,0 +1,49 @@
+from flask import current_app
+from flask_restx import Namespace, Resource
+import logging
+from services.cache import get_cache
+from services.write_queue import get_dispatcher
+from services.mirror import get_mirror
+from services.mailgun_client import get_client
+from services.single_flight import get_single_flight
+from services.write_coalescer import get_coalescer
+from services.webhooks import get_processor
+from .throttling import get_throttler
+from .http_cache import get_http_cache
+
+# Setup logging
+log = logging.getLogger(__name__)
+
+api = Namespace('health', description='Service health and runtime statistics')
+
+
+@api.route('/')
+class Health(Resource):
+    """Reports liveness plus counters useful for monitoring."""
+
+    @api.doc('get_health')
+    @api.response(200, 'Success')
+    def get(self):
+        """Service status, cache, write queue, mirror, read/write coalescing, webhook, circuit breaker, rate limiter and HTTP cache statistics"""
+        cache = get_cache()
+        dispatcher = get_dispatcher()
+        mirror = get_mirror()
+        single_flight = get_single_flight()
+        coalescer = get_coalescer()
+        webhook_processor = get_processor()
+        client = get_client()
+        throttler = get_throttler()
+        http_cache = get_http_cache()
+        return {
+            "status": "ok",
+            "cache": cache.stats() if cache is not None else None,
+            "write_queue": dispatcher.queue.stats() if dispatcher is not None else None,
+            "mirror": mirror.stats(current_app.config['MAILGUN_LIST_ADDRESS']) if mirror is not None else None,
+            "mailgun": client.resilience.snapshot(),
+            "coalescing": single_flight.stats() if single_flight is not None else None,
+            "write_coalescer": coalescer.stats() if coalescer is not None else None,
+            "webhooks": webhook_processor.stats() if webhook_processor is not None else None,
+            "rate_limit": client.rate_limiter.snapshot() if client.rate_limiter is not None else None,
+            "throttling": {"rejected": throttler.rejected} if throttler is not None else None,
+            "http_cache": http_cache.stats() if http_cache is not None else None,
+        }, 200
@@ -0,0 +1,264 @@
+import gzip
+import json
+import hashlib
+import threading
+import logging
+from collections import Counter, OrderedDict
+from flask import current_app, request, g, make_response
+from flask_restx.representations import output_json as restx_output_json
+from .throttling import route_path
+
+log = logging.getLogger(__name__)
+
+# Key used to store the HTTP cache policies on the Flask app (app.extensions)
+EXTENSION_KEY = 'api_http_cache'
+
+# Content-Encoding tokens in the order they are preferred when a client accepts several
+ENCODINGS = ('br', 'gzip')
+
+COMPRESSIBLE_TYPES = frozenset(('application/json', 'application/problem+json', 'application/javascript'))
+
+
+class _Entry:
+    """A serialized response body with its ETag and compressed variants, computed on first use."""
+
+    __slots__ = ('data', 'body', 'etag', 'encoded')
+
+    def __init__(self, body, data=None):
+        self.data = data  # Keeps the memo key (id(data)) from being reused while the entry lives
+        self.body = body
+        self.etag = None
+        self.encoded = {}
+
+
+class HttpCache:
+    """
+    Cache-Control, ETag / If-None-Match and compression for the API's GET responses.
+
+    JSON bodies are serialized through `serialize`, which memoizes large bodies
+    by the identity of the object they came from: the subscriber cache hands
+    out the same result object until it expires, so repeated reads of a cached
+    list skip serialization, hashing and compression entirely. Entries are kept
+    in an LRU bounded by `memo_bytes`. Results must not be mutated once
+    returned by a view (they are shared with the subscriber cache anyway).
+
+    ETags are weak (W/"...") content hashes of the uncompressed body, so the
+    gzip and brotli variants of a response share one validator.
+    """
+
+    def __init__(self, cache_control=None, default_cache_control=None, etags=True, compression=True,
+                 min_size=1024, encodings=ENCODINGS, gzip_level=6, brotli_quality=5, memo_bytes=16 * 1024 * 1024,
+                 json_settings=None):
+        self.cache_control = cache_control or {}
+        self.default_cache_control = default_cache_control
+        self.etags = etags
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.memo_bytes = memo_bytes
+        self.json_settings = json_settings or {}
+        self._brotli = None
+        self.encodings = ()
+        if compression:
+            self.encodings = tuple(encoding for encoding in encodings if self._supports(encoding))
+        self.counts = Counter()
+        self._memo = OrderedDict()
+        self._memo_size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the policies from a Flask config mapping; returns None when all of them are off."""
+        cache_control = config.get('API_CACHE_CONTROL') or {}
+        if isinstance(cache_control, str):
+            cache_control = json.loads(cache_control)
+        encodings = config.get('API_COMPRESSION_ENCODINGS', ','.join(ENCODINGS))
+        if isinstance(encodings, str):
+            encodings = [encoding.strip() for encoding in encodings.split(',') if encoding.strip()]
+        etags = config.get('API_ETAGS_ENABLED', True)
+        compression = config.get('API_COMPRESSION_ENABLED', True)
+        default_cache_control = config.get('API_CACHE_CONTROL_DEFAULT')
+        if not (etags or compression or cache_control or default_cache_control):
+            return None
+        # Same bytes as flask-restx's own JSON representation
+        json_settings = dict(config.get('RESTX_JSON') or {})
+        if config.get('DEBUG'):
+            json_settings.setdefault('indent', 4)
+        return cls(
+            cache_control=cache_control,
+            default_cache_control=default_cache_control,
+            etags=etags,
+            compression=compression,
+            min_size=int(config.get('API_COMPRESSION_MIN_SIZE', 1024)),
+            encodings=encodings,
+            gzip_level=int(config.get('API_COMPRESSION_GZIP_LEVEL', 6)),
+            brotli_quality=int(config.get('API_COMPRESSION_BROTLI_QUALITY', 5)),
+            memo_bytes=int(config.get('API_RESPONSE_MEMO_BYTES', 16 * 1024 * 1024)),
+            json_settings=json_settings,
+        )
+
+    def _supports(self, encoding):
+        if encoding == 'gzip':
+            return True
+        if encoding == 'br':
+            try:
+                import brotli
+            except ImportError:
+                try:
+                    import brotlicffi as brotli
+                except ImportError:
+                    log.info("Brotli compression unavailable (install 'brotli'); using gzip only.")
+                    return False
+            self._brotli = brotli
+            return True
+        log.warning("Unsupported API_COMPRESSION_ENCODINGS entry ignored: %s", encoding)
+        return False
+
+    def cache_control_for(self, route):
+        return self.cache_control.get(route, self.default_cache_control)
+
+    def serialize(self, data):
+        """The JSON body for `data`, memoized by object identity when it is large enough to be worth it."""
+        key = id(data)
+        entry = self._memo.get(key)
+        if entry is not None and entry.data is data:
+            with self._lock:
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+            self.counts['memo_hits'] += 1
+            return entry
+        body = (json.dumps(data, **self.json_settings) + "\n").encode('utf-8')
+        entry = _Entry(body, data)
+        if self.memo_bytes and self.min_size <= len(body) <= self.memo_bytes // 4:
+            with self._lock:
+                previous = self._memo.pop(key, None)
+                if previous is not None:
+                    self._memo_size -= len(previous.body)
+                self._memo[key] = entry
+                self._memo_size += len(body)
+                while self._memo_size > self.memo_bytes:
+                    _, evicted = self._memo.popitem(last=False)
+                    self._memo_size -= len(evicted.body)
+        return entry
+
+    @staticmethod
+    def entry(body):
+        """An unmemoized entry for a body produced elsewhere (errors, the Swagger spec, ...)."""
+        return _Entry(body)
+
+    def etag(self, entry):
+        if entry.etag is None:
+            entry.etag = hashlib.blake2b(entry.body, digest_size=16).hexdigest()
+        return entry.etag
+
+    def negotiate(self, accept_encodings):
+        """The preferred encoding the client accepts (a werkzeug Accept), or None for identity."""
+        for encoding in self.encodings:
+            if accept_encodings[encoding] > 0:
+                return encoding
+        return None
+
+    def encode(self, entry, encoding):
+        body = entry.encoded.get(encoding)
+        if body is None:
+            if encoding == 'br':
+                body = self._brotli.compress(entry.body, quality=self.brotli_quality)
+            else:
+                body = gzip.compress(entry.body, compresslevel=self.gzip_level, mtime=0)
+            entry.encoded[encoding] = body
+        return body
+
+    def prepare(self, route, status_code, entry, headers, mimetype=None, if_none_match=None,
+                accept_encodings=None):
+        """
+        Applies the policies to a GET response: returns (status_code, body) and updates `headers`.
+
+        `entry` is the response's serialized body, or None when the body must be
+        left alone (streamed, already encoded, not a 200); only the
+        Cache-Control policy applies then and the body returned is None.
+        """
+        if status_code < 500 and status_code != 429 and 'Cache-Control' not in headers:
+            policy = self.cache_control_for(route)
+            if policy:
+                headers['Cache-Control'] = policy
+        if status_code != 200 or entry is None:
+            return status_code, None
+        compressible = (self.encodings and len(entry.body) >= self.min_size
+                        and (mimetype in COMPRESSIBLE_TYPES or (mimetype or '').startswith('text/')))
+        if compressible:
+            vary = headers.get('Vary')
+            if not vary:
+                headers['Vary'] = 'Accept-Encoding'
+            elif 'accept-encoding' not in vary.lower():
+                headers['Vary'] = f"{vary}, Accept-Encoding"
+        if self.etags:
+            etag = self.etag(entry)
+            headers['ETag'] = f'W/"{etag}"'
+            if if_none_match and if_none_match.contains_weak(etag):
+                self.counts['not_modified'] += 1
+                return 304, b''
+        encoding = self.negotiate(accept_encodings) if compressible and accept_encodings else None
+        if encoding is None:
+            return 200, entry.body
+        headers['Content-Encoding'] = encoding
+        self.counts[f'compressed_{encoding}'] += 1
+        return 200, self.encode(entry, encoding)
+
+    def stats(self):
+        return {'memo_entries': len(self._memo), 'memo_bytes': self._memo_size, **self.counts}
+
+
+def get_http_cache():
+    """Returns the HTTP cache policies for the current app, or None when they are all disabled."""
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def output_json(data, code, headers=None):
+    """The API's JSON representation: flask-restx's, serialized through the HttpCache memo."""
+    http_cache = get_http_cache()
+    if http_cache is None:
+        return restx_output_json(data, code, headers)
+    entry = http_cache.serialize(data)
+    g.api_response_entry = entry
+    response = make_response(entry.body, code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def finalize_response(response):
+    """Blueprint after_request hook: Cache-Control, ETag / 304 and compression for GET and HEAD."""
+    entry = g.pop('api_response_entry', None)
+    if request.method not in ('GET', 'HEAD') or request.url_rule is None:
+        return response
+    http_cache = get_http_cache()
+    if http_cache is None:
+        return response
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        entry = None
+    else:
+        body = response.get_data()
+        if entry is None or (entry.body is not body and entry.body != body):
+            entry = http_cache.entry(body)
+    status_code, body = http_cache.prepare(
+        f"GET {route_path()}", response.status_code, entry, response.headers, mimetype=response.mimetype,
+        if_none_match=request.if_none_match, accept_encodings=request.accept_encodings,
+    )
+    if status_code == 304:
+        response.status_code = 304
+        response.set_data(b'')
+        response.headers.pop('Content-Length', None)
+        response.headers.pop('Content-Type', None)
+    elif body is not None and body is not entry.body:
+        response.set_data(body)
+    return response
+
+
+def init_blueprint(blueprint):
+    """Builds the HTTP cache policies when the blueprint is registered and adds the response hook."""
+
+    @blueprint.record_once
+    def create(state):
+        state.app.extensions[EXTENSION_KEY] = HttpCache.from_config(state.app.config)
+
+    blueprint.after_request(finalize_response)
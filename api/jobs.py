@@ -0,0 +1,38 @@
+from flask_restx import Namespace, Resource, fields
+import logging
+from services import write_queue
+
+# Setup logging
+log = logging.getLogger(__name__)
+
+api = Namespace('jobs', description='Status of queued subscriber writes')
+
+job_model = api.model('Job', {
+    'job_id': fields.String(description='Job identifier returned by the queued write'),
+    'operation': fields.String(description='Queued operation (e.g. add)'),
+    'status': fields.String(description='queued, running, succeeded or failed'),
+    'attempts': fields.Integer(description='Number of delivery attempts so far'),
+    'status_code': fields.Integer(description='Mailgun status code of the last attempt'),
+    'result': fields.Raw(description='Mailgun response of the last attempt'),
+    'created_at': fields.Float(description='Creation time (Unix epoch seconds)'),
+    'updated_at': fields.Float(description='Last update time (Unix epoch seconds)'),
+})
+
+
+@api.route('/<string:job_id>')
+@api.param('job_id', 'The job id returned by POST /mail/subscribers/ in queued mode')
+class Job(Resource):
+    """Poll the outcome of a queued write."""
+
+    @api.doc('get_job')
+    @api.response(200, 'Success', job_model)
+    @api.response(404, 'Job not found or queued writes disabled')
+    def get(self, job_id):
+        """Fetch the status of a queued write"""
+        dispatcher = write_queue.get_dispatcher()
+        if dispatcher is None:
+            return {"message": "Queued writes are not enabled."}, 404
+        job = dispatcher.queue.get(job_id)
+        if job is None:
+            return {"message": "Job not found"}, 404
+        return job, 200
@@ -0,0 +1,168 @@
+from functools import wraps
+from flask_restx import Namespace, Resource
+import logging
+from services import mailgun_service, mirror, write_coalescer
+from services.mail_lists import get_lists
+from . import mail_list, payloads
+
+# Setup logging
+log = logging.getLogger(__name__)
+
+api = Namespace('lists', description='Subscribers of every configured list, and operations across lists')
+
+LIST_PARAM = 'Name or address of a list this deployment serves (MAILGUN_LIST_ADDRESS or MAILGUN_LISTS)'
+
+subscriptions_parser = payloads.subscriptions_payload.as_parser()
+
+# Parser for GET /subscriptions/<address>: the member read's options, optionally limited to some lists
+subscriptions_read_parser = mail_list.read_parser.copy()
+subscriptions_read_parser.add_argument('lists', type=payloads.names, help='Only look in these lists (comma-separated; default: all)', required=False, location='args')
+
+
+def _unknown_list(name):
+    return {"message": f"Unknown list: {name}"}, 404
+
+
+def _for_list(view):
+    """A /mail/subscribers view method, run for the list named in the URL (its Swagger docs carry over)."""
+    @wraps(view)
+    def wrapper(self, list_name, *args, **kwargs):
+        target = get_lists().resolve(list_name)
+        if target is None:
+            return _unknown_list(list_name)
+        with target.scope():
+            return view(self, *args, **kwargs)
+    apidoc = getattr(view, '__apidoc__', None)
+    if apidoc and 'id' in apidoc:
+        # Operation ids must stay unique in the spec
+        wrapper.__apidoc__ = {**apidoc, 'id': f"{apidoc['id']}_of_list"}
+    return wrapper
+
+
+def _by_list(address, results, ok_statuses=(200,)):
+    """
+    A fan-out response: each list's status and result, the lists that failed,
+    and 207 (Multi-Status) rather than 200 when any did.
+    """
+    failed = [name for name, (_, status_code) in results.items() if status_code not in ok_statuses]
+    lists = {name: {"status": status_code, **(result if isinstance(result, dict) else {"result": result})}
+             for name, (result, status_code) in results.items()}
+    return {"address": address, "lists": lists, "failed": failed}, 207 if failed else 200
+
+
+@api.route('/lists/')
+class MailingLists(Resource):
+    """The lists this deployment serves."""
+
+    @api.doc('list_mailing_lists')
+    @api.response(200, 'Success')
+    def get(self):
+        """List the configured mailing lists"""
+        return {"items": [target.to_dict() for target in get_lists()]}, 200
+
+
+@api.route('/lists/<string:list_name>/subscribers/')
+@api.param('list_name', LIST_PARAM)
+@api.response(404, 'Unknown list')
+class ListSubscriberList(Resource):
+    """Subscribers of one list; the same operations as /mail/subscribers/ (the default list)."""
+
+    get = _for_list(mail_list.SubscriberList.get)
+    post = _for_list(mail_list.SubscriberList.post)
+
+
+@api.route('/lists/<string:list_name>/subscribers/count')
+@api.param('list_name', LIST_PARAM)
+@api.response(404, 'Unknown list')
+class ListSubscriberCount(Resource):
+    """Subscriber counts of one list, from the mirror."""
+
+    get = _for_list(mail_list.SubscriberCount.get)
+
+
+@api.route('/lists/<string:list_name>/subscribers/<string:member_address>')
+@api.param('list_name', LIST_PARAM)
+@api.param('member_address', 'The email address of the subscriber')
+@api.response(404, 'Unknown list or subscriber not found')
+@api.response(500, 'Mailgun API Error')
+class ListSubscriber(Resource):
+    """One subscriber of one list; the same operations as /mail/subscribers/<address>."""
+
+    get = _for_list(mail_list.Subscriber.get)
+    put = _for_list(mail_list.Subscriber.put)
+    delete = _for_list(mail_list.Subscriber.delete)
+
+
+@api.route('/subscriptions')
+class Subscriptions(Resource):
+    """Adds an address to several lists with one request."""
+
+    @api.doc('subscribe_to_lists')
+    @api.expect(subscriptions_parser)
+    @api.response(200, 'Added to (or updated in) every list')
+    @api.response(207, "Some lists failed; see each list's status")
+    @api.response(400, 'Input validation error or unknown list')
+    def post(self):
+        """Add a subscriber to several lists at once (in parallel)"""
+        try:
+            args = payloads.subscriptions_payload.parse_request()
+        except payloads.ValidationError as e:
+            return e.to_response(), 400
+        registry = get_lists()
+        targets = {}
+        unknown = []
+        for name in args['lists']:
+            target = registry.resolve(name)
+            if target is None:
+                unknown.append(name)
+            else:
+                targets[target.name] = target
+        if unknown:
+            return payloads.ValidationError({"lists": f"Unknown list(s): {', '.join(unknown)}"}).to_response(), 400
+        log.info("Received request to add %s to %d list(s)", args['address'], len(targets))
+
+        def subscribe():
+            # Like POST /subscribers/, but never queued: the caller gets each list's outcome
+            write_coalescer.flush_pending(args['address'])
+            return mailgun_service.add_list_member(
+                email=args['address'],
+                name=args.get('name'),
+                subscribed=args['subscribed'],
+                upsert=args['upsert']
+            )
+
+        return _by_list(args['address'], registry.fan_out(subscribe, targets.values()))
+
+
+@api.route('/subscriptions/<string:member_address>')
+@api.param('member_address', 'The email address to look up')
+class AddressSubscriptions(Resource):
+    """Where an address is a member, looked up in every list at once."""
+
+    @api.doc('get_subscriptions')
+    @api.expect(subscriptions_read_parser)
+    @api.response(200, "Every list answered; 'subscribed' names the lists the address is subscribed to")
+    @api.response(207, "Some lists could not be read; see each list's status")
+    @api.response(404, 'Unknown list in lists')
+    def get(self, member_address):
+        """Find the lists an address is subscribed to (in parallel)"""
+        args = subscriptions_read_parser.parse_args()
+        registry = get_lists()
+        targets = {}
+        for name in args['lists'] or [target.name for target in registry]:
+            target = registry.resolve(name)
+            if target is None:
+                return _unknown_list(name)
+            targets[target.name] = target
+        log.info("Received request for the subscriptions of %s (%d list(s))", member_address, len(targets))
+
+        def lookup():
+            served = mirror.read_member(member_address, args['source'], args['max_staleness'])
+            if served is None:
+                served = mailgun_service.get_member(member_address)
+            return write_coalescer.apply_pending(*served)
+
+        body, status_code = _by_list(member_address, registry.fan_out(lookup, targets.values()), ok_statuses=(200, 404))
+        body['subscribed'] = [name for name, entry in body['lists'].items()
+                              if entry['status'] == 200 and (entry.get('member') or {}).get('subscribed')]
+        return body, status_code
@@ -1,12 +1,20 @@
-from flask import request
-from flask_restx import Namespace, Resource, fields, reqparse
-from services import mailgun_service
+import csv
+import io
+import json
+import itertools
+from flask import request, Response, stream_with_context, url_for
+from flask_restx import Namespace, Resource, fields, reqparse, inputs
+from services import mailgun_service, bulk_import, write_queue, mirror, write_coalescer
+from services.errors import MailgunUnavailable
 import logging
 from auth.decorators import signature_required # Import the decorator
+from . import payloads
 
 # Setup logging
 log = logging.getLogger(__name__)
 
+# `requests` is imported in the views that catch its errors (startup time, see services/mailgun_client.py)
+
 # Define the namespace - changed from 'subscribers' to '' since path is now in __init__.py
 api = Namespace('', description='Mailgun mailing list subscriber operations')
 
@@ -23,18 +31,96 @@ message_model = api.model('Message', {
     'message': fields.String(required=True, description='A message describing the result')
 })
 
-# Parser for adding a subscriber (POST) - handles form data, JSON, and query parameters
-subscriber_parser = reqparse.RequestParser()
-subscriber_parser.add_argument('address', type=str, required=True, help='Email address cannot be blank', location=('json', 'form', 'args'))
-subscriber_parser.add_argument('name', type=str, help='Optional subscriber name', required=False, location=('json', 'form', 'args'))
-subscriber_parser.add_argument('subscribed', type=bool, help='Subscription status (default: true)', default=True, location=('json', 'form', 'args'))
-subscriber_parser.add_argument('upsert', type=bool, help='Update if exists (default: true)', default=True, location=('json', 'form', 'args'))
+# Adding (POST) and updating (PUT) a subscriber take JSON, form data or query parameters, validated by
+# the precompiled schemas in payloads.py; these parsers only document the same fields in Swagger
+subscriber_parser = payloads.subscriber_payload.as_parser()
+update_subscriber_parser = payloads.update_subscriber_payload.as_parser()
+
+# Parser for the subscriber reads (GET / and GET /<address>) - query parameters only
+read_parser = reqparse.RequestParser()
+read_parser.add_argument('source', type=str, choices=mirror.SOURCES, help='Serve from Mailgun or from the local mirror (default: MIRROR_DEFAULT_SOURCE)', required=False, location='args')
+read_parser.add_argument('max_staleness', type=float, help='Oldest mirror data (seconds since the last sync) to accept before falling back to Mailgun', required=False, location='args')
+
+# Parser for counting subscribers (GET /count), also the filters of the list GET - served from the mirror
+count_parser = reqparse.RequestParser()
+count_parser.add_argument('subscribed', type=inputs.boolean, help='Only subscribed (true) or unsubscribed (false) members', required=False, location='args')
+count_parser.add_argument('domain', type=str, help='Only addresses at this domain (e.g. example.com)', required=False, location='args')
+count_parser.add_argument('prefix', type=str, help='Only addresses starting with this prefix', required=False, location='args')
+count_parser.add_argument('name', type=str, help='Only members whose name contains this text', required=False, location='args')
+count_parser.add_argument('max_staleness', type=float, help='Oldest mirror data (seconds since the last sync) to accept; 503 if older', required=False, location='args')
+
+# Parser for the list GET: mirror/Mailgun source plus filters and pagination
+list_parser = read_parser.copy()
+for argument in count_parser.args:
+    if argument.name != 'max_staleness':
+        list_parser.add_argument(argument)
+list_parser.add_argument('limit', type=inputs.int_range(1, mirror.MAX_QUERY_LIMIT), help=f'Members per page (1-{mirror.MAX_QUERY_LIMIT}, default 100)', required=False, location='args')
+list_parser.add_argument('offset', type=inputs.natural, help='Members to skip', required=False, location='args')
+
+# Parser for the streamed export (GET /export) - query parameters only
+export_parser = reqparse.RequestParser()
+export_parser.add_argument('format', type=str, choices=('jsonl', 'csv'), default='jsonl', help='Output format: jsonl (default) or csv', location='args')
+export_parser.add_argument('limit', type=inputs.positive, help='Maximum number of members to export', required=False, location='args')
+export_parser.add_argument('cursor', type=str, help='Resume after this member address (the last address received)', required=False, location='args')
+export_parser.add_argument('subscribed', type=inputs.boolean, help='Only export subscribed (true) or unsubscribed (false) members', required=False, location='args')
+
+# Parser for the bulk import (POST /bulk) - options come from the query string, data from the body
+bulk_import_parser = reqparse.RequestParser()
+bulk_import_parser.add_argument('format', type=str, choices=('csv', 'jsonl'), help='Upload format (default: from Content-Type or file name)', required=False, location='args')
+bulk_import_parser.add_argument('upsert', type=inputs.boolean, help='Update members that already exist (default: true)', default=True, location='args')
 
+BULK_JSONL_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines', 'application/json')
 
-# Parser for updating a subscriber (PUT) - handles form data, JSON, and query parameters
-update_subscriber_parser = reqparse.RequestParser()
-update_subscriber_parser.add_argument('name', type=str, help='Optional subscriber name', required=False, location=('json', 'form', 'args'))
-update_subscriber_parser.add_argument('subscribed', type=bool, help='Subscription status', required=False, location=('json', 'form', 'args'))
+EXPORT_CSV_FIELDS = ('address', 'name', 'subscribed', 'vars')
+
+# Address column of the last CSV row when the export broke off (the vars column holds the resume cursor)
+EXPORT_CSV_ERROR_MARKER = '#error'
+
+
+def _export_jsonl(members):
+    """Yields one JSON document per line for each member."""
+    import requests
+    last_address = None
+    try:
+        for member in members:
+            last_address = member.get('address')
+            yield json.dumps(member, separators=(',', ':')) + '\n'
+    except (requests.exceptions.RequestException, MailgunUnavailable) as e:
+        # Headers are already sent, so report the failure in-band with a resume cursor
+        log.error("Mailgun API error during export after %s: %s", last_address, e)
+        yield json.dumps({"error": f"Error fetching members: {e}", "cursor": last_address}) + '\n'
+
+
+def _export_csv(members):
+    """Yields CSV rows, buffering one Mailgun page worth of rows per chunk."""
+    import requests
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_FIELDS)
+    last_address = None
+    try:
+        for count, member in enumerate(members, start=1):
+            last_address = member.get('address')
+            writer.writerow((
+                member.get('address', ''),
+                member.get('name', ''),
+                str(member.get('subscribed', '')).lower(),
+                json.dumps(member.get('vars') or {}, separators=(',', ':')),
+            ))
+            if count % 100 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    except (requests.exceptions.RequestException, MailgunUnavailable) as e:
+        # Headers are already sent: end with a marker row carrying the error and a resume cursor
+        log.error("Mailgun API error during CSV export after %s: %s", last_address, e)
+        writer.writerow((
+            EXPORT_CSV_ERROR_MARKER,
+            f"Error fetching members: {e}",
+            '',
+            json.dumps({"cursor": last_address}, separators=(',', ':')),
+        ))
+    yield buffer.getvalue()
 
 
 @api.route('/')
@@ -42,26 +128,55 @@ class SubscriberList(Resource):
     """Shows a list of all subscribers, and lets you POST to add new subscribers."""
 
     @api.doc('list_subscribers')
+    @api.expect(list_parser)
     @api.response(200, 'Success')
     @api.response(500, 'Mailgun API Error')
+    @api.response(501, 'Filters or pagination requested but the subscriber mirror is disabled')
+    @api.response(503, 'Filters or pagination requested but the mirror is older than max_staleness')
     def get(self):
-        """List all subscribers"""
+        """List all subscribers, or filter and page through them (from the mirror)"""
+        args = list_parser.parse_args()
         log.info("Received request to list subscribers")
+        filters = {name: args[name] for name in mirror.FILTERS if args[name] is not None}
+        if filters or args['limit'] is not None or args['offset'] is not None:
+            return write_coalescer.apply_pending(
+                *mirror.query_members(filters, args['limit'] or 100, args['offset'] or 0, args['max_staleness']))
+        served = mirror.read_list(args['source'], args['max_staleness'])
+        if served is not None:
+            return write_coalescer.apply_pending(*served)
         result, status_code = mailgun_service.get_list_members()
-        return result, status_code
+        return write_coalescer.apply_pending(result, status_code)
 
     # Removed security requirement documentation and decorator for POST
     @api.doc('create_subscriber')
     @api.expect(subscriber_parser)
     @api.response(200, 'Subscriber added or updated successfully', message_model)
+    @api.response(202, 'Request queued (queued-write mode); poll status_url for the outcome')
     @api.response(400, 'Input validation error')
     # Removed 401 response as signature is no longer checked here
     @api.response(500, 'Mailgun API Error')
     # REMOVED: @signature_required('subscribe-add') # Apply decorator with action identifier
     def post(self):
         """Create a new subscriber (or update if upsert=true)"""
-        args = subscriber_parser.parse_args()
-        log.info(f"Received request to add/update subscriber: {args['address']}")
+        try:
+            args = payloads.subscriber_payload.parse_request()
+        except payloads.ValidationError as e:
+            return e.to_response(), 400
+        log.info("Received request to add/update subscriber: %s", args['address'])
+        # A coalesced update still pending for this address must reach Mailgun first
+        write_coalescer.flush_pending(args['address'])
+
+        # Queued mode: persist the write and let the background dispatcher deliver it
+        if write_queue.get_dispatcher() is not None:
+            job_id = write_queue.enqueue_add(
+                email=args['address'],
+                name=args.get('name'),
+                subscribed=args['subscribed'],
+                upsert=args['upsert']
+            )
+            log.info("Queued add/update for %s as job %s", args['address'], job_id)
+            status_url = url_for('api.jobs_job', job_id=job_id)
+            return {"message": "Subscription request accepted.", "job_id": job_id, "status_url": status_url}, 202, {'Location': status_url}
 
         # Add error handling here to ensure we always return proper JSON
         try:
@@ -72,11 +187,115 @@ class SubscriberList(Resource):
                 upsert=args['upsert']
             )
             return result, status_code
+        except MailgunUnavailable:
+            raise  # Handled by the API error handler (503 + Retry-After)
         except Exception as e:
-            log.error(f"Error processing subscriber request: {e}")
+            log.error("Error processing subscriber request: %s", e)
             return {"message": f"Server error: {str(e)}"}, 500
 
 
+@api.route('/count')
+class SubscriberCount(Resource):
+    """Counts subscribers, optionally filtered, from the local mirror."""
+
+    @api.doc('count_subscribers')
+    @api.expect(count_parser)
+    @api.response(200, 'Success')
+    @api.response(501, 'The subscriber mirror is disabled')
+    @api.response(503, 'The mirror is older than max_staleness or has not synced yet')
+    def get(self):
+        """Count subscribers matching the filters"""
+        args = count_parser.parse_args()
+        filters = {name: args[name] for name in mirror.FILTERS if args[name] is not None}
+        log.info("Received request to count subscribers: %s", filters)
+        return mirror.count_members(filters, args['max_staleness'])
+
+
+@api.route('/export')
+class SubscriberExport(Resource):
+    """Streams the whole list, page by page, in constant memory."""
+
+    @api.doc('export_subscribers')
+    @api.expect(export_parser)
+    @api.response(200, 'Streamed list of subscribers (JSON lines or CSV)')
+    @api.response(400, 'Input validation error')
+    @api.response(500, 'Mailgun API Error')
+    def get(self):
+        """Export subscribers as a stream of JSON lines or CSV"""
+        import requests
+        args = export_parser.parse_args()
+        log.info("Received request to export subscribers (format=%s, limit=%s, cursor=%s)",
+                 args['format'], args['limit'], args['cursor'])
+
+        members = mailgun_service.iter_list_members(
+            limit=args['limit'],
+            cursor=args['cursor'],
+            subscribed=args['subscribed']
+        )
+        # Fetch the first page before committing to a 200 so upstream errors get a proper status
+        try:
+            first = next(members, None)
+        except requests.exceptions.RequestException as e:
+            log.error("Mailgun API error (export): %s", e)
+            return {"message": f"Error fetching members: {e}"}, getattr(e.response, 'status_code', 500)
+        if first is not None:
+            members = itertools.chain((first,), members)
+
+        if args['format'] == 'csv':
+            body, mimetype, filename = _export_csv(members), 'text/csv', 'subscribers.csv'
+        else:
+            body, mimetype, filename = _export_jsonl(members), 'application/x-ndjson', 'subscribers.jsonl'
+        return Response(stream_with_context(body), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no',  # Don't let a reverse proxy buffer the whole export
+        })
+
+
+@api.route('/bulk')
+class SubscriberBulkImport(Resource):
+    """Imports many subscribers at once through Mailgun's members.json batch API."""
+
+    @api.doc('bulk_import_subscribers', security='apiKey', params={
+            'X-Timestamp': {'in': 'header', 'description': 'Request timestamp (Unix epoch seconds)', 'required': True},
+            'X-Signature': {'in': 'header', 'description': 'HMAC-SHA256 signature of (timestamp + "subscribe-bulk")', 'required': True}
+    })
+    @api.expect(bulk_import_parser)
+    @api.response(200, 'Streamed import progress (JSON lines, one event per chunk plus a summary)')
+    @api.response(400, 'No upload data or unknown format')
+    @api.response(401, 'Authentication Error (timestamp/signature invalid)')
+    @signature_required('subscribe-bulk')
+    def post(self):
+        """Bulk import subscribers from a CSV or JSON-lines upload"""
+        args = bulk_import_parser.parse_args()
+
+        # Either a multipart upload (field 'file') or the raw request body
+        upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+        if upload is not None:
+            stream, filename, mimetype = upload.stream, upload.filename or '', upload.mimetype
+        else:
+            stream, filename, mimetype = request.stream, '', request.mimetype
+
+        upload_format = args['format']
+        if upload_format is None:
+            if mimetype in BULK_JSONL_MIMETYPES or filename.endswith(('.jsonl', '.ndjson')):
+                upload_format = 'jsonl'
+            elif mimetype in ('text/csv', 'text/plain') or filename.endswith('.csv'):
+                upload_format = 'csv'
+            else:
+                return {"message": "Unknown upload format. Use ?format=csv or ?format=jsonl."}, 400
+        if upload is None and not request.content_length and not request.headers.get('Transfer-Encoding'):
+            return {"message": "No upload data provided."}, 400
+
+        log.info("Received bulk import request (format=%s, upsert=%s)", upload_format, args['upsert'])
+        text = bulk_import.open_text_stream(stream)
+        records = bulk_import.parse_jsonl(text) if upload_format == 'jsonl' else bulk_import.parse_csv(text)
+        events = bulk_import.run_import(records, upsert=args['upsert'])
+        body = (json.dumps(event) + '\n' for event in events)
+        return Response(stream_with_context(body), mimetype='application/x-ndjson', headers={
+            'X-Accel-Buffering': 'no',
+        })
+
+
 @api.route('/<string:member_address>')
 @api.param('member_address', 'The email address of the subscriber')
 @api.response(404, 'Subscriber not found', message_model)
@@ -85,12 +304,17 @@ class Subscriber(Resource):
     """Show a single subscriber item and lets you update or delete them"""
 
     @api.doc('get_subscriber')
+    @api.expect(read_parser)
     @api.response(200, 'Success')
     def get(self, member_address):
         """Fetch a specific subscriber"""
-        log.info(f"Received request to get subscriber: {member_address}")
+        args = read_parser.parse_args()
+        log.info("Received request to get subscriber: %s", member_address)
+        served = mirror.read_member(member_address, args['source'], args['max_staleness'])
+        if served is not None:
+            return write_coalescer.apply_pending(*served)
         result, status_code = mailgun_service.get_member(member_address)
-        return result, status_code
+        return write_coalescer.apply_pending(result, status_code)
 
     @api.doc('update_subscriber', security='apiKey', params={
             'X-Timestamp': {'in': 'header', 'description': 'Request timestamp (Unix epoch seconds)', 'required': True},
@@ -98,19 +322,28 @@ class Subscriber(Resource):
     })
     @api.expect(update_subscriber_parser)
     @api.response(200, 'Subscriber updated successfully', message_model)
+    @api.response(202, 'Update accepted (write-coalescing mode); sent to Mailgun merged with other updates')
     @api.response(400, 'Input validation error or no data provided')
     @api.response(401, 'Authentication Error (timestamp/signature invalid)')
     @signature_required('subscribe-update') # Apply decorator with action identifier
     def put(self, member_address):
         """Update a subscriber"""
-        args = update_subscriber_parser.parse_args()
-        log.info(f"Received request to update subscriber: {member_address}")
-        # Filter out None values so we only send provided fields
-        update_data = {k: v for k, v in args.items() if v is not None}
+        try:
+            # Only the provided fields (null counts as not provided)
+            update_data = payloads.update_subscriber_payload.parse_request()
+        except payloads.ValidationError as e:
+            return e.to_response(), 400
+        log.info("Received request to update subscriber: %s", member_address)
 
         if not update_data:
              return {"message": "No update data provided. Provide 'name' or 'subscribed'."}, 400
 
+        # Coalescing mode: merge with other updates to this address and send them as one PUT shortly
+        coalescer = write_coalescer.get_coalescer()
+        if coalescer is not None:
+            pending = coalescer.submit(member_address, update_data)
+            return {"message": "Update accepted.", "member": {"address": member_address, **pending}}, 202
+
         result, status_code = mailgun_service.update_member(
             member_address=member_address,
             **update_data # Pass filtered args
@@ -126,6 +359,7 @@ class Subscriber(Resource):
     @signature_required('subscribe-delete') # Apply decorator with action identifier
     def delete(self, member_address):
         """Delete a subscriber"""
-        log.info(f"Received request to delete subscriber: {member_address}")
+        log.info("Received request to delete subscriber: %s", member_address)
+        write_coalescer.flush_pending(member_address)
         result, status_code = mailgun_service.delete_member(member_address)
         return result, status_code
@@ -0,0 +1,186 @@
+import re
+from flask import request
+from flask_restx import reqparse
+
+# Where the subscriber write endpoints accept their fields, highest priority first (like the reqparse
+# locations they replace): a JSON object body, a form body, the query string
+LOCATIONS = ('json', 'form', 'args')
+
+TRUE_VALUES = frozenset(('1', 'true', 'yes', 'on', 'y'))
+FALSE_VALUES = frozenset(('0', 'false', 'no', 'off', 'n'))
+
+# A practical address check (not full RFC 5322): dot-separated local part without spaces or
+# specials, and a domain of at least two valid labels; Mailgun has the final word
+EMAIL_PATTERN = re.compile(
+    r"[^\s@\"(),:;<>\[\]\\.]+(?:\.[^\s@\"(),:;<>\[\]\\.]+)*"
+    r"@(?:[^\W_](?:[\w-]{0,61}[^\W_])?\.)+[^\W\d_][\w-]*[^\W_]"
+)
+EMAIL_MAX_LENGTH = 254
+EMAIL_LOCAL_MAX_LENGTH = 64
+
+MISSING_MESSAGE = "Missing required parameter in the JSON body, the post body or the query string"
+
+
+class ValidationError(ValueError):
+    """A payload failed validation; `errors` maps each offending field to a message."""
+
+    def __init__(self, errors):
+        super().__init__("Input payload validation failed")
+        self.errors = errors
+
+    def to_response(self):
+        """The flask-restx validation error body (message + errors) for a 400."""
+        return {"message": str(self), "errors": self.errors}
+
+
+def boolean(value):
+    """Strict boolean: JSON true/false, or 1/0, true/false, yes/no, on/off, y/n in any case."""
+    if value is True or value is False:
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"'{value}' is not a valid boolean (use true or false)")
+
+
+boolean.__schema__ = {'type': 'boolean'}
+
+
+def email(value):
+    """An email address, surrounding whitespace removed."""
+    if not isinstance(value, str):
+        raise ValueError("must be a string")
+    address = value.strip()
+    if not address:
+        raise ValueError("Email address cannot be blank")
+    if (len(address) > EMAIL_MAX_LENGTH or EMAIL_PATTERN.fullmatch(address) is None
+            or address.index('@') > EMAIL_LOCAL_MAX_LENGTH):
+        raise ValueError(f"'{address}' is not a valid email address")
+    return address
+
+
+email.__schema__ = {'type': 'string', 'format': 'email'}
+
+
+def string(value):
+    if not isinstance(value, str):
+        raise ValueError("must be a string")
+    return value
+
+
+string.__schema__ = {'type': 'string'}
+
+
+def names(value):
+    """A list of names: a JSON array of strings or a comma-separated string (blanks and repeats dropped)."""
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError("must be an array of names or a comma-separated string")
+    items = list(dict.fromkeys(item.strip() for item in value if item.strip()))
+    if not items:
+        raise ValueError("At least one name is required")
+    return items
+
+
+names.__schema__ = {'type': 'string'}
+
+
+class Field:
+    __slots__ = ('name', 'convert', 'required', 'default', 'help')
+
+    def __init__(self, name, convert, required=False, default=None, help=None):
+        self.name = name
+        self.convert = convert
+        self.required = required
+        self.default = default
+        self.help = help
+
+
+class PayloadSchema:
+    """
+    A fixed set of fields, compiled once at import.
+
+    `parse` walks each source mapping once, converting only the keys the schema
+    knows (the first source that has a key wins; null counts as absent), then
+    fills in defaults and checks required fields. It collects every field's
+    error and raises one ValidationError. Unknown keys are ignored.
+    """
+
+    def __init__(self, *fields):
+        self.fields = {field.name: field for field in fields}
+        self.defaults = {field.name: field.default for field in fields if field.default is not None}
+        self.required = tuple(field.name for field in fields if field.required)
+
+    def parse(self, *sources):
+        """Returns the converted fields (plus defaults) from the sources, highest priority first."""
+        fields = self.fields
+        values = self.defaults.copy()
+        seen = set()
+        errors = None
+        for source in sources:
+            if not source:
+                continue
+            for key, raw in source.items():
+                field = fields.get(key)
+                if field is None or raw is None or key in seen:
+                    continue
+                seen.add(key)
+                try:
+                    values[key] = field.convert(raw)
+                except ValueError as e:
+                    if errors is None:
+                        errors = {}
+                    errors[key] = str(e)
+        for name in self.required:
+            if name not in seen:
+                if errors is None:
+                    errors = {}
+                errors[name] = MISSING_MESSAGE
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+    def parse_request(self, req=None):
+        """Parses the Flask request: JSON object body, else form body, then the query string."""
+        req = req or request
+        if req.is_json:
+            body = req.get_json(silent=True)
+            if body is not None and not isinstance(body, dict):
+                raise ValidationError({"body": "JSON body must be an object"})
+            return self.parse(body, req.args)
+        return self.parse(req.form, req.args)
+
+    def as_parser(self):
+        """A reqparse parser with the same fields, for the Swagger docs (@api.expect); not used to parse."""
+        parser = reqparse.RequestParser()
+        for field in self.fields.values():
+            parser.add_argument(field.name, type=field.convert, required=field.required, default=field.default,
+                                help=field.help, location=LOCATIONS)
+        return parser
+
+
+# POST /mail/subscribers/
+subscriber_payload = PayloadSchema(
+    Field('address', email, required=True, help='Email address of the subscriber'),
+    Field('name', string, help='Optional subscriber name'),
+    Field('subscribed', boolean, default=True, help='Subscription status (default: true)'),
+    Field('upsert', boolean, default=True, help='Update if exists (default: true)'),
+)
+
+# PUT /mail/subscribers/<address>
+update_subscriber_payload = PayloadSchema(
+    Field('name', string, help='Optional subscriber name'),
+    Field('subscribed', boolean, help='Subscription status'),
+)
+
+# POST /mail/subscriptions
+subscriptions_payload = PayloadSchema(
+    Field('address', email, required=True, help='Email address of the subscriber'),
+    Field('lists', names, required=True, help='Lists to add it to (names or addresses), comma-separated or a JSON array'),
+    Field('name', string, help='Optional subscriber name'),
+    Field('subscribed', boolean, default=True, help='Subscription status (default: true)'),
+    Field('upsert', boolean, default=True, help='Update if exists (default: true)'),
+)
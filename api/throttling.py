@@ -0,0 +1,232 @@
+import json
+import math
+import time
+import threading
+import logging
+from collections import OrderedDict
+from flask import current_app, request, g, jsonify
+
+log = logging.getLogger(__name__)
+
+# Key used to store the throttler on the Flask app (app.extensions)
+EXTENSION_KEY = 'api_throttler'
+
+# Route limit value that exempts a route from throttling (including the global limit)
+UNLIMITED = 'unlimited'
+
+
+def parse_limit(value):
+    """Parses '<requests>/<seconds>' (e.g. '10/60') into (limit, window); 'unlimited' gives None."""
+    if str(value).strip().lower() == UNLIMITED:
+        return None
+    count, _, window = str(value).partition('/')
+    return int(count), float(window or 60)
+
+
+class MemoryStore:
+    """
+    Per-process sliding-window counters.
+
+    Uses the two-window approximation: the previous fixed window's count is
+    weighted by how much of it still overlaps the sliding window. Each key costs
+    three numbers; past `max_keys`, the least recently seen keys are dropped, so
+    active clients keep their counts. Rejected requests are not counted.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now):
+        """Counts a request; returns (allowed, estimated_count)."""
+        index = int(now // window)
+        weight = 1 - (now - index * window) / window
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < index - 1:
+                previous, current = 0, 0
+            elif entry[0] == index - 1:
+                previous, current = entry[2], 0
+            else:
+                previous, current = entry[1], entry[2]
+            count = previous * weight + current
+            allowed = count + 1 <= limit
+            if allowed:
+                current += 1
+                count += 1
+            self._data[key] = (index, previous, current)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+        return allowed, count
+
+
+class RedisStore:
+    """
+    Shared sliding-window counters for all workers and hosts.
+
+    Only `incr`, `decr`, `expire` and `get` are used, so any Redis-compatible
+    client (or a local stand-in in tests) works as `client`. Like MemoryStore,
+    rejected requests are not counted: their increment is taken back.
+    """
+
+    def __init__(self, client, prefix='ephergent:rl:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("The 'redis' package is required for API_RATE_LIMIT_REDIS_URL") from e
+        return cls(redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2))
+
+    def hit(self, key, limit, window, now):
+        index = int(now // window)
+        weight = 1 - (now - index * window) / window
+        current_key = f"{self.prefix}{key}:{index}"
+        current = self.client.incr(current_key)
+        if current == 1:
+            self.client.expire(current_key, int(window * 2) + 1)
+        previous = int(self.client.get(f"{self.prefix}{key}:{index - 1}") or 0)
+        count = previous * weight + current
+        if count > limit:
+            self.client.decr(current_key)
+            return False, count - 1
+        return True, count
+
+
+class Throttler:
+    """Applies a per-IP limit across the API plus a per-IP limit for each route."""
+
+    def __init__(self, store, default_limit, global_limit=None, route_limits=None, trust_proxy=False):
+        self.store = store
+        self.default_limit = default_limit
+        self.global_limit = global_limit
+        self.route_limits = route_limits or {}
+        self.trust_proxy = trust_proxy
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the throttler from a Flask config mapping."""
+        redis_url = config.get('API_RATE_LIMIT_REDIS_URL')
+        store = RedisStore.from_url(redis_url) if redis_url else MemoryStore()
+        route_limits = config.get('API_RATE_LIMITS') or {}
+        if isinstance(route_limits, str):
+            route_limits = json.loads(route_limits)
+        global_limit = config.get('API_RATE_LIMIT_GLOBAL')
+        return cls(
+            store,
+            default_limit=parse_limit(config.get('API_RATE_LIMIT_DEFAULT', '120/60')),
+            global_limit=parse_limit(global_limit) if global_limit else None,
+            route_limits={route: parse_limit(limit) for route, limit in route_limits.items()},
+            trust_proxy=config.get('API_RATE_LIMIT_TRUST_PROXY', False),
+        )
+
+    def client_ip(self):
+        if self.trust_proxy and request.access_route:
+            return request.access_route[0]
+        return request.remote_addr or 'unknown'
+
+    def limit_for(self, route):
+        return self.route_limits.get(route, self.default_limit)
+
+    def check(self, ip, route, now):
+        """
+        Counts the request against every applicable limit.
+
+        Returns (allowed, headers) where headers describe the most restrictive limit.
+        """
+        route_limit = self.limit_for(route)
+        if route_limit is None:
+            return True, {}
+        checks = [(f"{ip}|{route}", route_limit)]
+        if self.global_limit:
+            checks.append((ip, self.global_limit))
+        allowed, tightest = True, None
+        for key, (limit, window) in checks:
+            ok, count = self.store.hit(key, limit, window, now)
+            remaining = max(0, int(limit - count))
+            reset = math.ceil(window - (now % window))
+            if tightest is None or remaining < tightest[1]:
+                tightest = (limit, remaining, reset, window)
+            if not ok:
+                allowed = False
+                break
+        limit, remaining, reset, window = tightest
+        headers = {
+            'RateLimit-Limit': str(limit),
+            'RateLimit-Remaining': str(remaining),
+            'RateLimit-Reset': str(reset),
+            'RateLimit-Policy': f"{limit};w={int(window)}",
+        }
+        if not allowed:
+            self.rejected += 1
+            headers['Retry-After'] = str(reset)
+        return allowed, headers
+
+
+def get_throttler():
+    """Returns the throttler for the current app (built on first use), or None when disabled."""
+    app = current_app._get_current_object()
+    if EXTENSION_KEY not in app.extensions:
+        throttler = None
+        if app.config.get('API_RATE_LIMIT_ENABLED', True):
+            throttler = Throttler.from_config(app.config)
+        app.extensions[EXTENSION_KEY] = throttler
+    return app.extensions[EXTENSION_KEY]
+
+
+def throttle_request():
+    """Blueprint before_request hook: rejects over-limit clients before any view code runs."""
+    if request.method == 'OPTIONS' or request.url_rule is None:
+        return None
+    throttler = get_throttler()
+    if throttler is None:
+        return None
+    # Route key relative to the blueprint prefix, e.g. "POST /mail/subscribers/"
+    route = f"{request.method} {route_path()}"
+    try:
+        allowed, headers = throttler.check(throttler.client_ip(), route, time.time())
+    except Exception as e:
+        # Fail open: a broken shared store must not take the API down
+        log.warning("Rate limit check failed, allowing request: %s", e)
+        return None
+    g.rate_limit_headers = headers
+    if not allowed:
+        log.warning("Rate limit exceeded for %s on %s", throttler.client_ip(), route)
+        response = jsonify({"message": "Too many requests, slow down."})
+        response.status_code = 429
+        response.headers.update(headers)
+        return response
+    return None
+
+
+def add_rate_limit_headers(response):
+    """Blueprint after_request hook: adds RateLimit-* headers to allowed responses."""
+    headers = g.pop('rate_limit_headers', None)
+    if headers and response.status_code != 429:
+        response.headers.update(headers)
+    return response
+
+
+_route_paths = {}
+
+
+def route_path():
+    """Returns the matched URL rule without the blueprint prefix (memoized per rule)."""
+    rule = request.url_rule.rule
+    path = _route_paths.get(rule)
+    if path is None:
+        prefix = current_app.blueprints[request.blueprint].url_prefix or ''
+        path = _route_paths[rule] = rule[len(prefix):] if rule.startswith(prefix) else rule
+    return path
+
+
+def init_blueprint(blueprint):
+    """Registers the throttling hooks on the API blueprint."""
+    blueprint.before_request(throttle_request)
+    blueprint.after_request(add_rate_limit_headers)
@@ -0,0 +1,58 @@
+from flask import current_app, request
+from flask_restx import Namespace, Resource
+import logging
+from auth.decorators import check_webhook_signature
+from services import webhooks
+from services.metrics import get_metrics
+
+# Setup logging
+log = logging.getLogger(__name__)
+
+api = Namespace('webhooks', description='Mailgun event webhooks (unsubscribes pushed by Mailgun)')
+
+# Seconds Mailgun is asked to wait when the event buffer is full (it retries non-2xx deliveries)
+RETRY_AFTER = '5'
+
+
+@api.route('/mailgun')
+class MailgunWebhook(Resource):
+    """Receives signed Mailgun events and queues the ones that change local subscriber state."""
+
+    @api.doc('mailgun_webhook')
+    @api.response(200, 'Event accepted (applied shortly) or ignored')
+    @api.response(400, "Not a Mailgun webhook body ('signature' and 'event-data' objects)")
+    @api.response(401, 'Invalid, expired or replayed signature')
+    @api.response(501, 'Webhooks are disabled')
+    @api.response(503, 'Event buffer or replay cache full; Mailgun retries later')
+    def post(self):
+        """Receive a Mailgun webhook event"""
+        processor = webhooks.get_processor()
+        if processor is None:
+            return {"message": "Webhooks are disabled (WEBHOOKS_ENABLED=false)"}, 501
+        payload = request.get_json(silent=True)
+        if (not isinstance(payload, dict) or not isinstance(payload.get('signature'), dict)
+                or not isinstance(payload.get('event-data'), dict)):
+            return {"message": "Expected a Mailgun webhook JSON body with 'signature' and 'event-data'"}, 400
+
+        signature = payload['signature']
+        result, message, status_code = check_webhook_signature(
+            current_app.config['MAILGUN_WEBHOOK_SIGNING_KEY'],
+            signature.get('timestamp'),
+            signature.get('token'),
+            signature.get('signature'),
+            replay_cache=processor.replay_cache,
+        )
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.auth_checks.inc('mailgun-webhook', 'signature', result)
+        if result != 'ok':
+            return {"message": message}, status_code
+
+        outcome = processor.accept(payload['event-data'])
+        if outcome == webhooks.FULL:
+            log.warning("Webhook event buffer full; asking Mailgun to retry.")
+            if processor.replay_cache is not None:
+                # Mailgun's retry carries the same token; it must not be refused as a replay
+                processor.replay_cache.discard(int(signature['timestamp']), signature['token'])
+            return {"message": "Event buffer full, retry later."}, 503, {'Retry-After': RETRY_AFTER}
+        return {"message": "Event accepted." if outcome == webhooks.QUEUED else "Event ignored."}, 200
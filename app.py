@@ -1,26 +1,48 @@
 import os
 from flask import Flask, render_template, current_app, redirect, url_for # Added redirect, url_for
 import os
-import time
-import hmac
-import hashlib
-from flask import Flask, render_template, current_app
+from flask import Flask, render_template, make_response
 from flask_cors import CORS
-from config import config_by_name
+from dotenv import load_dotenv
 from api import blueprint as api_blueprint # This now imports the blueprint from api/__init__.py
-import logging
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+from services import mailgun_client, cache, write_queue, metrics, log_pipeline, mirror, single_flight, write_coalescer, webhooks, mail_lists
 
 def create_app(config_name=None):
     """Create and configure an instance of the Flask application."""
+    # Load environment variables from a .env file (existing variables win), then the settings read from them.
+    # Done here rather than at import so importing the app has no side effects and fails on nothing.
+    load_dotenv()
+    from config import config_by_name
+
     if config_name is None:
         config_name = os.getenv('FLASK_CONFIG', 'dev') # Default to 'dev' if not set
 
     app = Flask(__name__)
     CORS(app, resources={r"/api/*": {"origins": "https://ephergent.com"}})
-    app.config.from_object(config_by_name[config_name])
+    config_class = config_by_name[config_name]
+    config_class.validate()
+    app.config.from_object(config_class)
+
+    # Logging: records go through a bounded queue to a writer thread (JSON lines, sampled)
+    log_pipeline.init_app(app)
+    # Prometheus-style metrics at /metrics, aggregated over worker processes (METRICS_ENABLED)
+    metrics.init_app(app)
+    # Lists served besides MAILGUN_LIST_ADDRESS (MAILGUN_LISTS) and the pool for fan-out calls across them
+    mail_lists.init_app(app)
+    # Create the app-scoped, pooled Mailgun HTTP client (one pool per worker process)
+    mailgun_client.init_app(app)
+    # Read-through cache for member/list lookups (in-process LRU, optional shared backend)
+    cache.init_app(app)
+    # Concurrent identical reads share one Mailgun call (MAILGUN_COALESCE_READS)
+    single_flight.init_app(app)
+    # Optional durable queue for POST /subscribers (WRITE_QUEUE_ENABLED)
+    write_queue.init_app(app)
+    # Optional local SQLite copy of the list for fast GETs (MIRROR_ENABLED)
+    mirror.init_app(app)
+    # Optional merging of rapid PUTs to the same address into one Mailgun update (WRITE_COALESCE_ENABLED)
+    write_coalescer.init_app(app)
+    # Optional Mailgun webhook receiver: events buffered and applied in batches (WEBHOOKS_ENABLED)
+    webhooks.init_app(app)
 
     # Register blueprints
     app.register_blueprint(api_blueprint)
@@ -33,38 +55,24 @@ def create_app(config_name=None):
 
     @app.route('/subscribe-example')
     def subscribe_example():
-        """Serves the example HTML form with pre-calculated signature data."""
-        # Generate timestamp and signature for the example form
-        # This mimics what Pelican would do during its build process
-        api_secret = current_app.config.get('API_SECRET')
-        # Ensure the action identifier matches the one used in the decorator for the POST endpoint
-        # In api/mail_list.py, the POST endpoint uses 'subscribe-add'
-        action_identifier = 'subscribe-add'
-        timestamp = str(int(time.time()))
-        signature = "ERROR_API_SECRET_NOT_SET" # Default in case secret is missing
-
-        if api_secret:
-            message = timestamp.encode('utf-8') + action_identifier.encode('utf-8')
-            try:
-                hash_obj = hmac.new(api_secret.encode('utf-8'), message, hashlib.sha256)
-                signature = hash_obj.hexdigest()
-                app.logger.debug(f"Generated signature for example form: {signature} (ts: {timestamp}, action: {action_identifier})")
-            except Exception as e:
-                app.logger.error(f"Error calculating HMAC for example form: {e}")
-                signature = "ERROR_CALCULATING_SIGNATURE"
-        else:
-             app.logger.warning("API_SECRET not found, cannot generate signature for example form.")
-
-        # Pass data to the template
-        return render_template('subscribe_form.html',
-                               api_timestamp=timestamp,
-                               api_signature=signature,
-                               api_action=action_identifier) # Pass action identifier too
+        """Serves the example HTML form; it fetches a signed token from /api/v1/auth/token on submit."""
+        # The page no longer carries a signature, so it is rendered once and served from memory
+        html = app.extensions.get('subscribe_form_html')
+        if html is None:
+            # Ensure the action identifier matches the one used in the decorator for the POST endpoint
+            # In api/mail_list.py, the POST endpoint uses 'subscribe-add'
+            html = render_template('subscribe_form.html',
+                                   api_token_url=url_for('api.auth_token'),
+                                   api_action='subscribe-add')
+            app.extensions['subscribe_form_html'] = html
+        response = make_response(html)
+        response.headers['Cache-Control'] = f"public, max-age={app.config.get('SUBSCRIBE_FORM_MAX_AGE', 3600)}"
+        return response
 
     # Log the configuration being used
-    app.logger.info(f"App created with configuration: {config_name}")
-    app.logger.info(f"Mailgun List Address: {app.config.get('MAILGUN_LIST_ADDRESS')}")
-    app.logger.info(f"Debug mode: {app.config.get('DEBUG')}")
+    app.logger.info("App created with configuration: %s", config_name)
+    app.logger.info("Mailgun List Address: %s", app.config.get('MAILGUN_LIST_ADDRESS'))
+    app.logger.info("Debug mode: %s", app.config.get('DEBUG'))
 
 
     return app
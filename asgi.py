@@ -0,0 +1,6 @@
+# ASGI entry point for the async serving mode, e.g.:
+#   uvicorn asgi:app --host 0.0.0.0 --port 8000
+# Uses FLASK_CONFIG like the WSGI app; see "Async Serving Mode" in README.md.
+from async_api import create_asgi_app
+
+app = create_asgi_app()
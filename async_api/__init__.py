@@ -0,0 +1,135 @@
+import math
+import time
+import logging
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from app import create_app
+from api import http_cache
+from api.throttling import get_throttler
+from auth.decorators import get_replay_cache
+from auth.tokens import get_minter
+from services import mailgun_client, cache, metrics, mirror, single_flight, write_coalescer, write_queue, webhooks
+from services.async_mailgun_client import AsyncMailgunClient
+from services.async_mailgun_service import AsyncMailgunService
+from services.errors import MailgunUnavailable
+
+# Import endpoints
+from .mail_list import SubscriberList, SubscriberCount, Subscriber
+from .health import Health
+
+log = logging.getLogger(__name__)
+
+# Mirrors the WSGI blueprint prefix and namespace paths (api/__init__.py)
+API_PREFIX = '/api/v1'
+SUBSCRIBERS_PATH = f'{API_PREFIX}/mail/subscribers'
+
+
+async def upstream_unavailable_handler(request, error):
+    """503 + Retry-After for Mailgun calls refused locally (open breaker, rate limit)."""
+    log.warning("Mailgun unavailable: %s", error.message)
+    headers = {}
+    if error.retry_after is not None:
+        headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return JSONResponse({"message": error.message}, 503, headers=headers)
+
+
+class Instrumented:
+    """
+    Wraps an async endpoint to record the same request metrics as the Flask hooks
+    (services.metrics), labelled with the Flask rule the endpoint mirrors.
+    """
+
+    def __init__(self, endpoint, route):
+        self.endpoint = endpoint
+        self.route = route
+
+    async def __call__(self, scope, receive, send):
+        registry = scope['app'].state.metrics
+        if registry is None:
+            return await self.endpoint(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        registry.http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.endpoint(scope, receive, send_with_status)
+        except MailgunUnavailable:
+            status = 503  # Answered by upstream_unavailable_handler
+            raise
+        finally:
+            registry.http_requests_in_flight.dec()
+            registry.observe_request(scope['method'], self.route, status, time.perf_counter() - start)
+
+
+def create_asgi_app(config_name=None):
+    """
+    Create the ASGI application (async serving mode).
+
+    The subscriber read/write endpoints and the health check run as async
+    handlers on an aiohttp connection pool; every other route (export, bulk
+    import, jobs, tokens, webhooks, Swagger UI, the example form) is served by
+    the regular Flask app mounted underneath. Both share config, the subscriber cache,
+    circuit breakers, retry budget, rate limits, auth state and metrics.
+    """
+    flask_app = create_app(config_name)
+    sync_client = flask_app.extensions[mailgun_client.EXTENSION_KEY]
+    client = AsyncMailgunClient.from_config(
+        flask_app.config,
+        resilience=sync_client.resilience,
+        rate_limiter=sync_client.rate_limiter,
+        metrics=sync_client.metrics,
+    )
+    with flask_app.app_context():
+        throttler = get_throttler()
+        token_minter = get_minter()
+        replay_cache = get_replay_cache()
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await client.aclose()
+
+    wsgi = WSGIMiddleware(flask_app)
+    routes = [
+        # Static paths first: Starlette tries routes in order, unlike Werkzeug's rule ranking
+        Route(f'{SUBSCRIBERS_PATH}/export', wsgi),
+        Route(f'{SUBSCRIBERS_PATH}/bulk', wsgi),
+        Route(f'{SUBSCRIBERS_PATH}/count', Instrumented(SubscriberCount, f'{SUBSCRIBERS_PATH}/count')),
+        Route(f'{SUBSCRIBERS_PATH}/', Instrumented(SubscriberList, f'{SUBSCRIBERS_PATH}/')),
+        Route(f'{SUBSCRIBERS_PATH}/{{member_address}}',
+              Instrumented(Subscriber, f'{SUBSCRIBERS_PATH}/<string:member_address>')),
+        Route(f'{API_PREFIX}/health/', Instrumented(Health, f'{API_PREFIX}/health/')),
+        Mount('/', app=wsgi),
+    ]
+    app = Starlette(
+        routes=routes,
+        lifespan=lifespan,
+        exception_handlers={MailgunUnavailable: upstream_unavailable_handler},
+    )
+    app.state.flask_app = flask_app
+    app.state.config = flask_app.config
+    mirror_sync = flask_app.extensions.get(mirror.EXTENSION_KEY)
+    app.state.mirror = mirror_sync.mirror if mirror_sync is not None else None
+    app.state.mailgun = AsyncMailgunService(flask_app.config, client, cache=flask_app.extensions.get(cache.EXTENSION_KEY),
+                                            mirror=app.state.mirror,
+                                            single_flight=flask_app.extensions.get(single_flight.EXTENSION_KEY))
+    app.state.write_coalescer = flask_app.extensions.get(write_coalescer.EXTENSION_KEY)
+    app.state.write_queue = flask_app.extensions.get(write_queue.EXTENSION_KEY)
+    app.state.webhooks = flask_app.extensions.get(webhooks.EXTENSION_KEY)
+    app.state.throttler = throttler
+    app.state.http_cache = flask_app.extensions.get(http_cache.EXTENSION_KEY)
+    app.state.token_minter = token_minter
+    app.state.replay_cache = replay_cache
+    app.state.metrics = flask_app.extensions.get(metrics.EXTENSION_KEY)
+
+    log.info("ASGI app created (async subscriber endpoints, WSGI fallback for other routes).")
+    return app
@@ -0,0 +1,40 @@
+import logging
+from starlette.concurrency import run_in_threadpool
+from starlette.endpoints import HTTPEndpoint
+from starlette.responses import JSONResponse
+
+# Setup logging
+log = logging.getLogger(__name__)
+
+
+class Health(HTTPEndpoint):
+    """Async GET /api/v1/health/: the WSGI health report plus the async client's pool settings."""
+
+    async def get(self, request):
+        state = request.app.state
+        client = state.mailgun.client
+        cache = state.mailgun.cache
+        http_cache = state.http_cache
+        # Same Cache-Control policy as the WSGI health route (no-store by default)
+        cache_control = http_cache.cache_control_for('GET /health/') if http_cache is not None else None
+        # The mirror (SQLite) and the shared rate-limit bucket (flock) can block: read them on a thread
+        mirror_stats = (await run_in_threadpool(state.mirror.stats, state.mailgun.list_address)
+                        if state.mirror is not None else None)
+        rate_limit = await run_in_threadpool(client.rate_limiter.snapshot) if client.rate_limiter is not None else None
+        return JSONResponse({
+            "status": "ok",
+            "mode": "asgi",
+            "cache": cache.stats() if cache is not None else None,
+            "mirror": mirror_stats,
+            "mailgun": client.resilience.snapshot(),
+            "coalescing": state.mailgun.single_flight.stats() if state.mailgun.single_flight is not None else None,
+            "write_coalescer": state.write_coalescer.stats() if state.write_coalescer is not None else None,
+            "webhooks": state.webhooks.stats() if state.webhooks is not None else None,
+            "rate_limit": rate_limit,
+            "throttling": {"rejected": state.throttler.rejected} if state.throttler is not None else None,
+            "http_cache": http_cache.stats() if http_cache is not None else None,
+            "async_pool": {
+                "max_connections": client.max_connections,
+                "keepalive_timeout": client.keepalive_timeout,
+            },
+        }, 200, headers={'Cache-Control': cache_control} if cache_control else None)
@@ -0,0 +1,320 @@
+import json
+import time
+import logging
+from functools import wraps
+from starlette.concurrency import run_in_threadpool
+from starlette.endpoints import HTTPEndpoint
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_etags
+from api import payloads
+from api.throttling import MemoryStore
+from auth.decorators import authenticate_request
+from services import mirror, write_queue
+
+# Setup logging
+log = logging.getLogger(__name__)
+
+async def _parse_payload(request, schema):
+    """Validates the JSON object or form body, then the query string, with a payloads schema (like the WSGI API)."""
+    body = None
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        raw = await request.body()
+        if raw:
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                raise payloads.ValidationError({"body": "Invalid JSON"})
+            if not isinstance(body, dict):
+                raise payloads.ValidationError({"body": "JSON body must be an object"})
+    elif content_type.startswith(('application/x-www-form-urlencoded', 'multipart/form-data')):
+        async with request.form() as form:
+            body = {key: value for key, value in form.items() if isinstance(value, str)}
+    return schema.parse(body, request.query_params)
+
+
+async def _read_from_mirror(request, serve):
+    """
+    Applies the `source` / `max_staleness` query parameters of the subscriber GETs.
+
+    `serve(bound)` reads the mirror (on a thread: SQLite may wait on another
+    worker's write); returns its (result, status_code, headers), or None when
+    Mailgun has to answer.
+    """
+    state = request.app.state
+    source = request.query_params.get('source')
+    max_staleness = request.query_params.get('max_staleness')
+    if source is not None and source not in mirror.SOURCES:
+        raise ValueError(f"source must be one of {', '.join(mirror.SOURCES)}")
+    max_staleness = float(max_staleness) if max_staleness is not None else None
+    if state.mirror is None:
+        return None
+    bound = mirror.resolve_read(state.config, source, max_staleness)
+    if bound is None:
+        return None
+    served = await run_in_threadpool(serve, bound)
+    if served is None:
+        return None
+    result, status_code, headers = served
+    return _apply_pending(state, result, status_code), status_code, headers
+
+
+def _read_filters(request):
+    """The list filters (mirror.FILTERS) and max_staleness from the query string, validated like count_parser."""
+    params = request.query_params
+    filters = {name: params[name] for name in ('domain', 'prefix', 'name') if params.get(name) is not None}
+    if params.get('subscribed') is not None:
+        filters['subscribed'] = payloads.boolean(params['subscribed'])
+    max_staleness = params.get('max_staleness')
+    return filters, float(max_staleness) if max_staleness is not None else None
+
+
+async def _serve_filtered(request, serve):
+    """Runs `serve(mirror, list_address, bound)` on a thread for a filtered read, or answers 501 when the mirror is off."""
+    state = request.app.state
+    _, max_staleness = _read_filters(request)
+    if state.mirror is None:
+        return {"message": "Filtering and counting are served from the subscriber mirror; "
+                           "it is disabled (MIRROR_ENABLED=false)"}, 501, None
+    bound = mirror.filtered_read_bound(state.config, max_staleness)
+    result, status_code, headers = await run_in_threadpool(serve, state.mirror, state.mailgun.list_address, bound)
+    return _apply_pending(state, result, status_code), status_code, headers
+
+
+def _apply_pending(state, result, status_code):
+    """Overlays this worker's coalesced, not yet sent updates on a read (write_coalescer.apply_pending)."""
+    coalescer = state.write_coalescer
+    return coalescer.overlay(result, status_code) if coalescer is not None else result
+
+
+async def _flush_pending(state, address):
+    """Sends a coalesced update still pending for the address before another write to it."""
+    coalescer = state.write_coalescer
+    if coalescer is not None and coalescer.has_pending(address):
+        await run_in_threadpool(coalescer.flush, address)
+
+
+async def _enqueue_add(state, **kwargs):
+    """
+    Queued-write mode: persists the add like the WSGI POST (write_queue.enqueue_add)
+    and returns the job id and its status URL.
+    """
+    def enqueue():
+        with state.flask_app.app_context():
+            return write_queue.enqueue_add(**kwargs)
+
+    job_id = await run_in_threadpool(enqueue)
+    status_url = state.flask_app.url_map.bind('').build('api.jobs_job', {'job_id': job_id})
+    return job_id, status_url
+
+
+def _client_ip(request, trust_proxy):
+    if trust_proxy:
+        forwarded = request.headers.get('x-forwarded-for')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else 'unknown'
+
+
+def signature_required(action_identifier):
+    """Async counterpart of auth.decorators.signature_required for HTTPEndpoint methods."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(self, request):
+            state = request.app.state
+            api_secret = state.config.get('API_SECRET')
+            if not api_secret:
+                log.error("API_SECRET not configured on the server.")
+                return JSONResponse({"message": "Authentication configuration error."}, 500)
+            ok, message, status_code = authenticate_request(
+                request.headers, action_identifier, api_secret,
+                replay_cache=state.replay_cache, minter=state.token_minter, metrics=state.metrics,
+            )
+            if not ok:
+                return JSONResponse({"message": message}, status_code)
+            return await f(self, request)
+        return decorated_function
+    return decorator
+
+
+class ThrottledEndpoint(HTTPEndpoint):
+    """
+    HTTPEndpoint that applies the API's per-client rate limits before the handler runs.
+
+    `route_key` is the WSGI rule the endpoint mirrors (relative to /api/v1), so
+    API_RATE_LIMITS entries apply to both serving modes with the same counters.
+    """
+
+    route_key = None
+
+    async def dispatch(self):
+        throttler = self.scope['app'].state.throttler
+        if throttler is None or self.scope['method'] == 'OPTIONS':
+            return await super().dispatch()
+        request = Request(self.scope, receive=self.receive)
+        route = f"{request.method} {self.route_key}"
+        ip = _client_ip(request, throttler.trust_proxy)
+        try:
+            if isinstance(throttler.store, MemoryStore):
+                allowed, headers = throttler.check(ip, route, time.time())
+            else:
+                # Shared stores do network I/O; keep it off the event loop
+                allowed, headers = await run_in_threadpool(throttler.check, ip, route, time.time())
+        except Exception as e:
+            # Fail open: a broken shared store must not take the API down
+            log.warning("Rate limit check failed, allowing request: %s", e)
+            return await super().dispatch()
+        if not allowed:
+            log.warning("Rate limit exceeded for %s on %s", ip, route)
+            response = JSONResponse({"message": "Too many requests, slow down."}, 429, headers=headers)
+            return await response(self.scope, self.receive, self.send)
+
+        # Add the RateLimit-* headers to whatever response the handler produces
+        raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+        send = self.send
+
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', ())) + raw_headers
+            await send(message)
+
+        self.send = send_with_headers
+        await super().dispatch()
+
+    def respond(self, request, result, status_code, headers=None):
+        """
+        JSON response for a read, with the WSGI blueprint's Cache-Control, ETag / 304 and compression.
+
+        Uses the same HttpCache (api.http_cache) as the WSGI API, so bodies and
+        ETags are identical in both serving modes and share one memo.
+        """
+        http_cache = request.app.state.http_cache
+        if http_cache is None:
+            return JSONResponse(result, status_code, headers=headers)
+        entry = http_cache.serialize(result) if status_code == 200 else None
+        response_headers = Headers(headers or {})
+        status_code, body = http_cache.prepare(
+            f"GET {self.route_key}", status_code, entry, response_headers, mimetype='application/json',
+            if_none_match=parse_etags(request.headers.get('if-none-match')),
+            accept_encodings=parse_accept_header(request.headers.get('accept-encoding')),
+        )
+        if body is None:
+            return JSONResponse(result, status_code, headers=dict(response_headers))
+        return Response(body, status_code, headers=dict(response_headers),
+                        media_type='application/json' if status_code != 304 else None)
+
+
+class SubscriberList(ThrottledEndpoint):
+    """Async GET (list) and POST (add) /api/v1/mail/subscribers/."""
+
+    route_key = '/mail/subscribers/'
+
+    async def get(self, request):
+        log.info("Received request to list subscribers")
+        list_address = request.app.state.mailgun.list_address
+        params = request.query_params
+        try:
+            filters, _ = _read_filters(request)
+            if filters or params.get('limit') is not None or params.get('offset') is not None:
+                limit = int(params.get('limit', 100))
+                offset = int(params.get('offset', 0))
+                if not 1 <= limit <= mirror.MAX_QUERY_LIMIT or offset < 0:
+                    raise ValueError(f"limit must be 1-{mirror.MAX_QUERY_LIMIT} and offset at least 0")
+                return self.respond(request, *await _serve_filtered(
+                    request, lambda store, list_address, bound: store.serve_query(
+                        list_address, bound, limit, offset, **filters)))
+            served = await _read_from_mirror(request, lambda bound: request.app.state.mirror.serve_list(list_address, bound))
+        except ValueError as e:
+            return JSONResponse({"message": f"Input payload validation failed: {e}"}, 400)
+        if served is not None:
+            return self.respond(request, *served)
+        result, status_code = await request.app.state.mailgun.get_list_members()
+        return self.respond(request, _apply_pending(request.app.state, result, status_code), status_code)
+
+    async def post(self, request):
+        try:
+            args = await _parse_payload(request, payloads.subscriber_payload)
+        except payloads.ValidationError as e:
+            return JSONResponse(e.to_response(), 400)
+        log.info("Received request to add/update subscriber: %s", args['address'])
+        await _flush_pending(request.app.state, args['address'])
+        if request.app.state.write_queue is not None:
+            job_id, status_url = await _enqueue_add(
+                request.app.state,
+                email=args['address'],
+                name=args.get('name'),
+                subscribed=args['subscribed'],
+                upsert=args['upsert']
+            )
+            log.info("Queued add/update for %s as job %s", args['address'], job_id)
+            return JSONResponse({"message": "Subscription request accepted.", "job_id": job_id, "status_url": status_url},
+                                202, headers={'Location': status_url})
+        result, status_code = await request.app.state.mailgun.add_list_member(
+            email=args['address'],
+            name=args.get('name'),
+            subscribed=args['subscribed'],
+            upsert=args['upsert']
+        )
+        return JSONResponse(result, status_code)
+
+
+class SubscriberCount(ThrottledEndpoint):
+    """Async GET /api/v1/mail/subscribers/count (from the subscriber mirror)."""
+
+    route_key = '/mail/subscribers/count'
+
+    async def get(self, request):
+        try:
+            filters, _ = _read_filters(request)
+        except ValueError as e:
+            return JSONResponse({"message": f"Input payload validation failed: {e}"}, 400)
+        log.info("Received request to count subscribers: %s", filters)
+        return self.respond(request, *await _serve_filtered(request, lambda store, list_address, bound: store.serve_count(
+            list_address, bound, **filters)))
+
+
+class Subscriber(ThrottledEndpoint):
+    """Async GET, PUT and DELETE /api/v1/mail/subscribers/<member_address>."""
+
+    route_key = '/mail/subscribers/<string:member_address>'
+
+    async def get(self, request):
+        member_address = request.path_params['member_address']
+        log.info("Received request to get subscriber: %s", member_address)
+        list_address = request.app.state.mailgun.list_address
+        try:
+            served = await _read_from_mirror(
+                request, lambda bound: request.app.state.mirror.serve_member(list_address, member_address, bound))
+        except ValueError as e:
+            return JSONResponse({"message": f"Input payload validation failed: {e}"}, 400)
+        if served is not None:
+            return self.respond(request, *served)
+        result, status_code = await request.app.state.mailgun.get_member(member_address)
+        return self.respond(request, _apply_pending(request.app.state, result, status_code), status_code)
+
+    @signature_required('subscribe-update')
+    async def put(self, request):
+        member_address = request.path_params['member_address']
+        try:
+            update_data = await _parse_payload(request, payloads.update_subscriber_payload)
+        except payloads.ValidationError as e:
+            return JSONResponse(e.to_response(), 400)
+        if not update_data:
+            return JSONResponse({"message": "No update data provided. Provide 'name' or 'subscribed'."}, 400)
+        log.info("Received request to update subscriber: %s", member_address)
+        coalescer = request.app.state.write_coalescer
+        if coalescer is not None:
+            pending = coalescer.submit(member_address, update_data)
+            return JSONResponse({"message": "Update accepted.", "member": {"address": member_address, **pending}}, 202)
+        result, status_code = await request.app.state.mailgun.update_member(member_address, **update_data)
+        return JSONResponse(result, status_code)
+
+    @signature_required('subscribe-delete')
+    async def delete(self, request):
+        member_address = request.path_params['member_address']
+        log.info("Received request to delete subscriber: %s", member_address)
+        await _flush_pending(request.app.state, member_address)
+        result, status_code = await request.app.state.mailgun.delete_member(member_address)
+        return JSONResponse(result, status_code)
@@ -2,8 +2,11 @@ import os
 import time
 import hmac
 import hashlib
+import threading
 from functools import wraps
-from flask import request, current_app, jsonify
+from flask import request, current_app
+from auth.tokens import TOKEN_HEADER, get_minter
+from services.metrics import get_metrics
 import logging
 
 log = logging.getLogger(__name__)
@@ -11,11 +14,287 @@ log = logging.getLogger(__name__)
 # Define the allowed time window in seconds (e.g., 5 minutes)
 TIMESTAMP_WINDOW = 300
 
+# Width of the replay cache buckets, in seconds of request timestamp
+REPLAY_BUCKET_SECONDS = 10
+
+# Outcomes of ReplayCache.check_and_add
+RECORDED = 'recorded'
+REPLAYED = 'replayed'
+STALE = 'stale'  # Older than the entries the cache dropped to stay within max_entries
+FULL = 'full'  # The newest timestamps alone fill the cache
+
+# Template cache key for the Mailgun webhook signing key (webhooks sign timestamp + token, no action)
+WEBHOOK_TEMPLATE_KEY = 'mailgun-webhook'
+
+# Keyed HMAC objects per (secret, action); copying one skips re-keying on every request
+_hmac_templates = {}
+_hmac_templates_lock = threading.Lock()
+
+
+def _hmac_template(api_secret, action_identifier):
+    """Returns a cached HMAC-SHA256 object already keyed with the API secret."""
+    key = (api_secret, action_identifier)
+    template = _hmac_templates.get(key)
+    if template is None:
+        with _hmac_templates_lock:
+            template = _hmac_templates.get(key)
+            if template is None:
+                template = hmac.new(api_secret.encode('utf-8'), digestmod=hashlib.sha256)
+                _hmac_templates[key] = template
+    return template
+
+
+def compute_signature(api_secret, timestamp_str, action_identifier, nonce=None):
+    """HMAC-SHA256 hex digest of timestamp + action_identifier (+ optional nonce)."""
+    hash_obj = _hmac_template(api_secret, action_identifier).copy()
+    hash_obj.update(timestamp_str.encode('utf-8'))
+    hash_obj.update(action_identifier.encode('utf-8'))
+    if nonce:
+        hash_obj.update(nonce.encode('utf-8'))
+    return hash_obj.hexdigest()
+
+
+class ReplayCache:
+    """
+    Remembers accepted (timestamp, signature) pairs until their timestamp leaves
+    the allowed window, so a captured signature can only be used once.
+
+    Entries are grouped in buckets by request timestamp; whole buckets are
+    dropped as the window slides, so each check stays O(1) regardless of how
+    many entries are held. `max_entries` bounds memory: when full, the oldest
+    bucket is dropped early and timestamps up to it are refused as STALE from
+    then on (they could no longer be checked), so a burst shortens the window
+    instead of locking out all signed traffic. Only when the bucket of the
+    request itself would have to go is it refused as FULL.
+    """
+
+    def __init__(self, window=TIMESTAMP_WINDOW, bucket_seconds=REPLAY_BUCKET_SECONDS, max_entries=100000):
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self.max_entries = max_entries
+        self._buckets = {}
+        self._size = 0
+        self._oldest_bucket = None
+        self._evicted_through = None
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        # A bucket can go once even its newest timestamp is outside the window
+        cutoff = (now - self.window) // self.bucket_seconds
+        if self._oldest_bucket is not None and self._oldest_bucket >= cutoff:
+            return
+        for index in [index for index in self._buckets if index < cutoff]:
+            self._size -= len(self._buckets.pop(index))
+        self._oldest_bucket = min(self._buckets) if self._buckets else None
+        if self._evicted_through is not None and self._evicted_through < cutoff:
+            self._evicted_through = None
+
+    def check_and_add(self, timestamp, signature, now=None):
+        """
+        Records the pair and returns RECORDED, or the reason it was not:
+        REPLAYED (already seen), STALE or FULL (see the class docstring).
+        """
+        now = int(time.time()) if now is None else now
+        index = timestamp // self.bucket_seconds
+        entry = (timestamp, signature)
+        with self._lock:
+            self._expire(now)
+            if self._evicted_through is not None and index <= self._evicted_through:
+                return STALE
+            bucket = self._buckets.get(index)
+            if bucket is not None and entry in bucket:
+                return REPLAYED
+            while self._size >= self.max_entries:
+                oldest = self._oldest_bucket
+                if oldest is None or oldest >= index:
+                    log.error("Replay cache is full with current timestamps; refusing signed request.")
+                    return FULL
+                self._size -= len(self._buckets.pop(oldest))
+                self._evicted_through = oldest
+                self._oldest_bucket = min(self._buckets) if self._buckets else None
+                self.evicted += 1
+                log.warning("Replay cache full; dropped timestamps up to %d early.",
+                            (oldest + 1) * self.bucket_seconds - 1)
+            if bucket is None:
+                bucket = self._buckets[index] = set()
+                if self._oldest_bucket is None or index < self._oldest_bucket:
+                    self._oldest_bucket = index
+            bucket.add(entry)
+            self._size += 1
+            return RECORDED
+
+    def discard(self, timestamp, signature):
+        """Forgets a recorded pair, so a request that was refused after its check can be retried."""
+        with self._lock:
+            bucket = self._buckets.get(timestamp // self.bucket_seconds)
+            if bucket is not None and (timestamp, signature) in bucket:
+                bucket.remove((timestamp, signature))
+                self._size -= 1
+
+    def __len__(self):
+        return self._size
+
+
+def get_replay_cache():
+    """
+    Returns the app's replay cache, or None when replay protection is disabled.
+
+    The cache is per process: with several gunicorn workers a replay can still
+    land on a different worker once; within a worker it is always rejected.
+    """
+    if not current_app.config.get('SIGNATURE_REPLAY_PROTECTION', True):
+        return None
+    cache = current_app.extensions.get('signature_replay_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('signature_replay_cache', ReplayCache(
+            max_entries=current_app.config.get('SIGNATURE_REPLAY_CACHE_SIZE', 100000)))
+    return cache
+
+
+def _check_signature(api_secret, action_identifier, timestamp_str, received_signature,
+                     nonce=None, now=None, replay_cache=None):
+    """Returns (result, message, status_code); result is 'ok' or the reason the request was refused."""
+    if not timestamp_str or not received_signature:
+        log.warning("Auth headers missing.")
+        return 'missing', "Missing required authentication headers (X-Timestamp, X-Signature).", 401
+
+    try:
+        request_timestamp = int(timestamp_str)
+    except ValueError:
+        log.warning("Invalid timestamp format received: %s", timestamp_str)
+        return 'malformed', "Invalid timestamp format.", 401
+
+    current_timestamp = int(time.time()) if now is None else now
+    if abs(current_timestamp - request_timestamp) > TIMESTAMP_WINDOW:
+        log.warning("Timestamp expired. Request: %s, Server: %s", request_timestamp, current_timestamp)
+        return 'expired', f"Timestamp expired or outside allowed window ({TIMESTAMP_WINDOW}s).", 401
+
+    try:
+        expected_signature = compute_signature(api_secret, timestamp_str, action_identifier, nonce)
+    except Exception as e:
+        log.error("Error calculating HMAC: %s", e)
+        return 'error', "Error during signature verification.", 500
+
+    # Compare as bytes: compare_digest raises TypeError for non-ASCII str input
+    if not hmac.compare_digest(expected_signature.encode('utf-8'), received_signature.encode('utf-8')):
+        log.warning("Signature mismatch for action %s (timestamp %s).", action_identifier, timestamp_str)
+        return 'invalid', "Invalid signature.", 401
+
+    if replay_cache is not None:
+        replay_key = f"{received_signature}:{nonce}" if nonce else received_signature
+        outcome = replay_cache.check_and_add(request_timestamp, replay_key, now=current_timestamp)
+        if outcome != RECORDED:
+            log.warning("Signature refused by the replay cache for action %s (timestamp %s): %s",
+                        action_identifier, timestamp_str, outcome)
+            return _replay_refusal(outcome)
+
+    return 'ok', None, 200
+
+
+def _replay_refusal(outcome):
+    """(result, message, status_code) for a request the replay cache did not record."""
+    if outcome == REPLAYED:
+        return 'replayed', "Signature already used.", 401
+    if outcome == STALE:
+        return 'stale', "Timestamp too old to check for replays under the current load; sign with the current time.", 401
+    return 'overloaded', "Replay protection is at capacity; retry shortly.", 503
+
+
+def check_webhook_signature(signing_key, timestamp_str, token, received_signature, now=None, replay_cache=None):
+    """
+    Checks a Mailgun webhook signature: HMAC-SHA256 of timestamp + token keyed with the webhook signing key.
+
+    Held to the same rules as signed API requests: timestamp window,
+    constant-time comparison and, with a replay cache, each token accepted
+    only once. Returns (result, message, status_code) like _check_signature.
+    """
+    if not timestamp_str or not token or not received_signature:
+        log.warning("Webhook signature fields missing.")
+        return 'missing', "Missing webhook signature (timestamp, token, signature).", 401
+    if not isinstance(token, str) or not isinstance(received_signature, str):
+        return 'malformed', "Invalid webhook signature format.", 401
+
+    try:
+        request_timestamp = int(timestamp_str)
+    except (TypeError, ValueError):
+        log.warning("Invalid webhook timestamp received: %s", timestamp_str)
+        return 'malformed', "Invalid timestamp format.", 401
+
+    current_timestamp = int(time.time()) if now is None else now
+    if abs(current_timestamp - request_timestamp) > TIMESTAMP_WINDOW:
+        log.warning("Webhook timestamp expired. Request: %s, Server: %s", request_timestamp, current_timestamp)
+        return 'expired', f"Timestamp expired or outside allowed window ({TIMESTAMP_WINDOW}s).", 401
+
+    hash_obj = _hmac_template(signing_key, WEBHOOK_TEMPLATE_KEY).copy()
+    hash_obj.update(str(timestamp_str).encode('utf-8'))
+    hash_obj.update(token.encode('utf-8'))
+    if not hmac.compare_digest(hash_obj.hexdigest().encode('utf-8'), received_signature.encode('utf-8')):
+        log.warning("Webhook signature mismatch (timestamp %s).", timestamp_str)
+        return 'invalid', "Invalid signature.", 401
+
+    if replay_cache is not None:
+        outcome = replay_cache.check_and_add(request_timestamp, token, now=current_timestamp)
+        if outcome != RECORDED:
+            log.warning("Webhook token refused by the replay cache (timestamp %s): %s", timestamp_str, outcome)
+            return _replay_refusal(outcome)
+
+    return 'ok', None, 200
+
+
+def verify_signature(api_secret, action_identifier, timestamp_str, received_signature,
+                     nonce=None, now=None, replay_cache=None):
+    """
+    Verifies a signed request.
+
+    Returns (ok, message, status_code); message/status_code describe the failure.
+    Framework-independent so it can be shared by other serving paths and benchmarks.
+    """
+    result, message, status_code = _check_signature(api_secret, action_identifier, timestamp_str,
+                                                     received_signature, nonce, now, replay_cache)
+    return result == 'ok', message, status_code
+
+
+def authenticate_request(headers, action_identifier, api_secret, replay_cache=None, minter=None, metrics=None):
+    """
+    Checks a request's X-Token, or X-Timestamp/X-Signature (and optional X-Nonce), headers.
+
+    Returns (ok, message, status_code). Shared by signature_required and the
+    async (ASGI) handlers; the result is counted in `metrics` when given.
+    """
+    # Minted token (GET /api/v1/auth/token) for public actions such as the subscribe form
+    token = headers.get(TOKEN_HEADER)
+    if token:
+        ok, message = minter.verify(token, action_identifier) if minter else (False, "Invalid token.")
+        if metrics is not None:
+            metrics.auth_checks.inc(action_identifier, 'token', 'ok' if ok else 'invalid')
+        if not ok:
+            log.warning("Token rejected for action %s: %s", action_identifier, message)
+            return False, message, 401
+        return True, None, 200
+
+    # Headers, timestamp window, signature and replay
+    result, message, status_code = _check_signature(
+        api_secret,
+        action_identifier,
+        headers.get('X-Timestamp'),
+        headers.get('X-Signature'),
+        nonce=headers.get('X-Nonce'),
+        replay_cache=replay_cache,
+    )
+    if metrics is not None:
+        metrics.auth_checks.inc(action_identifier, 'signature', result)
+    return result == 'ok', message, status_code
+
+
 def signature_required(action_identifier):
     """
     Decorator to verify HMAC signature for API requests.
     Requires 'X-Timestamp' and 'X-Signature' headers.
-    Signs the concatenation of timestamp + action_identifier.
+    Signs the concatenation of timestamp + action_identifier, plus the optional
+    'X-Nonce' header when sent. Each signature is accepted only once.
+    Alternatively accepts an 'X-Token' minted by GET /api/v1/auth/token for
+    actions listed in AUTH_TOKEN_ACTIONS.
     """
     def decorator(f):
         @wraps(f)
@@ -24,50 +303,23 @@ def signature_required(action_identifier):
             api_secret = current_app.config.get('API_SECRET')
             if not api_secret:
                 log.error("API_SECRET not configured on the server.")
-                # Return JSON instead of abort
-                return jsonify({"message": "Authentication configuration error."}), 500
-
-            # 2. Get Headers
-            timestamp_str = request.headers.get('X-Timestamp')
-            received_signature = request.headers.get('X-Signature')
-
-            if not timestamp_str or not received_signature:
-                log.warning("Auth headers missing.")
-                # Return JSON instead of abort
-                return jsonify({"message": "Missing required authentication headers (X-Timestamp, X-Signature)."}), 401
-
-            # 3. Validate Timestamp
-            try:
-                request_timestamp = int(timestamp_str)
-            except ValueError:
-                log.warning(f"Invalid timestamp format received: {timestamp_str}")
-                # Return JSON instead of abort
-                return jsonify({"message": "Invalid timestamp format."}), 401
-
-            current_timestamp = int(time.time())
-            if abs(current_timestamp - request_timestamp) > TIMESTAMP_WINDOW:
-                log.warning(f"Timestamp expired. Request: {request_timestamp}, Server: {current_timestamp}")
-                # Return JSON instead of abort
-                return jsonify({"message": f"Timestamp expired or outside allowed window ({TIMESTAMP_WINDOW}s)."}), 401
-
-            # 4. Construct Message & Calculate Expected Signature
-            message = timestamp_str.encode('utf-8') + action_identifier.encode('utf-8')
-            try:
-                hash_obj = hmac.new(api_secret.encode('utf-8'), message, hashlib.sha256)
-                expected_signature = hash_obj.hexdigest()
-            except Exception as e:
-                log.error(f"Error calculating HMAC: {e}")
-                # Return JSON instead of abort
-                return jsonify({"message": "Error during signature verification."}), 500
-
-            # 5. Compare Signatures
-            if not hmac.compare_digest(expected_signature, received_signature):
-                log.warning(f"Signature mismatch. Received: {received_signature}, Expected: {expected_signature}")
-                # Return JSON instead of abort
-                return jsonify({"message": "Invalid signature."}), 401
-
-            # 6. Proceed if valid
-            log.debug(f"Signature verified successfully for action: {action_identifier}")
+                # Return a dict so flask-restx serializes the JSON error body
+                return {"message": "Authentication configuration error."}, 500
+
+            # 2. Verify the minted token, or headers, timestamp window, signature and replay
+            ok, message, status_code = authenticate_request(
+                request.headers,
+                action_identifier,
+                api_secret,
+                replay_cache=get_replay_cache(),
+                minter=get_minter(),
+                metrics=get_metrics(),
+            )
+            if not ok:
+                return {"message": message}, status_code
+
+            # 3. Proceed if valid
+            log.debug("Signature verified successfully for action: %s", action_identifier)
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -0,0 +1,109 @@
+import time
+import hmac
+import hashlib
+import threading
+import logging
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+# Key used to store the minter on the Flask app (app.extensions)
+EXTENSION_KEY = 'auth_token_minter'
+
+# Request header carrying a minted token (instead of X-Timestamp/X-Signature)
+TOKEN_HEADER = 'X-Token'
+
+
+class TokenMinter:
+    """
+    Mints short-lived signed tokens for public actions (e.g. the subscribe form).
+
+    A token is "<expires>.<hmac>" where the HMAC covers the action and the expiry,
+    in a message format distinct from request signatures. Expiries are aligned to
+    `bucket_seconds`, so everyone asking within one bucket gets the same token and
+    the HMAC is computed once per action and bucket. Tokens are valid for at least
+    `ttl - bucket_seconds` seconds after they are handed out.
+
+    Because anyone can fetch a token for an allowed action, tokens are reusable
+    until they expire; the replay cache only applies to X-Signature requests.
+    """
+
+    def __init__(self, api_secret, ttl=300, bucket_seconds=60, actions=('subscribe-add',)):
+        if bucket_seconds >= ttl:
+            raise ValueError("AUTH_TOKEN_BUCKET_SECONDS must be smaller than AUTH_TOKEN_TTL")
+        self.api_secret = api_secret
+        self.ttl = int(ttl)
+        self.bucket_seconds = int(bucket_seconds)
+        self.actions = frozenset(actions)
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the minter from a Flask config mapping, or returns None without an API secret."""
+        api_secret = config.get('API_SECRET')
+        if not api_secret:
+            return None
+        actions = config.get('AUTH_TOKEN_ACTIONS', 'subscribe-add')
+        if isinstance(actions, str):
+            actions = [action.strip() for action in actions.split(',') if action.strip()]
+        return cls(
+            api_secret,
+            ttl=config.get('AUTH_TOKEN_TTL', 300),
+            bucket_seconds=config.get('AUTH_TOKEN_BUCKET_SECONDS', 60),
+            actions=actions,
+        )
+
+    def _sign(self, action, expires):
+        message = f"token:{action}:{expires}".encode('utf-8')
+        return hmac.new(self.api_secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+    def _token_for(self, action, expires):
+        """Returns the (cached) token for an action and an aligned expiry."""
+        key = (action, expires)
+        token = self._tokens.get(key)
+        if token is None:
+            token = f"{expires}.{self._sign(action, expires)}"
+            with self._lock:
+                # Keep the current and the previous buckets; older tokens have expired
+                if len(self._tokens) > 4 * len(self.actions):
+                    cutoff = expires - self.ttl
+                    self._tokens = {k: v for k, v in self._tokens.items() if k[1] > cutoff}
+                self._tokens[key] = token
+        return token
+
+    def mint(self, action, now=None):
+        """Returns (token, expires) for an allowed action; raises ValueError otherwise."""
+        if action not in self.actions:
+            raise ValueError(f"Tokens are not available for action '{action}'.")
+        now = int(time.time()) if now is None else int(now)
+        expires = (now // self.bucket_seconds) * self.bucket_seconds + self.ttl
+        return self._token_for(action, expires), expires
+
+    def verify(self, token, action, now=None):
+        """Returns (ok, message) for a token presented with a request for `action`."""
+        if action not in self.actions:
+            return False, "Tokens are not accepted for this action."
+        expires_str, _, signature = (token or '').partition('.')
+        try:
+            expires = int(expires_str)
+        except ValueError:
+            return False, "Invalid token."
+        now = int(time.time()) if now is None else int(now)
+        if expires < now:
+            return False, "Token expired."
+        # Only expiries this minter could have issued; also keeps the token cache bounded
+        if expires - now > self.ttl or (expires - self.ttl) % self.bucket_seconds:
+            return False, "Invalid token."
+        expected = self._token_for(action, expires).partition('.')[2]
+        if not hmac.compare_digest(expected.encode('utf-8'), signature.encode('utf-8')):
+            return False, "Invalid token."
+        return True, None
+
+
+def get_minter():
+    """Returns the token minter for the current app (built on first use), or None without API_SECRET."""
+    app = current_app._get_current_object()
+    if EXTENSION_KEY not in app.extensions:
+        app.extensions[EXTENSION_KEY] = TokenMinter.from_config(app.config)
+    return app.extensions[EXTENSION_KEY]
@@ -0,0 +1,123 @@
+"""
+Compares the sync (gunicorn/WSGI) and async (uvicorn/ASGI) serving modes.
+
+Starts the fake Mailgun (benchmarks.fake_mailgun) with a fixed response
+latency, then runs each server mode against it and drives GET
+/api/v1/mail/subscribers/<address> at several concurrency levels with the
+subscriber cache, inbound throttling and the outbound rate limit disabled, so
+every request is a Mailgun round trip. Reports throughput, latency percentiles,
+errors and the resident memory of the server processes.
+
+Usage:
+    python -m benchmarks.bench_async [--concurrency 50,500,2000] [--duration 10]
+        [--latency 0.05] [--sync-workers 4] [--sync-threads 1] [--json]
+
+Requires the async extras (pip install -r requirements-async.txt).
+"""
+import argparse
+import asyncio
+import json
+import time
+import aiohttp
+from benchmarks.harness import (free_port, raise_fd_limit, server_env, start_fake_mailgun, start_server,
+                                stop, tree_rss_mb)
+
+MEMBER = 'member000001@example.com'
+
+
+async def _drive(url, concurrency, duration):
+    latencies = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                try:
+                    async with session.get(url) as response:
+                        await response.read()
+                        status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                    continue
+                if status == 200:
+                    latencies.append(time.monotonic() - start)
+                else:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def bench_mode(mode, levels, args, mailgun_port):
+    port = free_port()
+    # Cache and outbound rate limit off: every request is a Mailgun round trip
+    env = server_env(mailgun_port, max(levels), {'SUBSCRIBER_CACHE_ENABLED': 'false',
+                                                  'MAILGUN_RATE_LIMIT_ENABLED': 'false'})
+    server = start_server(mode, port, env, args.sync_workers, args.sync_threads)
+    try:
+        url = f'http://127.0.0.1:{port}/api/v1/mail/subscribers/{MEMBER}'
+        asyncio.run(_drive(url, 10, 1))  # Warm up pools
+        results = []
+        for concurrency in levels:
+            result = asyncio.run(_drive(url, concurrency, args.duration))
+            result.update(mode=mode, concurrency=concurrency, server_rss_mb=tree_rss_mb(server.pid))
+            results.append(result)
+        return results
+    finally:
+        stop(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='50,500,2000', help='Comma-separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake Mailgun response latency (seconds)')
+    parser.add_argument('--sync-workers', type=int, default=4, help='gunicorn workers in sync mode')
+    parser.add_argument('--sync-threads', type=int, default=1, help='Threads per gunicorn worker in sync mode')
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',')]
+    raise_fd_limit()
+
+    mailgun_port = free_port()
+    fake = start_fake_mailgun(mailgun_port, latency=args.latency)
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            results.extend(bench_mode(mode, levels, args, mailgun_port))
+    finally:
+        fake.terminate()
+        fake.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"Fake Mailgun latency {args.latency * 1000:.0f} ms; sync mode: {args.sync_workers} workers x "
+          f"{args.sync_threads} threads; async mode: 1 uvicorn process")
+    print(f"{'mode':<6} {'conc':>6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} {'RSS MB':>8}")
+    for r in results:
+        print(f"{r['mode']:<6} {r['concurrency']:>6} {r['rps']:>9} {r['p50_ms']!s:>9} {r['p99_ms']!s:>9} "
+              f"{r['errors']:>7} {r['server_rss_mb']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Microbenchmark for the subscriber write payloads (api.payloads) against the reqparse parsers they replaced.
+
+Each iteration parses a fresh Werkzeug request (JSON body, form body or query
+string) for POST /mail/subscribers/ or PUT /mail/subscribers/<address>, so
+body decoding is included for both implementations. The legacy parsers are
+the exact reqparse definitions the endpoints used before (type=bool, which
+turned "false" into True).
+
+Usage:
+    python -m benchmarks.bench_payloads [--iterations N] [--json]
+"""
+import argparse
+import io
+import json
+import time
+import logging
+
+from flask import Flask
+from flask_restx import reqparse
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from api import payloads
+
+LOCATIONS = ('json', 'form', 'args')
+
+
+def _legacy_parsers():
+    """The reqparse parsers of api/mail_list.py before the payload schemas."""
+    subscriber = reqparse.RequestParser()
+    subscriber.add_argument('address', type=str, required=True, help='Email address cannot be blank', location=LOCATIONS)
+    subscriber.add_argument('name', type=str, help='Optional subscriber name', required=False, location=LOCATIONS)
+    subscriber.add_argument('subscribed', type=bool, help='Subscription status (default: true)', default=True,
+                            location=LOCATIONS)
+    subscriber.add_argument('upsert', type=bool, help='Update if exists (default: true)', default=True,
+                            location=LOCATIONS)
+    update = reqparse.RequestParser()
+    update.add_argument('name', type=str, help='Optional subscriber name', required=False, location=LOCATIONS)
+    update.add_argument('subscribed', type=bool, help='Subscription status', required=False, location=LOCATIONS)
+    return subscriber, update
+
+
+# (name, method, EnvironBuilder kwargs, which parsers)
+CASES = (
+    ('POST json', 'POST', {'json': {'address': 'someone@example.com', 'name': 'Some One', 'subscribed': True}},
+     'subscriber'),
+    ('POST form', 'POST', {'data': {'address': 'someone@example.com', 'name': 'Some One', 'subscribed': 'true'}},
+     'subscriber'),
+    ('POST query', 'POST', {'query_string': {'address': 'someone@example.com', 'subscribed': 'true'}}, 'subscriber'),
+    ('PUT json', 'PUT', {'json': {'name': 'Some One'}}, 'update'),
+    ('PUT form', 'PUT', {'data': {'subscribed': 'false'}}, 'update'),
+)
+
+
+def _requests(method, builder_kwargs, count):
+    """Fresh requests for the same payload (each decodes its own body)."""
+    builder = EnvironBuilder(path='/api/v1/mail/subscribers/', method=method, **builder_kwargs)
+    environ = builder.get_environ()
+    body = environ['wsgi.input'].read()
+    builder.close()
+    return [Request({**environ, 'wsgi.input': io.BytesIO(body)}) for _ in range(count)]
+
+
+def bench_case(method, builder_kwargs, legacy, schema, iterations):
+    """Returns microseconds per parse for reqparse and for the payload schema."""
+    batch = _requests(method, builder_kwargs, iterations)
+    start = time.perf_counter()
+    for req in batch:
+        legacy.parse_args(req=req)
+    legacy_us = (time.perf_counter() - start) / iterations * 1e6
+    batch = _requests(method, builder_kwargs, iterations)
+    start = time.perf_counter()
+    for req in batch:
+        schema.parse_request(req)
+    schema_us = (time.perf_counter() - start) / iterations * 1e6
+    return legacy_us, schema_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    legacy_subscriber, legacy_update = _legacy_parsers()
+    parsers = {
+        'subscriber': (legacy_subscriber, payloads.subscriber_payload),
+        'update': (legacy_update, payloads.update_subscriber_payload),
+    }
+    results = {}
+    with Flask(__name__).app_context():  # reqparse reads BUNDLE_ERRORS from the app config
+        for name, method, builder_kwargs, kind in CASES:
+            legacy_us, schema_us = bench_case(method, builder_kwargs, *parsers[kind], args.iterations)
+            results[name] = {'reqparse_us': round(legacy_us, 2), 'payload_schema_us': round(schema_us, 2)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(f"{name:<11} reqparse {result['reqparse_us']:>7.2f} us, payload schema "
+              f"{result['payload_schema_us']:>6.2f} us ({result['reqparse_us'] / result['payload_schema_us']:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Startup-time benchmark: import + create_app + first request, in fresh processes.
+
+Each run starts a new interpreter (as a container or gunicorn worker would),
+then times importing the app module, create_app(), and the first request
+through the Flask test client. The process wall time includes interpreter
+startup. Reported numbers are medians over the runs; `modules` is how many
+modules the process had loaded after the first request, and `requests_loaded`
+whether the HTTP client library was among them (it should only be once a
+request actually needs Mailgun).
+
+Usage:
+    python -m benchmarks.bench_startup [--runs N] [--path /api/v1/health/] [--config test] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process; prints one JSON line with the phase timings (milliseconds)
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app(sys.argv[1])
+created = time.perf_counter()
+response = flask_app.test_client().get(sys.argv[2])
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'status': response.status_code,
+    'modules': len(sys.modules),
+    'requests_loaded': 'requests' in sys.modules,
+}))
+"""
+
+PHASES = ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms')
+
+
+def _child_env():
+    env = dict(os.environ)
+    # Placeholders so create_app's config validation passes; nothing is sent to Mailgun
+    env.setdefault('MAILGUN_API_KEY', 'key-benchmark')
+    env.setdefault('MAILGUN_LIST_ADDRESS', 'list@mg.example.com')
+    env.setdefault('API_SECRET', 'benchmark-secret')
+    env.setdefault('SECRET_KEY', 'benchmark-secret-key')
+    env.setdefault('METRICS_DIR', '')  # No snapshot files
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'  # Measure with the existing bytecode cache, don't add to it
+    return env
+
+
+def run_once(config_name, path, env):
+    """Starts one interpreter; returns its phase timings plus the total process wall time."""
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', CHILD, config_name, path], cwd=ROOT, env=env,
+                               capture_output=True, text=True, check=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_ms'] = elapsed
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/api/v1/health/', help='First request (default: the health check)')
+    parser.add_argument('--config', default='test', help='create_app config name (default: test)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    env = _child_env()
+    run_once(args.config, args.path, env)  # Warm the OS file cache; not counted
+    runs = [run_once(args.config, args.path, env) for _ in range(args.runs)]
+    results = {phase: round(statistics.median(run[phase] for run in runs), 1) for phase in PHASES}
+    results.update(runs=args.runs, path=args.path, status=runs[-1]['status'], modules=runs[-1]['modules'],
+                   requests_loaded=runs[-1]['requests_loaded'])
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"Startup ({args.runs} runs, median): import {results['import_ms']:.1f} ms, "
+          f"create_app {results['create_app_ms']:.1f} ms, first request {args.path} "
+          f"{results['first_request_ms']:.1f} ms ({results['status']})")
+    print(f"Process wall time {results['process_ms']:.1f} ms; {results['modules']} modules loaded, "
+          f"requests {'loaded' if results['requests_loaded'] else 'not loaded'}")
+
+
+if __name__ == '__main__':
+    main()
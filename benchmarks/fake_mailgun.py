@@ -0,0 +1,247 @@
+"""
+In-memory fake of the Mailgun mailing-list API for benchmarks and local testing.
+
+Implements the endpoints this service uses (list members, member pages,
+members.json bulk upload, get/update/delete member) on a small asyncio
+HTTP/1.1 server with keep-alive, so it can hold thousands of concurrent
+connections. Responses can be delayed (fixed latency plus random jitter) to
+simulate the round trip to Mailgun, a fraction of requests can fail with a 5xx,
+and a request-rate limit answers 429 with Retry-After like Mailgun does.
+
+Usage:
+    python -m benchmarks.fake_mailgun [--port 8025] [--latency 0.05] [--jitter 0.01]
+        [--members 1000] [--error-rate 0.01] [--error-status 503]
+        [--rate-limit 300] [--retry-after 1]
+
+Then point the app at it with MAILGUN_API_BASE_URL=http://127.0.0.1:8025/v3.
+GET /_stats returns the fake's request, injected-error and 429 counters.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class FakeMailgun:
+    """State and request routing of the fake API (one mailing list per address in the URL)."""
+
+    def __init__(self, latency=0.0, members=0, domain='example.com', jitter=0.0,
+                 error_rate=0.0, error_status=503, rate_limit=None, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # Requests per second before answering 429 (token bucket, burst of one second)
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self._tokens = rate_limit or 0
+        self._updated = time.monotonic()
+        self.members = {}
+        self.requests = 0
+        self.injected_errors = 0
+        self.throttled = 0
+        for i in range(members):
+            address = f"member{i:06d}@{domain}"
+            self.members[address] = {'address': address, 'name': f"Member {i}", 'subscribed': True, 'vars': {}}
+
+    def fault(self):
+        """Returns (status, payload, headers) for an injected failure, or None to serve normally."""
+        if self.rate_limit:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._updated) * self.rate_limit)
+            self._updated = now
+            if self._tokens < 1:
+                self.throttled += 1
+                return 429, {'message': 'Too many requests'}, {'Retry-After': str(self.retry_after)}
+            self._tokens -= 1
+        if self.error_rate and random.random() < self.error_rate:
+            self.injected_errors += 1
+            return self.error_status, {'message': 'Injected failure'}, {}
+        return None
+
+    def stats(self):
+        """Counters served at GET /_stats (not part of the Mailgun API)."""
+        return {'requests': self.requests, 'injected_errors': self.injected_errors,
+                'throttled': self.throttled, 'members': len(self.members)}
+
+    def handle(self, method, target, host, form):
+        """Returns (status, payload) for one request."""
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = dict(parse_qsl(url.query))
+        # /v3/lists/<list>/members[.json][/<address> | /pages]
+        if len(parts) < 4 or parts[1] != 'lists':
+            return 404, {'message': 'Not found'}
+        list_address, resource, rest = parts[2], parts[3], parts[4:]
+
+        if resource == 'members.json' and method == 'POST':
+            members = json.loads(form.get('members') or '[]')
+            for member in members:
+                if isinstance(member, str):
+                    member = {'address': member}
+                self._upsert(member)
+            return 200, {'message': 'Mailing list has been updated', 'list': {'address': list_address}}
+        if resource != 'members':
+            return 404, {'message': 'Not found'}
+
+        if not rest:
+            if method == 'GET':
+                items = list(self.members.values())[:100]
+                return 200, {'items': items, 'total_count': len(self.members)}
+            if method == 'POST':
+                address = form.get('address')
+                if not address:
+                    return 400, {'message': 'Parameter address is missing'}
+                if address in self.members and form.get('upsert') != 'true':
+                    return 400, {'message': f"Address already exists '{address}'"}
+                member = self._upsert(form)
+                return 200, {'member': member, 'message': 'Mailing list member has been created'}
+            return 405, {'message': 'Method not allowed'}
+
+        if rest == ['pages'] and method == 'GET':
+            limit = int(query.get('limit', 100))
+            items = sorted(self.members.values(), key=lambda member: member['address'])
+            if query.get('page') == 'next' and query.get('address'):
+                items = [member for member in items if member['address'] > query['address']]
+            page = items[:limit]
+            pivot = page[-1]['address'] if page else ''
+            next_url = f"http://{host}/v3/lists/{list_address}/members/pages?page=next&address={pivot}&limit={limit}"
+            return 200, {'items': page, 'paging': {'next': next_url}}
+
+        address = rest[0]
+        member = self.members.get(address)
+        if member is None:
+            return 404, {'message': 'Member not found'}
+        if method == 'GET':
+            return 200, {'member': member}
+        if method == 'PUT':
+            if 'name' in form:
+                member['name'] = form['name']
+            if 'subscribed' in form:
+                member['subscribed'] = form['subscribed'] == 'true'
+            return 200, {'member': member, 'message': 'Mailing list member has been updated'}
+        if method == 'DELETE':
+            del self.members[address]
+            return 200, {'member': {'address': address}, 'message': 'Mailing list member has been deleted'}
+        return 405, {'message': 'Method not allowed'}
+
+    def _upsert(self, data):
+        address = data['address']
+        member = self.members.setdefault(address, {'address': address, 'name': '', 'subscribed': True, 'vars': {}})
+        if data.get('name') is not None:
+            member['name'] = data['name']
+        subscribed = data.get('subscribed')
+        if subscribed is not None:
+            member['subscribed'] = subscribed in (True, 'true', 'yes')
+        return member
+
+    async def serve_connection(self, reader, writer):
+        """Serves HTTP/1.1 requests on one keep-alive connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                body = await reader.readexactly(length) if length else b''
+                form = dict(parse_qsl(body.decode('utf-8'))) if body else {}
+
+                extra_headers = {}
+                if target == '/_stats':
+                    status, payload = 200, self.stats()
+                else:
+                    self.requests += 1
+                    delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+                    if delay:
+                        await asyncio.sleep(delay)
+                    fault = self.fault()
+                    if fault is not None:
+                        status, payload, extra_headers = fault
+                    else:
+                        status, payload = self.handle(method, target, headers.get('host', ''), form)
+                data = json.dumps(payload).encode('utf-8')
+                close = headers.get('connection', '').lower() == 'close'
+                head = ''.join(f"{name}: {value}\r\n" for name, value in extra_headers.items())
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Unknown')}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n{head}"
+                    f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Starts listening; returns the asyncio server."""
+        return await asyncio.start_server(self.serve_connection, host, port, backlog=4096)
+
+
+def start_in_thread(host='127.0.0.1', port=0, **kwargs):
+    """Runs a FakeMailgun on a background event loop; returns (fake, port)."""
+    fake = FakeMailgun(**kwargs)
+    started = threading.Event()
+    bound = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(fake.start(host, port))
+        bound['port'] = server.sockets[0].getsockname()[1]
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name='fake-mailgun', daemon=True).start()
+    started.wait()
+    return fake, bound['port']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds to delay every response (default: 0.05)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random delay of up to this many seconds')
+    parser.add_argument('--members', type=int, default=1000, help='Number of members to pre-populate')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with --error-status')
+    parser.add_argument('--error-status', type=int, default=503, help='Status of injected failures (default: 503)')
+    parser.add_argument('--rate-limit', type=float, default=None, help='Requests per second before answering 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429 (default: 1)')
+    args = parser.parse_args()
+
+    async def run():
+        fake = FakeMailgun(latency=args.latency, members=args.members, jitter=args.jitter,
+                           error_rate=args.error_rate, error_status=args.error_status,
+                           rate_limit=args.rate_limit, retry_after=args.retry_after)
+        server = await fake.start(args.host, args.port)
+        print(f"Fake Mailgun listening on http://{args.host}:{args.port}/v3 "
+              f"(latency {args.latency * 1000:.0f} ms, {args.members} members, error rate {args.error_rate}, "
+              f"rate limit {args.rate_limit or 'none'})", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Shared helpers for the benchmarks: start the fake Mailgun and the app in
+either serving mode as subprocesses, wait for them, and measure them.
+"""
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def raise_fd_limit():
+    """Thousands of concurrent connections need more than the usual 1024 descriptors."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+
+
+def tree_rss_mb(pid):
+    """Resident memory of a process and all its descendants, in MB (Linux /proc)."""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as children:
+                    pending.extend(int(child) for child in children.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return round(total / 1024, 1)
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server did not come up: {url}")
+
+
+def start_fake_mailgun(port, latency=0.05, members=10, extra_args=()):
+    """Starts benchmarks.fake_mailgun in a subprocess and waits until it answers."""
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_mailgun', '--port', str(port),
+                                '--latency', str(latency), '--members', str(members), *extra_args],
+                               cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_up(f'http://127.0.0.1:{port}/_stats')
+    return process
+
+
+def server_env(mailgun_port, max_connections, overrides=None):
+    """Environment for a benchmarked app: fake Mailgun, no inbound throttling, large pools."""
+    env = dict(os.environ)
+    env.update(
+        FLASK_CONFIG='test',
+        SECRET_KEY=env.get('SECRET_KEY', 'benchmark-secret-key'),
+        MAILGUN_API_KEY=env.get('MAILGUN_API_KEY', 'key-benchmark'),
+        MAILGUN_LIST_ADDRESS=env.get('MAILGUN_LIST_ADDRESS', 'list@example.com'),
+        API_SECRET=env.get('API_SECRET', 'benchmark-secret'),
+        MAILGUN_API_BASE_URL=f'http://127.0.0.1:{mailgun_port}/v3',
+        API_RATE_LIMIT_ENABLED='false',
+        MAILGUN_POOL_MAXSIZE=str(max_connections),
+        MAILGUN_ASYNC_MAX_CONNECTIONS=str(max_connections),
+        MAILGUN_READ_TIMEOUT='30',
+    )
+    env.update(overrides or {})
+    return env
+
+
+def start_server(mode, port, env, sync_workers=4, sync_threads=1):
+    """Starts the app with gunicorn (mode 'sync') or uvicorn (mode 'async') and waits until it answers."""
+    if mode == 'sync':
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(sync_workers), '--threads', str(sync_threads),
+                   '--backlog', '4096', '--timeout', '60', "app:create_app('test')"]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--backlog', '4096', '--no-access-log', '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    wait_until_up(f'http://127.0.0.1:{port}/api/v1/health/')
+    return process
+
+
+def stop(process):
+    """Stops a process started by start_server/start_fake_mailgun (and its workers)."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        process.terminate()
+    process.wait(timeout=30)
@@ -0,0 +1,322 @@
+"""
+Load test for /api/v1/mail/subscribers against the local fake Mailgun.
+
+Drives a weighted mix of GET (one member), POST (add), PUT (update) and
+DELETE requests at a fixed concurrency for a fixed duration, then reports
+requests per second, p50/p95/p99 latency and error rates per operation.
+Results can be written as JSON (tagged with the git commit) and compared with
+an earlier run.
+
+By default the fake Mailgun and the app are started as subprocesses
+(`--serve sync` runs gunicorn, `--serve async` runs uvicorn). With
+`--base-url` an already running app is used instead; it must point at a fake
+Mailgun pre-populated with `--members` members and share API_SECRET with this
+process. Started servers run with inbound throttling and the outbound Mailgun
+rate limit off unless re-enabled with `--env`.
+
+Usage:
+    python -m benchmarks.loadtest [--serve sync|async] [--concurrency 100] [--duration 20]
+        [--mix get=70,post=10,put=15,delete=5] [--latency 0.05] [--error-rate 0.01]
+        [--rate-limit 500] [--env KEY=VALUE ...] [--output run.json] [--compare baseline.json]
+
+Requires aiohttp (pip install -r requirements-async.txt).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+import aiohttp
+from auth.decorators import compute_signature
+from benchmarks.harness import (ROOT, free_port, raise_fd_limit, server_env, start_fake_mailgun, start_server,
+                                stop, tree_rss_mb)
+
+OPERATIONS = ('get', 'post', 'put', 'delete')
+ACTIONS = {'put': 'subscribe-update', 'delete': 'subscribe-delete'}
+PERCENTILES = (0.50, 0.95, 0.99)
+
+
+def parse_mix(value):
+    """Parses 'get=70,post=10,...' into {operation: weight}."""
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip().lower()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}' (expected one of {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class OperationStats:
+    """Latencies and status codes for one operation."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.exceptions = 0
+        self.errors = 0
+
+    def record(self, status, latency, expected):
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if status in expected:
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+
+    def as_dict(self, elapsed):
+        latencies = sorted(self.latencies)
+        total = len(latencies) + self.errors + self.exceptions
+        result = {
+            'requests': total,
+            'ok': len(latencies),
+            'errors': self.errors,
+            'exceptions': self.exceptions,
+            'error_rate': round((self.errors + self.exceptions) / total, 4) if total else 0.0,
+            'rps': round(total / elapsed, 1),
+            'statuses': self.statuses,
+        }
+        for p in PERCENTILES:
+            key = f"p{int(p * 100)}_ms"
+            result[key] = round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+        result['mean_ms'] = round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None
+        result['max_ms'] = round(latencies[-1] * 1000, 2) if latencies else None
+        return result
+
+
+class LoadTest:
+    """Closed-loop load generator: `concurrency` workers, each sending one request at a time."""
+
+    def __init__(self, base_url, api_secret, mix, members, concurrency):
+        self.base_url = base_url.rstrip('/')
+        self.api_secret = api_secret
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.members = [f"member{i:06d}@example.com" for i in range(members)]
+        self.concurrency = concurrency
+        self.created = []
+        self.stats = {name: OperationStats() for name in self.operations}
+        self._nonce_prefix = uuid.uuid4().hex[:8]
+        self._nonce = 0
+
+    def _signed_headers(self, operation):
+        # A fresh nonce per request: signatures are single-use
+        self._nonce += 1
+        nonce = f"{self._nonce_prefix}-{self._nonce}"
+        timestamp = str(int(time.time()))
+        signature = compute_signature(self.api_secret, timestamp, ACTIONS[operation], nonce)
+        return {'X-Timestamp': timestamp, 'X-Signature': signature, 'X-Nonce': nonce}
+
+    def _request(self, operation):
+        """Returns (method, url, kwargs, expected statuses) for the next request of `operation`."""
+        url = f"{self.base_url}/api/v1/mail/subscribers/"
+        if operation == 'post':
+            address = f"load-{uuid.uuid4().hex[:12]}@example.com"
+            self.created.append(address)
+            return 'POST', url, {'data': {'address': address, 'name': 'Load Test'}}, (200, 202)
+        if operation == 'delete' and self.created:
+            address = self.created.pop(random.randrange(len(self.created)))
+            return 'DELETE', url + address, {'headers': self._signed_headers('delete')}, (200, 404)
+        if operation == 'delete':
+            # Nothing created yet: deleting an unknown address still exercises the full path
+            address = f"missing-{uuid.uuid4().hex[:12]}@example.com"
+            return 'DELETE', url + address, {'headers': self._signed_headers('delete')}, (404,)
+        address = random.choice(self.members)
+        if operation == 'put':
+            return 'PUT', url + address, {'data': {'name': f"Updated {random.randrange(1000)}"},
+                                          'headers': self._signed_headers('put')}, (200, 404)
+        return 'GET', url + address, {}, (200, 404)
+
+    async def run(self, duration, warmup=0):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+            if warmup:
+                await self._run_workers(session, warmup, record=False)
+                self.stats = {name: OperationStats() for name in self.operations}
+            started = time.monotonic()
+            await self._run_workers(session, duration, record=True)
+            return time.monotonic() - started
+
+    async def _run_workers(self, session, duration, record):
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            while time.monotonic() < deadline:
+                operation = random.choices(self.operations, self.weights)[0]
+                method, url, kwargs, expected = self._request(operation)
+                start = time.monotonic()
+                try:
+                    async with session.request(method, url, **kwargs) as response:
+                        await response.read()
+                        status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if record:
+                        self.stats[operation].exceptions += 1
+                    continue
+                if record:
+                    self.stats[operation].record(status, time.monotonic() - start, expected)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def report(self, elapsed):
+        operations = {name: stats.as_dict(elapsed) for name, stats in self.stats.items()}
+        total = sum(op['requests'] for op in operations.values())
+        failed = sum(op['errors'] + op['exceptions'] for op in operations.values())
+        latencies = sorted(latency for stats in self.stats.values() for latency in stats.latencies)
+        overall = {
+            'requests': total,
+            'rps': round(total / elapsed, 1),
+            'error_rate': round(failed / total, 4) if total else 0.0,
+            'elapsed_s': round(elapsed, 2),
+        }
+        for p in PERCENTILES:
+            overall[f"p{int(p * 100)}_ms"] = (
+                round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None)
+        return overall, operations
+
+
+def _get_json(url):
+    try:
+        import urllib.request
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline):
+    """Prints per-operation RPS and latency changes against a baseline result file."""
+    print(f"\nCompared with {baseline['meta'].get('git_commit') or 'baseline'} "
+          f"({baseline['meta'].get('timestamp', '?')}):")
+    print(f"{'operation':<10} {'metric':<8} {'baseline':>10} {'current':>10} {'change':>9}")
+    rows = [('overall', current['overall'], baseline.get('overall', {}))]
+    rows += [(name, op, baseline.get('operations', {}).get(name, {})) for name, op in current['operations'].items()]
+    for name, now, before in rows:
+        for metric in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate'):
+            old, new = before.get(metric), now.get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+            print(f"{name:<10} {metric:<8} {old:>10} {new:>10} {change:>9}")
+
+
+def print_report(result):
+    meta = result['meta']
+    print(f"{meta['mode']} | concurrency {meta['concurrency']} | {meta['duration']}s | "
+          f"commit {meta.get('git_commit') or '?'}{' (dirty)' if meta.get('git_dirty') else ''}")
+    print(f"{'operation':<10} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>8}")
+    rows = list(result['operations'].items()) + [('overall', result['overall'])]
+    for name, op in rows:
+        print(f"{name:<10} {op['requests']:>9} {op['rps']:>8} {op['p50_ms']!s:>8} {op['p95_ms']!s:>8} "
+              f"{op['p99_ms']!s:>8} {op['error_rate'] * 100:>7.2f}%")
+    if result.get('server', {}).get('rss_mb') is not None:
+        print(f"server RSS: {result['server']['rss_mb']} MB")
+    if result.get('fake_mailgun'):
+        print(f"fake Mailgun: {result['fake_mailgun']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--serve', choices=('sync', 'async'), default='sync', help='Serving mode to start')
+    parser.add_argument('--base-url', help='Use an already running app instead of starting one')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=20, help='Measured seconds')
+    parser.add_argument('--warmup', type=float, default=2, help='Unmeasured seconds before the run')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('get=70,post=10,put=15,delete=5'))
+    parser.add_argument('--members', type=int, default=1000, help='Members in the fake list')
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake Mailgun latency (seconds)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Fake Mailgun extra random latency (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fake Mailgun injected 5xx rate')
+    parser.add_argument('--rate-limit', type=float, default=None, help='Fake Mailgun requests/s before 429')
+    parser.add_argument('--sync-workers', type=int, default=4)
+    parser.add_argument('--sync-threads', type=int, default=1)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra app config for the started server (repeatable)')
+    parser.add_argument('--output', help='Write the JSON result to this file')
+    parser.add_argument('--compare', help='Compare with an earlier JSON result')
+    parser.add_argument('--json', action='store_true', help='Print the JSON result instead of a table')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    fake = server = None
+    fake_port = None
+    api_secret = os.environ.get('API_SECRET', 'benchmark-secret')
+    try:
+        if args.base_url:
+            base_url = args.base_url
+        else:
+            fake_port = free_port()
+            fake_args = ['--jitter', str(args.jitter), '--error-rate', str(args.error_rate)]
+            if args.rate_limit:
+                fake_args += ['--rate-limit', str(args.rate_limit)]
+            fake = start_fake_mailgun(fake_port, latency=args.latency, members=args.members, extra_args=fake_args)
+            # The app's outbound limit (20 req/s by default) would otherwise cap every run;
+            # re-enable it with --env MAILGUN_RATE_LIMIT_ENABLED=true
+            overrides = {'MAILGUN_RATE_LIMIT_ENABLED': 'false'}
+            overrides.update(item.split('=', 1) for item in args.env)
+            env = server_env(fake_port, max(args.concurrency, 10), overrides)
+            api_secret = env['API_SECRET']
+            port = free_port()
+            server = start_server(args.serve, port, env, args.sync_workers, args.sync_threads)
+            base_url = f"http://127.0.0.1:{port}"
+
+        test = LoadTest(base_url, api_secret, args.mix, args.members, args.concurrency)
+        elapsed = asyncio.run(test.run(args.duration, warmup=args.warmup))
+        overall, operations = test.report(elapsed)
+        result = {
+            'meta': {
+                'git_commit': _git('rev-parse', '--short', 'HEAD'),
+                'git_dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'mode': 'external' if args.base_url else args.serve,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'mix': args.mix,
+                'fake_mailgun': {'latency': args.latency, 'jitter': args.jitter,
+                                 'error_rate': args.error_rate, 'rate_limit': args.rate_limit},
+                'env': args.env,
+            },
+            'overall': overall,
+            'operations': operations,
+            'server': {
+                'rss_mb': tree_rss_mb(server.pid) if server is not None else None,
+                'health': _get_json(f"{base_url.rstrip('/')}/api/v1/health/"),
+            },
+            'fake_mailgun': _get_json(f"http://127.0.0.1:{fake_port}/_stats") if fake_port else None,
+        }
+    finally:
+        if server is not None:
+            stop(server)
+        if fake is not None:
+            fake.terminate()
+            fake.wait(timeout=10)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(result)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(result, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
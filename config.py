@@ -1,8 +1,16 @@
 import os
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+# Settings are read from the environment when this module is first imported; create_app loads
+# the .env file (if any) before importing it
+
+
+def _env_bool(name, default):
+    """Reads a boolean flag from the environment ('1', 'true', 'yes', 'on' are truthy)."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
 
 class Config:
     """Base configuration."""
@@ -11,18 +19,187 @@ class Config:
     TESTING = False
     MAILGUN_API_KEY = os.environ.get('MAILGUN_API_KEY')
     MAILGUN_LIST_ADDRESS = os.environ.get('MAILGUN_LIST_ADDRESS')
-    MAILGUN_API_BASE_URL = "https://api.mailgun.net/v3"
+    MAILGUN_API_BASE_URL = os.environ.get('MAILGUN_API_BASE_URL', "https://api.mailgun.net/v3")  # e.g. EU region or a local fake
+    # More lists served by the same deployment, at /api/v1/mail/lists/<name>/subscribers: "name=address,..." or a
+    # JSON object. MAILGUN_LIST_ADDRESS stays the default list (behind /mail/subscribers) under its own name here or
+    # MAILGUN_DEFAULT_LIST_NAME. Each list gets its own Mailgun connection pool (MAILGUN_POOL_*) and circuit breakers
+    MAILGUN_LISTS = os.environ.get('MAILGUN_LISTS', '')
+    MAILGUN_DEFAULT_LIST_NAME = os.environ.get('MAILGUN_DEFAULT_LIST_NAME', 'default')
+    MAILGUN_FANOUT_CONCURRENCY = int(os.environ.get('MAILGUN_FANOUT_CONCURRENCY', 8))  # Lists called at once per worker
     API_SECRET = os.environ.get('API_SECRET') # Load the API secret
+    # Reject signed requests whose (timestamp, signature) was already accepted within the window
+    SIGNATURE_REPLAY_PROTECTION = _env_bool('SIGNATURE_REPLAY_PROTECTION', True)
+    SIGNATURE_REPLAY_CACHE_SIZE = int(os.environ.get('SIGNATURE_REPLAY_CACHE_SIZE', 100000))
+    # Tokens minted by GET /api/v1/auth/token: allowed actions, lifetime and sharing bucket (seconds)
+    AUTH_TOKEN_ACTIONS = os.environ.get('AUTH_TOKEN_ACTIONS', 'subscribe-add')
+    AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 300))
+    AUTH_TOKEN_BUCKET_SECONDS = int(os.environ.get('AUTH_TOKEN_BUCKET_SECONDS', 60))
+    SUBSCRIBE_FORM_MAX_AGE = int(os.environ.get('SUBSCRIBE_FORM_MAX_AGE', 3600))  # Cache-Control for /subscribe-example
+    # Swagger UI at /api/v1/doc/ and its spec at /api/v1/swagger.json (generated on first request); false = 404
+    API_DOCS_ENABLED = _env_bool('API_DOCS_ENABLED', True)
+
+    # Mailgun HTTP client: connection pool size per worker, timeouts and keep-alive
+    MAILGUN_POOL_CONNECTIONS = int(os.environ.get('MAILGUN_POOL_CONNECTIONS', 4))
+    MAILGUN_POOL_MAXSIZE = int(os.environ.get('MAILGUN_POOL_MAXSIZE', 10))
+    MAILGUN_POOL_BLOCK = _env_bool('MAILGUN_POOL_BLOCK', False)
+    MAILGUN_CONNECT_TIMEOUT = float(os.environ.get('MAILGUN_CONNECT_TIMEOUT', 3.05))
+    MAILGUN_READ_TIMEOUT = float(os.environ.get('MAILGUN_READ_TIMEOUT', 10))
+    MAILGUN_KEEP_ALIVE = _env_bool('MAILGUN_KEEP_ALIVE', True)
+    # Async serving mode (asgi.py): connection pool of the aiohttp session per process
+    MAILGUN_ASYNC_MAX_CONNECTIONS = int(os.environ.get('MAILGUN_ASYNC_MAX_CONNECTIONS', 100))
+    MAILGUN_ASYNC_KEEPALIVE_TIMEOUT = float(os.environ.get('MAILGUN_ASYNC_KEEPALIVE_TIMEOUT', 15))
+    # Resilience: retries with jittered exponential backoff (honoring Retry-After), a retry
+    # budget so retries can't amplify load, and a circuit breaker per Mailgun endpoint
+    MAILGUN_RETRY_MAX_ATTEMPTS = int(os.environ.get('MAILGUN_RETRY_MAX_ATTEMPTS', 3))  # Including the first try
+    MAILGUN_RETRY_BASE_DELAY = float(os.environ.get('MAILGUN_RETRY_BASE_DELAY', 0.2))
+    MAILGUN_RETRY_MAX_DELAY = float(os.environ.get('MAILGUN_RETRY_MAX_DELAY', 2))
+    MAILGUN_RETRY_MAX_RETRY_AFTER = float(os.environ.get('MAILGUN_RETRY_MAX_RETRY_AFTER', 5))
+    MAILGUN_RETRY_BUDGET_RATIO = float(os.environ.get('MAILGUN_RETRY_BUDGET_RATIO', 0.2))
+    MAILGUN_RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get('MAILGUN_RETRY_BUDGET_MIN_PER_SECOND', 1))
+    MAILGUN_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('MAILGUN_BREAKER_FAILURE_THRESHOLD', 5))
+    MAILGUN_BREAKER_RESET_TIMEOUT = float(os.environ.get('MAILGUN_BREAKER_RESET_TIMEOUT', 30))
+
+    # Outbound rate limit: token bucket shared by all workers on the host (weights: reads vs writes)
+    MAILGUN_RATE_LIMIT_ENABLED = _env_bool('MAILGUN_RATE_LIMIT_ENABLED', True)
+    MAILGUN_RATE_LIMIT_RATE = float(os.environ.get('MAILGUN_RATE_LIMIT_RATE', 20))  # Tokens per second
+    MAILGUN_RATE_LIMIT_BURST = float(os.environ.get('MAILGUN_RATE_LIMIT_BURST', 40))
+    MAILGUN_RATE_LIMIT_READ_WEIGHT = float(os.environ.get('MAILGUN_RATE_LIMIT_READ_WEIGHT', 1))
+    MAILGUN_RATE_LIMIT_WRITE_WEIGHT = float(os.environ.get('MAILGUN_RATE_LIMIT_WRITE_WEIGHT', 2))
+    MAILGUN_RATE_LIMIT_WEIGHTS = os.environ.get('MAILGUN_RATE_LIMIT_WEIGHTS')  # e.g. "add_list_members_bulk=10"
+    MAILGUN_RATE_LIMIT_MAX_WAIT = float(os.environ.get('MAILGUN_RATE_LIMIT_MAX_WAIT', 1))  # 0 = fail fast with 503
+    MAILGUN_RATE_LIMIT_BACKGROUND_MAX_WAIT = float(os.environ.get('MAILGUN_RATE_LIMIT_BACKGROUND_MAX_WAIT', 30))
+    MAILGUN_RATE_LIMIT_SHARED = _env_bool('MAILGUN_RATE_LIMIT_SHARED', True)
+    MAILGUN_RATE_LIMIT_PATH = os.environ.get('MAILGUN_RATE_LIMIT_PATH', 'mailgun_rate_limit.bucket')
+
+    # Concurrent identical reads (same member, or the list) within a worker share one Mailgun call
+    MAILGUN_COALESCE_READS = _env_bool('MAILGUN_COALESCE_READS', True)
+
+    # Members requested per Mailgun page when paging through the list (Mailgun max is 100)
+    MAILGUN_PAGE_SIZE = min(int(os.environ.get('MAILGUN_PAGE_SIZE', 100)), 100)
+
+    # Subscriber read cache: in-process LRU with TTLs, plus an optional shared Redis backend
+    SUBSCRIBER_CACHE_ENABLED = _env_bool('SUBSCRIBER_CACHE_ENABLED', True)
+    SUBSCRIBER_CACHE_MAXSIZE = int(os.environ.get('SUBSCRIBER_CACHE_MAXSIZE', 10000))
+    SUBSCRIBER_CACHE_TTL = int(os.environ.get('SUBSCRIBER_CACHE_TTL', 60))
+    SUBSCRIBER_CACHE_LIST_TTL = int(os.environ.get('SUBSCRIBER_CACHE_LIST_TTL', 30))
+    SUBSCRIBER_CACHE_NEGATIVE_TTL = int(os.environ.get('SUBSCRIBER_CACHE_NEGATIVE_TTL', 30))
+    SUBSCRIBER_CACHE_REDIS_URL = os.environ.get('SUBSCRIBER_CACHE_REDIS_URL')  # e.g. redis://localhost:6379/0
+    SUBSCRIBER_CACHE_LOCAL_TTL = int(os.environ.get('SUBSCRIBER_CACHE_LOCAL_TTL', 5))  # Local copy TTL when shared
+
+    # Inbound rate limiting per client IP ("<requests>/<seconds>"); per-route overrides are keyed
+    # by "METHOD rule" relative to /api/v1 and can be replaced with a JSON object in API_RATE_LIMITS
+    API_RATE_LIMIT_ENABLED = _env_bool('API_RATE_LIMIT_ENABLED', True)
+    API_RATE_LIMIT_DEFAULT = os.environ.get('API_RATE_LIMIT_DEFAULT', '120/60')
+    API_RATE_LIMIT_GLOBAL = os.environ.get('API_RATE_LIMIT_GLOBAL', '300/60')
+    API_RATE_LIMITS = os.environ.get('API_RATE_LIMITS') or {
+        'POST /mail/subscribers/': '10/60',
+        'GET /mail/subscribers/<string:member_address>': '60/60',
+        'POST /mail/subscribers/bulk': '5/60',
+        'GET /mail/subscribers/export': '5/60',
+        'GET /auth/token': '30/60',
+        'POST /mail/lists/<string:list_name>/subscribers/': '10/60',
+        'GET /mail/lists/<string:list_name>/subscribers/<string:member_address>': '60/60',
+        'POST /mail/subscriptions': '10/60',
+        'GET /mail/subscriptions/<string:member_address>': '60/60',
+        'POST /webhooks/mailgun': 'unlimited',  # Signed by Mailgun, which delivers in bursts from few IPs
+    }
+    API_RATE_LIMIT_REDIS_URL = os.environ.get('API_RATE_LIMIT_REDIS_URL')  # Share counters across workers/hosts
+    API_RATE_LIMIT_TRUST_PROXY = _env_bool('API_RATE_LIMIT_TRUST_PROXY', False)  # Use X-Forwarded-For
 
-    # Basic validation
-    if not MAILGUN_API_KEY:
-        raise ValueError("No MAILGUN_API_KEY set for Flask application")
-    if not MAILGUN_LIST_ADDRESS:
-        raise ValueError("No MAILGUN_LIST_ADDRESS set for Flask application")
-    # Add validation for API_SECRET, especially in production
-    # Consider adding:
-    # if not API_SECRET and os.getenv('FLASK_CONFIG') == 'prod':
-    #     raise ValueError("No API_SECRET set for Flask application in production")
+    # HTTP caching for GET responses under /api/v1: Cache-Control policies keyed by "METHOD rule" (a JSON
+    # object in API_CACHE_CONTROL replaces them), weak content-hash ETags answered with 304 on If-None-Match,
+    # and gzip (brotli too when the 'brotli' package is installed) for bodies of API_COMPRESSION_MIN_SIZE bytes
+    API_CACHE_CONTROL = os.environ.get('API_CACHE_CONTROL') or {
+        'GET /mail/subscribers/': 'private, no-cache',
+        'GET /mail/subscribers/count': 'private, no-cache',
+        'GET /mail/subscribers/<string:member_address>': 'private, no-cache',
+        'GET /mail/lists/<string:list_name>/subscribers/': 'private, no-cache',
+        'GET /mail/lists/<string:list_name>/subscribers/count': 'private, no-cache',
+        'GET /mail/lists/<string:list_name>/subscribers/<string:member_address>': 'private, no-cache',
+        'GET /mail/subscriptions/<string:member_address>': 'private, no-cache',
+        'GET /mail/jobs/<string:job_id>': 'no-store',
+        'GET /health/': 'no-store',
+    }
+    API_CACHE_CONTROL_DEFAULT = os.environ.get('API_CACHE_CONTROL_DEFAULT', 'no-cache')  # Other GET routes
+    API_ETAGS_ENABLED = _env_bool('API_ETAGS_ENABLED', True)
+    API_COMPRESSION_ENABLED = _env_bool('API_COMPRESSION_ENABLED', True)
+    API_COMPRESSION_ENCODINGS = os.environ.get('API_COMPRESSION_ENCODINGS', 'br,gzip')  # Server preference order
+    API_COMPRESSION_MIN_SIZE = int(os.environ.get('API_COMPRESSION_MIN_SIZE', 1024))
+    API_COMPRESSION_GZIP_LEVEL = int(os.environ.get('API_COMPRESSION_GZIP_LEVEL', 6))
+    API_COMPRESSION_BROTLI_QUALITY = int(os.environ.get('API_COMPRESSION_BROTLI_QUALITY', 5))
+    API_RESPONSE_MEMO_BYTES = int(os.environ.get('API_RESPONSE_MEMO_BYTES', 16 * 1024 * 1024))  # 0 = no memo
+
+    # Queued writes: POST /subscribers returns 202 and a background dispatcher delivers to Mailgun
+    WRITE_QUEUE_ENABLED = _env_bool('WRITE_QUEUE_ENABLED', False)
+    WRITE_QUEUE_PATH = os.environ.get('WRITE_QUEUE_PATH', 'write_queue.sqlite3')
+    WRITE_QUEUE_BATCH_SIZE = int(os.environ.get('WRITE_QUEUE_BATCH_SIZE', 50))
+    WRITE_QUEUE_MAX_ATTEMPTS = int(os.environ.get('WRITE_QUEUE_MAX_ATTEMPTS', 5))
+    WRITE_QUEUE_RETRY_DELAY = float(os.environ.get('WRITE_QUEUE_RETRY_DELAY', 2))  # Doubles per attempt
+    WRITE_QUEUE_POLL_INTERVAL = float(os.environ.get('WRITE_QUEUE_POLL_INTERVAL', 0.5))
+    WRITE_QUEUE_USE_BULK = _env_bool('WRITE_QUEUE_USE_BULK', True)
+
+    # Local subscriber mirror: SQLite copy of the list, synced periodically and written through on updates
+    MIRROR_ENABLED = _env_bool('MIRROR_ENABLED', False)
+    MIRROR_PATH = os.environ.get('MIRROR_PATH', 'subscriber_mirror.sqlite3')
+    MIRROR_SYNC_INTERVAL = float(os.environ.get('MIRROR_SYNC_INTERVAL', 300))  # Seconds between syncs
+    MIRROR_MAX_STALENESS = float(os.environ.get('MIRROR_MAX_STALENESS', 600))  # Default bound for mirror reads
+    MIRROR_DEFAULT_SOURCE = os.environ.get('MIRROR_DEFAULT_SOURCE', 'mailgun')  # 'mirror' = serve GETs locally
+
+    # Write coalescing: PUT /subscribers/<address> returns 202 and updates to the same address arriving
+    # within WRITE_COALESCE_WINDOW seconds are merged (last write wins per field) into one Mailgun PUT
+    WRITE_COALESCE_ENABLED = _env_bool('WRITE_COALESCE_ENABLED', False)
+    WRITE_COALESCE_WINDOW = float(os.environ.get('WRITE_COALESCE_WINDOW', 0.25))
+    WRITE_COALESCE_CONCURRENCY = int(os.environ.get('WRITE_COALESCE_CONCURRENCY', 4))  # Merged PUTs sent in parallel
+    # A PUT failing with 429/5xx (or Mailgun unavailable) is retried with backoff, up to WRITE_COALESCE_MAX_ATTEMPTS sends
+    WRITE_COALESCE_MAX_ATTEMPTS = int(os.environ.get('WRITE_COALESCE_MAX_ATTEMPTS', 5))
+    WRITE_COALESCE_RETRY_DELAY = float(os.environ.get('WRITE_COALESCE_RETRY_DELAY', 1))  # Doubles per attempt
+    WRITE_COALESCE_RETRY_MAX_DELAY = float(os.environ.get('WRITE_COALESCE_RETRY_MAX_DELAY', 30))
+
+    # Mailgun webhooks (POST /api/v1/webhooks/mailgun): signed events are acknowledged at once, buffered
+    # in memory and applied in batches to the subscriber mirror and cache by a background worker
+    WEBHOOKS_ENABLED = _env_bool('WEBHOOKS_ENABLED', False)
+    MAILGUN_WEBHOOK_SIGNING_KEY = os.environ.get('MAILGUN_WEBHOOK_SIGNING_KEY')  # Mailgun: Webhooks > signing key
+    WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 10000))  # Events buffered per worker, then 503
+    WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 500))
+    WEBHOOK_BATCH_LINGER = float(os.environ.get('WEBHOOK_BATCH_LINGER', 0.05))  # Seconds to wait for more events
+    WEBHOOK_REPLAY_CACHE_SIZE = int(os.environ.get('WEBHOOK_REPLAY_CACHE_SIZE', 500000))
+
+    # Logging: records are queued and written by a background thread as JSON lines ('text' for the
+    # classic format); repeated messages beyond LOG_SAMPLE_BURST per LOG_SAMPLE_WINDOW seconds are dropped
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_ASYNC = _env_bool('LOG_ASYNC', True)  # false = synchronous stderr handler, no sampling
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # Records beyond this are dropped
+    LOG_SAMPLE_BURST = int(os.environ.get('LOG_SAMPLE_BURST', 20))  # 0 = no sampling
+    LOG_SAMPLE_WINDOW = float(os.environ.get('LOG_SAMPLE_WINDOW', 1))
+    LOG_SAMPLE_MAX_LEVEL = os.environ.get('LOG_SAMPLE_MAX_LEVEL', 'WARNING')  # Errors are never sampled
+    LOG_SKIP_THREAD_INFO = _env_bool('LOG_SKIP_THREAD_INFO', False)  # Process-wide: affects every logger
+
+    # Metrics at /metrics (Prometheus text format); each worker writes a snapshot file to METRICS_DIR
+    # (defaults to ./metrics, '' = this process only) and scrapes merge all of them
+    METRICS_ENABLED = _env_bool('METRICS_ENABLED', True)
+    METRICS_PATH = os.environ.get('METRICS_PATH', '/metrics')
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))  # Seconds
+    METRICS_LATENCY_BUCKETS = os.environ.get('METRICS_LATENCY_BUCKETS')  # e.g. "0.01,0.05,0.1,0.5,1"
+
+    # Bulk import: members per members.json call (Mailgun max is 1000) and chunks uploaded in parallel
+    BULK_IMPORT_CHUNK_SIZE = min(int(os.environ.get('BULK_IMPORT_CHUNK_SIZE', 1000)), 1000)
+    BULK_IMPORT_CONCURRENCY = int(os.environ.get('BULK_IMPORT_CONCURRENCY', 4))
+
+    @classmethod
+    def validate(cls):
+        """Basic validation, run by create_app for the configuration it uses (raises ValueError)."""
+        if not cls.MAILGUN_API_KEY:
+            raise ValueError("No MAILGUN_API_KEY set for Flask application")
+        if not cls.MAILGUN_LIST_ADDRESS:
+            raise ValueError("No MAILGUN_LIST_ADDRESS set for Flask application")
+        if cls.WEBHOOKS_ENABLED and not cls.MAILGUN_WEBHOOK_SIGNING_KEY:
+            raise ValueError("WEBHOOKS_ENABLED requires MAILGUN_WEBHOOK_SIGNING_KEY")
+        # Add validation for API_SECRET, especially in production
+        # Consider adding:
+        # if not cls.API_SECRET and cls is ProductionConfig:
+        #     raise ValueError("No API_SECRET set for Flask application in production")
 
 
 class DevelopmentConfig(Config):
@@ -41,9 +218,13 @@ class TestingConfig(Config):
 class ProductionConfig(Config):
     """Production configuration."""
     DEBUG = False
-    # Ensure SECRET_KEY is set in production
-    if Config.SECRET_KEY == 'a_default_secret_key_for_dev':
-         raise ValueError("SECRET_KEY must be set in production environment")
+
+    @classmethod
+    def validate(cls):
+        super().validate()
+        # Ensure SECRET_KEY is set in production
+        if cls.SECRET_KEY == 'a_default_secret_key_for_dev':
+            raise ValueError("SECRET_KEY must be set in production environment")
 
 
 config_by_name = dict(
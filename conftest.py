@@ -0,0 +1,49 @@
+import pytest
+from flask import Flask
+from api import blueprint as api_blueprint
+from benchmarks import fake_mailgun
+from services import cache, mail_lists, mailgun_client, mirror, single_flight
+
+LIST_ADDRESS = 'list@example.com'
+
+
+@pytest.fixture(scope="session")
+def fake_server():
+    """In-memory fake Mailgun (benchmarks/fake_mailgun.py) on a local port: (fake, port)."""
+    return fake_mailgun.start_in_thread(members=1)
+
+
+@pytest.fixture(scope="session")
+def mailgun_url(fake_server):
+    _, port = fake_server
+    return f"http://127.0.0.1:{port}/v3/lists/{LIST_ADDRESS}/members/member000000@example.com"
+
+
+@pytest.fixture
+def make_app(fake_server, tmp_path):
+    """
+    Builds a bare app with the API blueprint, the Mailgun client, cache and mirror,
+    pointed at the fake and without background threads. Keyword arguments are config.
+    """
+    _, port = fake_server
+
+    def make(*extensions, **config):
+        app = Flask(__name__)
+        app.config.update(
+            MAILGUN_API_KEY='key-test',
+            MAILGUN_API_BASE_URL=f"http://127.0.0.1:{port}/v3",
+            MAILGUN_LIST_ADDRESS=LIST_ADDRESS,
+            MAILGUN_RATE_LIMIT_ENABLED=False,
+            API_RATE_LIMIT_ENABLED=False,
+            API_SECRET='s3cret',
+            MIRROR_ENABLED=True,
+            MIRROR_PATH=str(tmp_path / 'mirror.sqlite3'),
+            MIRROR_START_SYNC=False,
+        )
+        app.config.update(config)
+        for extension in (mail_lists, mailgun_client, cache, single_flight, mirror, *extensions):
+            extension.init_app(app)
+        app.register_blueprint(api_blueprint)
+        return app
+
+    return make
@@ -0,0 +1,184 @@
+import time
+import asyncio
+import logging
+import aiohttp
+from services.resilience import Resilience, RETRYABLE_STATUSES, parse_retry_after
+from services.rate_limiter import RateLimiter, SharedTokenBucket
+from services.errors import MailgunUnavailable
+
+log = logging.getLogger(__name__)
+
+# Transport-level failures of an aiohttp call (timeouts surface as asyncio.TimeoutError too)
+CLIENT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class AsyncMailgunClient:
+    """
+    Pooled, keep-alive asyncio HTTP client for the Mailgun API (async serving mode).
+
+    The asyncio counterpart of services.mailgun_client.MailgunClient: one
+    aiohttp session per event loop with a bounded connection pool, connect and
+    read timeouts on every call, and the same retry policy, retry budget,
+    circuit breakers and outbound rate limiter. Waiting (backoff, rate-limit
+    tokens) happens on the event loop, so thousands of calls can be in flight
+    without holding a thread each.
+    """
+
+    def __init__(self, api_key, base_url, max_connections=100, keepalive_timeout=15.0,
+                 connect_timeout=3.05, read_timeout=10.0, keep_alive=True,
+                 resilience=None, rate_limiter=None, metrics=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.keep_alive = keep_alive
+        self.resilience = resilience or Resilience.from_config({})
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self._session = None
+
+    @classmethod
+    def from_config(cls, config, resilience=None, rate_limiter=None, metrics=None):
+        """
+        Builds a client from a Flask config mapping.
+
+        Pass the sync client's `resilience`, `rate_limiter` and `metrics` to share
+        breakers, retry budget, the outbound rate limit and metrics with the WSGI
+        code in the same process.
+        """
+        return cls(
+            api_key=config['MAILGUN_API_KEY'],
+            base_url=config['MAILGUN_API_BASE_URL'],
+            max_connections=config.get('MAILGUN_ASYNC_MAX_CONNECTIONS', 100),
+            keepalive_timeout=config.get('MAILGUN_ASYNC_KEEPALIVE_TIMEOUT', 15.0),
+            connect_timeout=config.get('MAILGUN_CONNECT_TIMEOUT', 3.05),
+            read_timeout=config.get('MAILGUN_READ_TIMEOUT', 10.0),
+            keep_alive=config.get('MAILGUN_KEEP_ALIVE', True),
+            resilience=resilience or Resilience.from_config(config),
+            rate_limiter=rate_limiter if rate_limiter is not None else RateLimiter.from_config(config),
+            metrics=metrics,
+        )
+
+    @property
+    def session(self):
+        """Returns the aiohttp session, creating it on first use (inside the running event loop)."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout if self.keep_alive else None,
+                force_close=not self.keep_alive,
+            )
+            self._session = aiohttp.ClientSession(
+                auth=aiohttp.BasicAuth('api', self.api_key),
+                connector=connector,
+                timeout=self.timeout,
+            )
+            log.info("Created async Mailgun HTTP session (max_connections=%s)", self.max_connections)
+        return self._session
+
+    async def _limiter_call(self, func, *args):
+        """
+        Calls the rate limiter. The host-wide bucket takes an flock that other
+        processes may hold, so it runs on a thread instead of stalling the event loop.
+        """
+        if isinstance(self.rate_limiter.bucket, SharedTokenBucket):
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def request(self, method, url, operation=None, idempotent=None, **kwargs):
+        """
+        Sends a request through the pooled session; same retry semantics as
+        MailgunClient.request. Returns the response with its body already read
+        (use `response.status` and `await response.json()`); raises one of
+        CLIENT_ERRORS on transport failures.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'PUT', 'DELETE')
+        breaker = self.resilience.breaker(operation or method.upper())
+        policy = self.resilience.policy
+        budget = self.resilience.budget
+        budget.record_request()
+
+        attempt = 1
+        while True:
+            retry_after = None
+            try:
+                breaker.before_call()
+                try:
+                    if self.rate_limiter is not None:
+                        wait = await self._limiter_call(self.rate_limiter.reserve, method, operation)
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                except BaseException:
+                    # Rate limited or cancelled before sending: free a half-open breaker's trial slot
+                    breaker.cancel_call()
+                    raise
+            except MailgunUnavailable:
+                if attempt == 1:
+                    raise
+                # A retry refused locally: report the attempt that was sent (see MailgunClient.request)
+                if error is not None:
+                    raise error
+                return response
+            started = time.perf_counter()
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    await response.read()
+            except asyncio.CancelledError:
+                # The request was abandoned, not failed; its outcome says nothing about Mailgun
+                breaker.cancel_call()
+                raise
+            except CLIENT_ERRORS as e:
+                if self.metrics is not None:
+                    self.metrics.observe_mailgun(operation or method.upper(), 'error', time.perf_counter() - started)
+                breaker.record_failure()
+                # Only a failed connect guarantees the request never reached Mailgun
+                retryable = idempotent or isinstance(e, aiohttp.ConnectionTimeoutError)
+                error = e
+            else:
+                if self.metrics is not None:
+                    self.metrics.observe_mailgun(operation or method.upper(), response.status,
+                                                 time.perf_counter() - started)
+                if response.status not in RETRYABLE_STATUSES:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                retryable = idempotent or response.status == 429
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status == 429 and self.rate_limiter is not None:
+                    await self._limiter_call(self.rate_limiter.penalize, retry_after if retry_after is not None else 1.0)
+                error = None
+
+            delay = None
+            if retryable and attempt < policy.max_attempts:
+                delay = policy.compute_delay(attempt, retry_after)
+            if delay is None or not budget.try_spend():
+                if error is not None:
+                    raise error
+                return response
+
+            if self.metrics is not None:
+                self.metrics.mailgun_retries.inc(operation or method.upper())
+            log.warning("Retrying Mailgun %s %s in %.2fs (attempt %d/%d): %s", method, operation or '', delay,
+                        attempt + 1, policy.max_attempts, error if error is not None else response.status)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request('PUT', url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request('DELETE', url, **kwargs)
+
+    async def aclose(self):
+        """Closes the pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+from services.async_mailgun_client import CLIENT_ERRORS
+from services.errors import MailgunUnavailable
+
+log = logging.getLogger(__name__)
+
+
+async def _json(response):
+    """Decoded JSON body of a Mailgun response, or None if it isn't JSON."""
+    try:
+        return await response.json(content_type=None)
+    except ValueError:
+        return None
+
+
+def _http_error(response):
+    """Same wording as the requests HTTPError the sync service reports."""
+    kind = 'Client' if response.status < 500 else 'Server'
+    return f"{response.status} {kind} Error: {response.reason} for url: {response.url}"
+
+
+class AsyncMailgunService:
+    """
+    Async version of services.mailgun_service for the ASGI serving mode.
+
+    Same operations, results and error mapping ((dict, status_code) tuples), but
+    without a Flask app context: config, client, cache, mirror and read
+    coalescer are passed in. The subscriber cache is shared with the WSGI app
+    in the same process, so writes on either side invalidate reads on both;
+    writes are also written through to the subscriber mirror (SQLite, fast
+    enough to call inline).
+    """
+
+    def __init__(self, config, client, cache=None, mirror=None, single_flight=None):
+        self.client = client
+        self.cache = cache
+        self.mirror = mirror
+        self.single_flight = single_flight
+        self.list_address = config['MAILGUN_LIST_ADDRESS']
+        self.base_url = config['MAILGUN_API_BASE_URL']
+
+    def _list_members_url(self):
+        return f"{self.base_url}/lists/{self.list_address}/members"
+
+    def _member_url(self, member_address):
+        return f"{self.base_url}/lists/{self.list_address}/members/{member_address}"
+
+    def _invalidate_members(self, *member_addresses):
+        """Drops the cached list and member entries and detaches in-flight reads (called from `finally` after writes)."""
+        if self.single_flight is not None:
+            self.single_flight.forget(('get_list_members', self.list_address),
+                                      *(('get_member', self.list_address, address) for address in member_addresses))
+        if self.cache is None:
+            return
+        member_keys = [self.cache.member_key(self.list_address, address) for address in member_addresses]
+        self.cache.invalidate(self.cache.list_key(self.list_address), *member_keys)
+
+    async def _write_through(self, status, members, action='upsert'):
+        """
+        Same as mailgun_service._write_through; `status` is None when the call failed
+        in transport. SQLite may wait up to its busy timeout for another worker's
+        write, so the write runs on a thread, off the event loop.
+        """
+        if self.mirror is None or (status is not None and 400 <= status < 500):
+            return
+        uncertain = status is None or status >= 500
+        try:
+            if uncertain and action != 'upsert':
+                await asyncio.to_thread(self.mirror.mark_dirty, self.list_address,
+                                        [member['address'] for member in members])
+            elif action == 'delete':
+                await asyncio.to_thread(self.mirror.delete, self.list_address,
+                                        [member['address'] for member in members])
+            else:
+                await asyncio.to_thread(self.mirror.upsert, self.list_address, members, dirty=uncertain)
+        except Exception as e:
+            log.warning("Subscriber mirror write-through failed: %s", e)
+
+    async def get_list_members(self):
+        """Fetches all members from the configured Mailgun mailing list."""
+        if self.cache is not None:
+            cache_key = self.cache.list_key(self.list_address)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        return await self._coalesced(('get_list_members', self.list_address), self._fetch_list_members)
+
+    async def _coalesced(self, key, fetch):
+        """Concurrent identical reads on the event loop share one Mailgun call."""
+        if self.single_flight is None:
+            return await fetch()
+        return await self.single_flight.do_async(key, key[0], fetch)
+
+    async def _fetch_list_members(self):
+        if self.cache is not None:
+            cache_key = self.cache.list_key(self.list_address)
+            generation = self.cache.generation(cache_key)
+        url = self._list_members_url()
+        try:
+            log.info("Making GET request to Mailgun: %s", url)
+            response = await self.client.get(url, operation='get_list_members')
+        except CLIENT_ERRORS as e:
+            log.error("Mailgun API error (get_list_members): %r", e)
+            return {"message": f"Error fetching members: {e!r}"}, 500
+        if response.status >= 400:
+            log.error("Mailgun API error (get_list_members): %s", _http_error(response))
+            return {"message": f"Error fetching members: {_http_error(response)}"}, response.status
+        result = await _json(response)
+        if self.cache is not None:
+            self.cache.set(cache_key, result, 200, ttl=self.cache.list_ttl, generation=generation)
+        return result, 200
+
+    async def add_list_member(self, email, name=None, subscribed=True, upsert=True):
+        """Adds or updates a member in the configured Mailgun mailing list."""
+        url = self._list_members_url()
+        data = {
+            "address": email,
+            "subscribed": str(subscribed).lower(),
+            "upsert": str(upsert).lower()
+        }
+        if name:
+            data["name"] = name
+
+        log.info("Making POST request to Mailgun: %s", url)
+        member = {'address': email, 'name': name, 'subscribed': subscribed}
+        response = None
+        refused = False
+        try:
+            # An upsert can safely be retried; a plain create only on 429 / connect failures
+            response = await self.client.post(url, data=data, operation='add_list_member', idempotent=upsert)
+        except MailgunUnavailable:
+            refused = True  # Never sent (open breaker, rate limit): Mailgun and the mirror are unchanged
+            raise
+        except CLIENT_ERRORS as e:
+            log.error("Mailgun API error (add_list_member): %r", e)
+            return {"message": f"Error adding member: {e!r}"}, 500
+        finally:
+            self._invalidate_members(email)
+            if response is None and not refused:
+                await self._write_through(None, [member])
+        log.info("Mailgun response status: %s", response.status)
+        result = await _json(response)
+        echoed = result.get('member') if isinstance(result, dict) and response.status < 300 else None
+        await self._write_through(response.status, [{**member, **(echoed or {})}])
+        if response.status >= 400:
+            log.error("Mailgun API error (add_list_member): %s", _http_error(response))
+            # Prefer Mailgun's own error message when it sent one
+            message = (result or {}).get('message') if isinstance(result, dict) else None
+            return {"message": message or f"Error adding member: {_http_error(response)}"}, response.status
+        return result, response.status
+
+    async def get_member(self, member_address):
+        """Fetches a specific member from the configured Mailgun mailing list."""
+        if self.cache is not None:
+            cache_key = self.cache.member_key(self.list_address, member_address)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        return await self._coalesced(('get_member', self.list_address, member_address),
+                                     lambda: self._fetch_member(member_address))
+
+    async def _fetch_member(self, member_address):
+        if self.cache is not None:
+            cache_key = self.cache.member_key(self.list_address, member_address)
+            generation = self.cache.generation(cache_key)
+        url = self._member_url(member_address)
+        try:
+            log.info("Making GET request to Mailgun: %s", url)
+            response = await self.client.get(url, operation='get_member')
+        except CLIENT_ERRORS as e:
+            log.error("Mailgun API error (get_member): %r", e)
+            return {"message": f"Error fetching member: {e!r}"}, 500
+        if response.status == 404:
+            # Negative caching: remember that the member doesn't exist (shorter TTL)
+            result = {"message": "Member not found"}
+            if self.cache is not None:
+                self.cache.set(cache_key, result, 404, generation=generation)
+            return result, 404
+        if response.status >= 400:
+            log.error("Mailgun API error (get_member): %s", _http_error(response))
+            return {"message": f"Error fetching member: {_http_error(response)}"}, response.status
+        result = await _json(response)
+        if isinstance(result, dict) and result.get('member'):
+            # A fresh read also repairs the member's mirror row (e.g. one flagged dirty)
+            await self._write_through(200, [result['member']])
+        if self.cache is not None:
+            self.cache.set(cache_key, result, 200, generation=generation)
+        return result, 200
+
+    async def update_member(self, member_address, name=None, subscribed=None):
+        """Updates a specific member in the configured Mailgun mailing list."""
+        url = self._member_url(member_address)
+        data = {}
+        if name is not None:
+            data["name"] = name
+        if subscribed is not None:
+            data["subscribed"] = str(subscribed).lower()
+
+        if not data:
+            return {"message": "No update data provided"}, 400
+
+        log.info("Making PUT request to Mailgun: %s", url)
+        log.debug("Request data for Mailgun: %s", data)
+        member = {'address': member_address, 'name': name, 'subscribed': subscribed}
+        response = None
+        refused = False
+        try:
+            response = await self.client.put(url, data=data, operation='update_member')
+        except MailgunUnavailable:
+            refused = True  # Never sent (open breaker, rate limit): Mailgun and the mirror are unchanged
+            raise
+        except CLIENT_ERRORS as e:
+            log.error("Mailgun API error (update_member): %r", e)
+            return {"message": f"Error updating member: {e!r}"}, 500
+        finally:
+            self._invalidate_members(member_address)
+            if response is None and not refused:
+                await self._write_through(None, [member], 'update')
+        if response.status == 404:
+            return {"message": "Member not found"}, 404
+        if response.status >= 400:
+            await self._write_through(response.status, [member], 'update')
+            log.error("Mailgun API error (update_member): %s", _http_error(response))
+            return {"message": f"Error updating member: {_http_error(response)}"}, response.status
+        result = await _json(response)
+        echoed = result.get('member') if isinstance(result, dict) else None
+        await self._write_through(response.status, [{**member, **(echoed or {})}], 'update')
+        return result, 200
+
+    async def delete_member(self, member_address):
+        """Deletes a specific member from the configured Mailgun mailing list."""
+        url = self._member_url(member_address)
+        log.info("Making DELETE request to Mailgun: %s", url)
+        response = None
+        refused = False
+        try:
+            response = await self.client.delete(url, operation='delete_member')
+        except MailgunUnavailable:
+            refused = True  # Never sent (open breaker, rate limit): Mailgun and the mirror are unchanged
+            raise
+        except CLIENT_ERRORS as e:
+            log.error("Mailgun API error (delete_member): %r", e)
+            return {"message": f"Error deleting member: {e!r}"}, 500
+        finally:
+            self._invalidate_members(member_address)
+            if not refused:
+                await self._write_through(response.status if response is not None else None,
+                                    [{'address': member_address}], 'delete')
+        if response.status == 404:
+            return {"message": "Member not found"}, 404
+        if response.status >= 400:
+            log.error("Mailgun API error (delete_member): %s", _http_error(response))
+            return {"message": f"Error deleting member: {_http_error(response)}"}, response.status
+        # Mailgun delete returns 200 OK on success
+        return await _json(response), 200
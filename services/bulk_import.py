@@ -0,0 +1,240 @@
+import csv
+import io
+import json
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from flask import current_app
+from services import mailgun_service
+from services.errors import MailgunUnavailable
+from services.rate_limiter import wait_policy
+
+log = logging.getLogger(__name__)
+
+# Mailgun's members.json endpoint accepts at most 1000 members per call
+MAX_CHUNK_SIZE = 1000
+
+# Deliberately simple: one '@', no whitespace, a dot in the domain part
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# Keep at most this many invalid rows in the final report
+MAX_REPORTED_INVALID = 100
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on', 'y')
+FALSE_VALUES = ('0', 'false', 'no', 'off', 'n')
+
+
+def open_text_stream(binary_stream):
+    """Wraps a binary upload stream so it can be read line by line as UTF-8 text."""
+    if not isinstance(binary_stream, io.BufferedIOBase) and hasattr(binary_stream, 'readinto'):
+        binary_stream = io.BufferedReader(binary_stream)
+    return io.TextIOWrapper(binary_stream, encoding='utf-8-sig', errors='replace', newline='')
+
+
+def parse_csv(text_stream):
+    """
+    Yields (line_number, record) pairs from a CSV upload.
+
+    A header row with an 'address' (or 'email') column is used if present;
+    otherwise the first column is taken as the address and the second as the name.
+    """
+    reader = csv.reader(text_stream)
+    columns = None
+    for row in reader:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if columns is None:
+            header = [cell.strip().lower() for cell in row]
+            if 'address' in header or 'email' in header:
+                columns = {name: index for index, name in enumerate(header)}
+                if 'address' not in columns:
+                    columns['address'] = columns['email']
+                continue
+            columns = {'address': 0, 'name': 1}
+        record = {}
+        for field in ('address', 'name', 'subscribed'):
+            index = columns.get(field)
+            if index is not None and index < len(row) and row[index].strip():
+                record[field] = row[index].strip()
+        yield reader.line_num, record
+
+
+def parse_jsonl(text_stream):
+    """
+    Yields (line_number, record) pairs from a JSON-lines upload.
+
+    Each line is either an object with an 'address' key or a bare address string.
+    """
+    for line_number, line in enumerate(text_stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            yield line_number, {'_error': 'Invalid JSON', '_raw': line[:200]}
+            continue
+        if isinstance(value, str):
+            value = {'address': value}
+        if not isinstance(value, dict):
+            yield line_number, {'_error': 'Expected an object or a string', '_raw': line[:200]}
+            continue
+        yield line_number, value
+
+
+def _normalize(record):
+    """Returns (member, error) for one parsed record."""
+    if '_error' in record:
+        return None, record['_error']
+    address = str(record.get('address') or '').strip()
+    if not EMAIL_RE.match(address):
+        return None, 'Invalid email address'
+    member = {'address': address}
+    if record.get('name'):
+        member['name'] = str(record['name'])
+    subscribed = record.get('subscribed')
+    if isinstance(subscribed, bool):
+        member['subscribed'] = subscribed
+    elif subscribed is not None:
+        value = str(subscribed).strip().lower()
+        if value in TRUE_VALUES:
+            member['subscribed'] = True
+        elif value in FALSE_VALUES:
+            member['subscribed'] = False
+        else:
+            return None, 'Invalid subscribed value'
+    if isinstance(record.get('vars'), dict):
+        member['vars'] = record['vars']
+    return member, None
+
+
+class ImportStats:
+    """Running totals for one import, reported in the final summary."""
+
+    def __init__(self):
+        self.rows = 0
+        self.valid = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.invalid_samples = []
+        self.chunks = 0
+        self.chunks_failed = 0
+        self.imported = 0
+        self.failed = 0
+
+    def record_invalid(self, line_number, error, record):
+        self.invalid += 1
+        if len(self.invalid_samples) < MAX_REPORTED_INVALID:
+            value = record.get('_raw', record.get('address'))
+            self.invalid_samples.append({'line': line_number, 'error': error, 'value': value})
+
+    def as_dict(self):
+        return {
+            'event': 'summary',
+            'rows': self.rows,
+            'valid': self.valid,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'invalid_samples': self.invalid_samples,
+            'chunks': self.chunks,
+            'chunks_failed': self.chunks_failed,
+            'imported': self.imported,
+            'failed': self.failed,
+        }
+
+
+def validate_and_dedupe(records, stats):
+    """Yields valid, normalized members, skipping invalid rows and repeated addresses."""
+    seen = set()
+    for line_number, record in records:
+        stats.rows += 1
+        member, error = _normalize(record)
+        if error:
+            stats.record_invalid(line_number, error, record)
+            continue
+        key = member['address'].lower()
+        if key in seen:
+            stats.duplicates += 1
+            continue
+        seen.add(key)
+        stats.valid += 1
+        yield member
+
+
+def chunked(members, size):
+    """Groups an iterable of members into lists of at most `size` items."""
+    chunk = []
+    for member in members:
+        chunk.append(member)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_import(records, upsert=True, chunk_size=None, max_workers=None):
+    """
+    Validates, dedupes and uploads `records` in members.json chunks.
+
+    Chunks are uploaded on a bounded thread pool; at most `max_workers` chunks
+    are in flight (and held in memory) at once, so the upload is consumed at
+    the pace Mailgun accepts it. Yields one progress event per finished chunk
+    followed by a summary event.
+    """
+    app = current_app._get_current_object()
+    chunk_size = min(chunk_size or app.config.get('BULK_IMPORT_CHUNK_SIZE', MAX_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    max_workers = max_workers or app.config.get('BULK_IMPORT_CONCURRENCY', 4)
+    stats = ImportStats()
+
+    background_wait = app.config.get('MAILGUN_RATE_LIMIT_BACKGROUND_MAX_WAIT', 30)
+
+    def upload(members):
+        # Imports can wait for rate-limit tokens much longer than interactive requests
+        with app.app_context(), wait_policy(background_wait):
+            return mailgun_service.add_list_members_bulk(members, upsert=upsert)
+
+    def report(future):
+        number, members = in_flight.pop(future)
+        try:
+            result, status_code = future.result()
+        except MailgunUnavailable as e:
+            result, status_code = {"message": e.message}, 503
+        except Exception as e:
+            log.error("Bulk import chunk %s failed: %s", number, e)
+            result, status_code = {"message": f"Server error: {e}"}, 500
+        ok = 200 <= status_code < 300
+        if ok:
+            stats.imported += len(members)
+        else:
+            stats.chunks_failed += 1
+            stats.failed += len(members)
+        return {
+            'event': 'chunk',
+            'chunk': number,
+            'status': status_code,
+            'ok': ok,
+            'count': len(members),
+            'first_address': members[0]['address'],
+            'last_address': members[-1]['address'],
+            'message': result.get('message') if isinstance(result, dict) else None,
+        }
+
+    in_flight = {}
+    members = validate_and_dedupe(records, stats)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bulk-import') as executor:
+        for number, chunk in enumerate(chunked(members, chunk_size), start=1):
+            stats.chunks += 1
+            in_flight[executor.submit(upload, chunk)] = (number, chunk)
+            if len(in_flight) >= max_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield report(future)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield report(future)
+
+    log.info("Bulk import finished: %d imported, %d failed, %d invalid, %d duplicates",
+             stats.imported, stats.failed, stats.invalid, stats.duplicates)
+    yield stats.as_dict()
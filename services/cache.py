@@ -0,0 +1,250 @@
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+# Key used to store the cache on the Flask app (app.extensions)
+EXTENSION_KEY = 'subscriber_cache'
+
+# Returned by backends when a key is absent (None is a valid cached value)
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache whose entries expire after a per-entry TTL."""
+
+    def __init__(self, maxsize=10000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (self._clock() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Shared cache backend on top of a Redis-compatible client.
+
+    Only `get`, `set(name, value, ex=...)` and `delete(*names)` are used, so any
+    object with that interface (e.g. a local stand-in in tests) works as `client`.
+    Values are stored as JSON.
+    """
+
+    def __init__(self, client, prefix='ephergent:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, prefix='ephergent:'):
+        """Connects to Redis; the `redis` package is only needed when this backend is used."""
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("The 'redis' package is required for SUBSCRIBER_CACHE_REDIS_URL") from e
+        return cls(redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5), prefix=prefix)
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return MISSING
+        return json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value, separators=(',', ':')), ex=max(1, int(ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+
+class SubscriberCache:
+    """
+    Read-through cache for Mailgun reads, layered as an in-process LRU in front of
+    an optional shared backend.
+
+    Cached values are the (result, status_code) pairs returned by the service
+    functions. 404s are cached for a shorter negative TTL. Errors from the shared
+    backend are counted and treated as misses so the cache can never take the
+    API down.
+
+    Every invalidation bumps the key's generation. A reader takes `generation(key)`
+    before calling Mailgun and passes it to `set`, which skips the write if the
+    key was invalidated meanwhile, so a read that raced a write cannot put the
+    pre-write result back. Generations are per process: invalidations from other
+    workers still reach the shared backend, but not this check.
+    """
+
+    def __init__(self, local, shared=None, ttl=60, list_ttl=30, negative_ttl=30, local_ttl=None):
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+        self.list_ttl = list_ttl
+        self.negative_ttl = negative_ttl
+        # Other workers can't evict our local copy, so keep it short when a shared backend exists
+        self.local_ttl = local_ttl
+        self._lock = threading.Lock()
+        self._counters = dict(hits=0, misses=0, negative_hits=0, sets=0, stale_sets=0, invalidations=0,
+                              backend_errors=0)
+        # Generation of each recently invalidated key; forgotten keys report the highest generation dropped
+        self._generations = OrderedDict()
+        self._generation_floor = 0
+        self._next_generation = 0
+        self._max_generations = max(1, getattr(local, 'maxsize', 10000))
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the cache from a Flask config mapping."""
+        shared = None
+        redis_url = config.get('SUBSCRIBER_CACHE_REDIS_URL')
+        if redis_url:
+            shared = RedisCache.from_url(redis_url)
+        return cls(
+            local=LRUCache(maxsize=config.get('SUBSCRIBER_CACHE_MAXSIZE', 10000)),
+            shared=shared,
+            ttl=config.get('SUBSCRIBER_CACHE_TTL', 60),
+            list_ttl=config.get('SUBSCRIBER_CACHE_LIST_TTL', 30),
+            negative_ttl=config.get('SUBSCRIBER_CACHE_NEGATIVE_TTL', 30),
+            local_ttl=config.get('SUBSCRIBER_CACHE_LOCAL_TTL', 5) if shared is not None else None,
+        )
+
+    @staticmethod
+    def member_key(list_address, member_address):
+        # Mailgun treats addresses case-insensitively
+        return f"member:{list_address}:{member_address.lower()}"
+
+    @staticmethod
+    def list_key(list_address):
+        return f"list:{list_address}"
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key):
+        """Returns the cached (result, status_code) pair, or None on a miss."""
+        value = self.local.get(key)
+        if value is MISSING and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                log.warning("Shared cache read failed for %s: %s", key, e)
+                self._count('backend_errors')
+                value = MISSING
+            if value is not MISSING:
+                value = tuple(value)
+                self.local.set(key, value, self.local_ttl or self.ttl)
+        if value is MISSING:
+            self._count('misses')
+            return None
+        self._count('negative_hits' if value[1] == 404 else 'hits')
+        return value
+
+    def generation(self, key):
+        """Current generation of the key; take it before fetching and pass it to set()."""
+        with self._lock:
+            return self._generations.get(key, self._generation_floor)
+
+    def set(self, key, result, status_code, ttl=None, generation=None):
+        """
+        Caches a successful result or a 404; other statuses are never cached, and
+        neither is a result fetched before the key's last invalidation.
+        """
+        if status_code == 404:
+            ttl = self.negative_ttl
+        elif status_code != 200:
+            return
+        if generation is not None and self.generation(key) != generation:
+            log.debug("Not caching %s: invalidated while it was being fetched.", key)
+            self._count('stale_sets')
+            return
+        ttl = ttl or self.ttl
+        value = (result, status_code)
+        self.local.set(key, value, min(ttl, self.local_ttl) if self.local_ttl else ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception as e:
+                log.warning("Shared cache write failed for %s: %s", key, e)
+                self._count('backend_errors')
+        self._count('sets')
+
+    def invalidate(self, *keys):
+        """Drops keys from every cache layer and bumps their generations."""
+        with self._lock:
+            self._next_generation += 1
+            for key in keys:
+                self._generations[key] = self._next_generation
+                self._generations.move_to_end(key)
+            while len(self._generations) > self._max_generations:
+                _, dropped = self._generations.popitem(last=False)
+                self._generation_floor = max(self._generation_floor, dropped)
+        self.local.delete(*keys)
+        if self.shared is not None:
+            try:
+                self.shared.delete(*keys)
+            except Exception as e:
+                log.warning("Shared cache invalidation failed: %s", e)
+                self._count('backend_errors')
+        self._count('invalidations', len(keys))
+
+    def clear(self):
+        """Clears the local layer (the shared backend expires on its own)."""
+        self.local.clear()
+
+    def stats(self):
+        """Returns a snapshot of the hit/miss counters."""
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['negative_hits']) / lookups, 4) if lookups else 0.0
+        stats['local_entries'] = len(self.local)
+        stats['shared_backend'] = type(self.shared).__name__ if self.shared is not None else None
+        return stats
+
+
+def init_app(app):
+    """Creates the subscriber cache (if enabled) and registers it on the app."""
+    cache = None
+    if app.config.get('SUBSCRIBER_CACHE_ENABLED', True):
+        cache = SubscriberCache.from_config(app.config)
+    app.extensions[EXTENSION_KEY] = cache
+    return cache
+
+
+def get_cache():
+    """Returns the subscriber cache for the current app, or None when caching is disabled."""
+    return current_app.extensions.get(EXTENSION_KEY)
@@ -0,0 +1,10 @@
+class MailgunUnavailable(Exception):
+    """
+    Raised when a Mailgun call is refused locally instead of being sent upstream
+    (e.g. an open circuit breaker). The API turns it into a 503 with Retry-After.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+# Key used to store the pipeline on the Flask app (app.extensions)
+EXTENSION_KEY = 'log_pipeline'
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed with `extra=` and goes into the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'suppressed'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, pid, plus `extra=` fields and tracebacks."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        suppressed = getattr(record, 'suppressed', None)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, noting how many similar lines the sampler dropped."""
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, 'suppressed', None)
+        return f"{line} ({suppressed} similar suppressed)" if suppressed else line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `burst` records per message template and `window`
+    seconds; the rest are dropped and counted on the next record of that kind
+    (`record.suppressed`).
+
+    Templates are the unformatted messages ("Rate limit exceeded for %s on %s"),
+    so lazily formatted calls group naturally. Records above `max_level` are
+    never dropped.
+    """
+
+    def __init__(self, burst=20, window=1.0, max_level=logging.WARNING, max_keys=10000, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.max_level = max_level
+        self.max_keys = max_keys
+        self.dropped = 0
+        self._clock = clock
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0 or record.levelno > self.max_level:
+            return True
+        template = record.msg if isinstance(record.msg, str) else type(record.msg)
+        key = (record.name, record.levelno, template)
+        now = self._clock()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state is None and len(self._windows) >= self.max_keys:
+                    # Messages formatted before logging never repeat; don't let them grow the table
+                    self._windows.clear()
+                suppressed = state[2] if state is not None else 0
+                # [window start, records let through, records dropped]
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            self.dropped += 1
+            return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks and never formats on the calling thread.
+
+    The stock handler merges the message arguments before enqueueing; here the
+    record is queued as is and the listener thread formats it. When the queue is
+    full the record is dropped and counted instead of waiting for the writer.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Process-wide logging setup: loggers hand records to a bounded in-memory
+    queue (after level checks and sampling) and a listener thread formats and
+    writes them, so request threads never wait on log I/O.
+
+    Records are queued unformatted, so message arguments should not be mutated
+    after the logging call. The listener is restarted in forked children
+    (gunicorn --preload) and drained at exit. `skip_thread_info` turns off the
+    logging module's thread and process-name collection for the whole process,
+    including other libraries' loggers, so it is opt-in.
+    """
+
+    def __init__(self, level=logging.INFO, fmt='json', queue_size=10000, sample_burst=20, sample_window=1.0,
+                 sample_max_level=logging.WARNING, stream=None, skip_thread_info=False):
+        self.level = level
+        self.skip_thread_info = skip_thread_info
+        self.queue_size = queue_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.output = logging.StreamHandler(stream or sys.stderr)
+        self.output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter(TEXT_FORMAT))
+        self.sampler = SamplingFilter(sample_burst, sample_window, sample_max_level)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.handler.addFilter(self.sampler)
+        self.listener = None
+        self._pid = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            level=logging.getLevelName(str(config.get('LOG_LEVEL', 'INFO')).upper()),
+            fmt=str(config.get('LOG_FORMAT', 'json')).lower(),
+            queue_size=int(config.get('LOG_QUEUE_SIZE', 10000)),
+            sample_burst=int(config.get('LOG_SAMPLE_BURST', 20)),
+            sample_window=float(config.get('LOG_SAMPLE_WINDOW', 1)),
+            sample_max_level=logging.getLevelName(str(config.get('LOG_SAMPLE_MAX_LEVEL', 'WARNING')).upper()),
+            skip_thread_info=config.get('LOG_SKIP_THREAD_INFO', False),
+        )
+
+    def start(self):
+        """Routes the root logger through the queue and starts the listener for this process."""
+        if self.skip_thread_info:
+            # Neither output format shows them (one of the optimizations listed in the logging HOWTO)
+            logging.logThreads = False
+            logging.logMultiprocessing = False
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self._start_listener()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.stop)
+
+    def _after_fork(self):
+        # The child has no listener thread, and the parent's thread may have held the queue's lock
+        # at fork time: start over with a fresh queue (records queued in the parent stay there)
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.handler.queue = self.queue
+        self.sampler._lock = threading.Lock()
+        self._start_listener()
+
+    def _start_listener(self):
+        if self._pid == os.getpid():
+            return
+        self.listener = logging.handlers.QueueListener(self.queue, self.output, respect_handler_level=True)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+        """Writes out everything still queued and stops the listener."""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'dropped_full': self.handler.dropped, 'sampled': self.sampler.dropped}
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def init_app(app):
+    """
+    Installs the logging pipeline for this process (once; later apps reuse it) and registers it on the app.
+
+    With LOG_ASYNC=false, logging stays synchronous (plain stream handler, no sampling).
+    """
+    global _pipeline
+    if not app.config.get('LOG_ASYNC', True):
+        logging.basicConfig(level=app.config.get('LOG_LEVEL', 'INFO'), format=TEXT_FORMAT)
+        app.extensions[EXTENSION_KEY] = None
+        return None
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = LogPipeline.from_config(app.config)
+            _pipeline.start()
+    app.extensions[EXTENSION_KEY] = _pipeline
+    return _pipeline
+
+
+def get_pipeline():
+    """Returns the logging pipeline of the current app, or None when logging is synchronous."""
+    return current_app.extensions.get(EXTENSION_KEY)
@@ -0,0 +1,190 @@
+import os
+import json
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from services.errors import MailgunUnavailable
+
+log = logging.getLogger(__name__)
+
+# Key used to store the list registry on the Flask app (app.extensions)
+EXTENSION_KEY = 'mail_lists'
+
+# List that mailgun_service works on in the current context; None is the default list (MAILGUN_LIST_ADDRESS)
+_active_list = contextvars.ContextVar('mailgun_list', default=None)
+
+
+@contextmanager
+def use_list(list_address):
+    """
+    Points mailgun_service at another list for the enclosed calls: URLs, cache
+    and single-flight keys, the mirror, queued and coalesced writes and the
+    Mailgun client all follow it. `None` selects the default list.
+    """
+    token = _active_list.set(list_address)
+    try:
+        yield
+    finally:
+        _active_list.reset(token)
+
+
+def active_list():
+    """The list selected with use_list() in this context, or None for the default list."""
+    return _active_list.get()
+
+
+def current_list_address():
+    """Address of the list the current context works on."""
+    return _active_list.get() or current_app.config['MAILGUN_LIST_ADDRESS']
+
+
+def parse_lists(value):
+    """MAILGUN_LISTS as {name: address}: a dict, a JSON object or "name=address,..." pairs."""
+    if not value:
+        return {}
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith('{'):
+            value = json.loads(value)
+        else:
+            pairs = {}
+            for item in value.split(','):
+                name, sep, address = item.strip().partition('=')
+                if not item.strip():
+                    continue
+                if not sep or not name.strip() or not address.strip():
+                    raise ValueError(f"MAILGUN_LISTS entries must be name=address, got {item.strip()!r}")
+                pairs[name.strip()] = address.strip()
+            value = pairs
+    return {str(name).strip(): str(address).strip() for name, address in value.items()}
+
+
+class MailList:
+    __slots__ = ('name', 'address', 'default')
+
+    def __init__(self, name, address, default=False):
+        self.name = name
+        self.address = address
+        self.default = default
+
+    def scope(self):
+        """use_list() for this list (the default list keeps the original, unscoped behaviour)."""
+        return use_list(None if self.default else self.address)
+
+    def to_dict(self):
+        return {'name': self.name, 'address': self.address, 'default': self.default}
+
+
+class MailLists:
+    """
+    The lists one deployment serves: MAILGUN_LIST_ADDRESS (the default list,
+    also behind the /mail/subscribers routes) plus the MAILGUN_LISTS entries.
+
+    `fan_out` calls several lists at once on a bounded thread pool, so an
+    operation on N lists takes about as long as the slowest of them instead
+    of their sum, and a failing list is reported as such without failing the
+    others. Each list has its own Mailgun client (see mailgun_client.get_client),
+    so a slow list cannot exhaust another's connections or trip its circuit
+    breakers. The pool is per process and recreated lazily after a fork.
+    """
+
+    def __init__(self, app, lists, default_address, default_name='default', concurrency=8):
+        self.app = app
+        self.concurrency = concurrency
+        self.lists = {}
+        self._by_key = {}
+        for name, address in lists.items():
+            if address.lower() == default_address.lower():
+                default_name = name
+        self._add(MailList(default_name, default_address, default=True))
+        for name, address in lists.items():
+            if address.lower() != default_address.lower():
+                self._add(MailList(name, address))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _add(self, mail_list):
+        for key in (mail_list.name.lower(), mail_list.address.lower()):
+            existing = self._by_key.get(key)
+            if existing is not None and existing.address.lower() != mail_list.address.lower():
+                raise ValueError(f"MAILGUN_LISTS: {key!r} names both {existing.address} and {mail_list.address}")
+            self._by_key[key] = mail_list
+        self.lists[mail_list.name] = mail_list
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(
+            app,
+            parse_lists(app.config.get('MAILGUN_LISTS')),
+            app.config['MAILGUN_LIST_ADDRESS'],
+            default_name=app.config.get('MAILGUN_DEFAULT_LIST_NAME') or 'default',
+            concurrency=int(app.config.get('MAILGUN_FANOUT_CONCURRENCY', 8)),
+        )
+
+    def __iter__(self):
+        return iter(self.lists.values())
+
+    def __len__(self):
+        return len(self.lists)
+
+    def resolve(self, key):
+        """The list with this name or address (case-insensitive), or None."""
+        return self._by_key.get(key.strip().lower()) if isinstance(key, str) else None
+
+    def _ensure_executor(self):
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        if self._pid is not None and self._pid != os.getpid():
+            # Forked child: the parent's pool threads don't exist here
+            self._lock = threading.Lock()
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='mail-lists-fanout')
+                self._pid = os.getpid()
+        return self._executor
+
+    def fan_out(self, func, mail_lists):
+        """
+        Calls func() once per list, concurrently, each in an app context scoped
+        to its list; returns {name: (result, status_code)} in the given order.
+        An exception is reported as that list's 503 (Mailgun unavailable) or 500.
+        """
+        mail_lists = list(mail_lists)
+        if len(mail_lists) == 1:
+            return {mail_lists[0].name: self._call(func, mail_lists[0])}
+        executor = self._ensure_executor()
+        futures = {mail_list.name: executor.submit(self._call, func, mail_list) for mail_list in mail_lists}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _call(self, func, mail_list):
+        try:
+            with self.app.app_context(), mail_list.scope():
+                result, status_code = func()[:2]
+        except MailgunUnavailable as e:
+            result, status_code = {"message": e.message}, 503
+        except Exception as e:
+            log.error("Fan-out call to list %s raised: %s", mail_list.name, e)
+            result, status_code = {"message": f"Server error: {e}"}, 500
+        return result, status_code
+
+    def stats(self):
+        return {'lists': [mail_list.to_dict() for mail_list in self], 'fanout_concurrency': self.concurrency}
+
+
+def init_app(app):
+    """Builds the list registry from MAILGUN_LIST_ADDRESS and MAILGUN_LISTS."""
+    registry = MailLists.from_config(app)
+    app.extensions[EXTENSION_KEY] = registry
+    return registry
+
+
+def get_lists():
+    """Returns the list registry for the current app, building it on first use."""
+    registry = current_app.extensions.get(EXTENSION_KEY)
+    if registry is None:
+        registry = init_app(current_app)
+    return registry
@@ -0,0 +1,237 @@
+import os
+import time
+import threading
+import logging
+from flask import current_app
+from services.resilience import Resilience, RETRYABLE_STATUSES, parse_retry_after
+from services.rate_limiter import RateLimiter
+from services.errors import MailgunUnavailable
+from services import metrics, mail_lists
+
+log = logging.getLogger(__name__)
+
+# `requests` is imported where it is used rather than here: it is a sizeable share of a worker's
+# startup (benchmarks/bench_startup.py) and isn't needed until the first call to Mailgun
+
+# Key used to store the client on the Flask app (app.extensions)
+EXTENSION_KEY = 'mailgun_client'
+
+# Key for the clients of the other configured lists (MAILGUN_LISTS), by list address
+LIST_CLIENTS_KEY = 'mailgun_list_clients'
+
+_list_clients_lock = threading.Lock()
+
+
+class MailgunClient:
+    """
+    Pooled, keep-alive HTTP client for the Mailgun API.
+
+    Wraps a requests.Session with a sized connection pool so repeated calls
+    reuse the same TCP/TLS connection to api.mailgun.net instead of doing a
+    fresh handshake per request. Every request gets a (connect, read) timeout.
+
+    The session is created lazily and re-created after a fork, so each
+    gunicorn worker process gets its own pool (sockets must not be shared
+    between processes).
+
+    Requests go through the resilience layer: transient failures (429/5xx,
+    connection errors) are retried with jittered backoff within a retry budget,
+    and a per-endpoint circuit breaker fails fast while Mailgun is down. An
+    optional host-wide token bucket smooths the outbound request rate.
+    """
+
+    def __init__(self, api_key, base_url, pool_connections=4, pool_maxsize=10,
+                 pool_block=False, connect_timeout=3.05, read_timeout=10.0,
+                 keep_alive=True, resilience=None, rate_limiter=None, metrics=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.resilience = resilience or Resilience.from_config({})
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, metrics=None, rate_limiter=None):
+        """Builds a client from a Flask config mapping (`rate_limiter` shares another client's limiter)."""
+        return cls(
+            api_key=config['MAILGUN_API_KEY'],
+            base_url=config['MAILGUN_API_BASE_URL'],
+            pool_connections=config.get('MAILGUN_POOL_CONNECTIONS', 4),
+            pool_maxsize=config.get('MAILGUN_POOL_MAXSIZE', 10),
+            pool_block=config.get('MAILGUN_POOL_BLOCK', False),
+            connect_timeout=config.get('MAILGUN_CONNECT_TIMEOUT', 3.05),
+            read_timeout=config.get('MAILGUN_READ_TIMEOUT', 10.0),
+            keep_alive=config.get('MAILGUN_KEEP_ALIVE', True),
+            resilience=Resilience.from_config(config),
+            rate_limiter=rate_limiter if rate_limiter is not None else RateLimiter.from_config(config),
+            metrics=metrics,
+        )
+
+    def _create_session(self):
+        """Creates a new session with a mounted, sized connection pool."""
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.auth = ('api', self.api_key)
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        log.info("Created Mailgun HTTP session for pid %s (pool_maxsize=%s, timeout=%s)",
+                 os.getpid(), self.pool_maxsize, self.timeout)
+        return session
+
+    @property
+    def session(self):
+        """Returns the session for the current process, creating it if needed."""
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    # Never close an inherited session here: its sockets belong to the parent
+                    self._session = self._create_session()
+                    self._pid = pid
+        return self._session
+
+    def request(self, method, url, operation=None, idempotent=None, **kwargs):
+        """
+        Sends a request through the pooled session with the default timeout.
+
+        `operation` names the Mailgun endpoint for the circuit breaker (defaults
+        to the HTTP method). Non-idempotent requests (POST unless `idempotent`
+        is set) are only retried when Mailgun cannot have applied them: on 429
+        and on connect timeouts.
+        """
+        import requests
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'PUT', 'DELETE')
+        breaker = self.resilience.breaker(operation or method.upper())
+        policy = self.resilience.policy
+        budget = self.resilience.budget
+        budget.record_request()
+
+        attempt = 1
+        while True:
+            try:
+                breaker.before_call()
+                if self.rate_limiter is not None:
+                    try:
+                        self.rate_limiter.acquire(method, operation)
+                    except BaseException:
+                        # Not sent: a half-open breaker must not wait forever for this trial's outcome
+                        breaker.cancel_call()
+                        raise
+            except MailgunUnavailable:
+                if attempt == 1:
+                    raise
+                # A retry refused locally: report the attempt that was sent, so MailgunUnavailable
+                # always means nothing reached Mailgun
+                if error is not None:
+                    raise error
+                return response
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if self.metrics is not None:
+                    self.metrics.observe_mailgun(operation or method.upper(), 'error', time.perf_counter() - started)
+                breaker.record_failure()
+                # Only a failed connect guarantees the request never reached Mailgun
+                retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                error = e
+            else:
+                if self.metrics is not None:
+                    self.metrics.observe_mailgun(operation or method.upper(), response.status_code,
+                                                 time.perf_counter() - started)
+                if response.status_code not in RETRYABLE_STATUSES:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                retryable = idempotent or response.status_code == 429
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status_code == 429 and self.rate_limiter is not None:
+                    # Make every worker on the host back off, not just this request
+                    self.rate_limiter.penalize(retry_after if retry_after is not None else 1.0)
+                error = None
+
+            delay = None
+            if retryable and attempt < policy.max_attempts:
+                delay = policy.compute_delay(attempt, retry_after)
+            if delay is None or not budget.try_spend():
+                if error is not None:
+                    raise error
+                return response
+
+            if self.metrics is not None:
+                self.metrics.mailgun_retries.inc(operation or method.upper())
+            log.warning("Retrying Mailgun %s %s in %.2fs (attempt %d/%d): %s", method, operation or '', delay,
+                        attempt + 1, policy.max_attempts, error if error is not None else response.status_code)
+            if error is None:
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        """Closes the pooled connections owned by this process."""
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+
+def init_app(app):
+    """Creates the app-scoped Mailgun client and registers it on the app."""
+    client = MailgunClient.from_config(app.config, metrics=app.extensions.get(metrics.EXTENSION_KEY))
+    app.extensions[EXTENSION_KEY] = client
+    return client
+
+
+def get_client():
+    """
+    Returns the Mailgun client for the current app and list (see
+    services.mail_lists.use_list), creating it on first use.
+    """
+    client = current_app.extensions.get(EXTENSION_KEY)
+    if client is None:
+        client = init_app(current_app)
+    list_address = mail_lists.active_list()
+    if list_address is None:
+        return client
+    clients = current_app.extensions.setdefault(LIST_CLIENTS_KEY, {})
+    list_client = clients.get(list_address)
+    if list_client is None:
+        with _list_clients_lock:
+            list_client = clients.get(list_address)
+            if list_client is None:
+                # Own connection pool and circuit breakers; the rate limit is per Mailgun account, so shared
+                list_client = MailgunClient.from_config(current_app.config, metrics=client.metrics,
+                                                        rate_limiter=client.rate_limiter)
+                clients[list_address] = list_client
+    return list_client
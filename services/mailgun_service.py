@@ -1,39 +1,176 @@
-import requests
+import json
+import logging
 from flask import current_app
+from services.mailgun_client import get_client
+from services.cache import get_cache
+from services.single_flight import get_single_flight
+from services import mirror
+from services.errors import MailgunUnavailable
+from services.mail_lists import current_list_address
 
-def _get_mailgun_auth():
-    """Helper function to get Mailgun API authentication."""
-    return ('api', current_app.config['MAILGUN_API_KEY'])
+# `requests` is imported in the functions that catch its errors (startup time, see services/mailgun_client.py)
 
 def _get_list_members_url():
     """Helper function to construct the list members URL."""
-    list_address = current_app.config['MAILGUN_LIST_ADDRESS']
+    list_address = current_list_address()
     base_url = current_app.config['MAILGUN_API_BASE_URL']
     return f"{base_url}/lists/{list_address}/members"
 
+def _get_list_members_pages_url():
+    """Helper function to construct the paginated list members URL."""
+    list_address = current_list_address()
+    base_url = current_app.config['MAILGUN_API_BASE_URL']
+    return f"{base_url}/lists/{list_address}/members/pages"
+
+def _get_bulk_members_url():
+    """Helper function to construct the bulk (members.json) upload URL."""
+    list_address = current_list_address()
+    base_url = current_app.config['MAILGUN_API_BASE_URL']
+    return f"{base_url}/lists/{list_address}/members.json"
+
 def _get_member_url(member_address):
     """Helper function to construct the specific member URL."""
-    list_address = current_app.config['MAILGUN_LIST_ADDRESS']
+    list_address = current_list_address()
     base_url = current_app.config['MAILGUN_API_BASE_URL']
     return f"{base_url}/lists/{list_address}/members/{member_address}"
 
+def invalidate_members(*member_addresses):
+    """
+    Drops the cached list and any cached entries for the given members, and
+    detaches reads of them still in flight so later readers don't join a
+    pre-write result.
+
+    Writes call this from a `finally` block: a timed-out write may still have
+    been applied by Mailgun.
+    """
+    list_address = current_list_address()
+    single_flight = get_single_flight()
+    if single_flight is not None:
+        single_flight.forget(('get_list_members', list_address),
+                             *(('get_member', list_address, address) for address in member_addresses))
+    cache = get_cache()
+    if cache is None:
+        return
+    member_keys = [cache.member_key(list_address, address) for address in member_addresses]
+    cache.invalidate(cache.list_key(list_address), *member_keys)
+
+def _write_through(response, members, action='upsert'):
+    """
+    Applies a write (or a member Mailgun just returned) to the subscriber mirror.
+
+    `action` is 'upsert', 'update' or 'delete'. `response` is None when the
+    call failed in transport (e.g. a timeout): like a 5xx, the write may or may
+    not have been applied, so the rows are flagged dirty rather than guessed
+    (an add stores the intended member, dirty). Calls refused locally with
+    MailgunUnavailable were never sent and must not come here. A mirror
+    failure never fails the request; the next sync repairs it.
+    """
+    subscriber_mirror = mirror.get_mirror()
+    if subscriber_mirror is None or (response is not None and 400 <= response.status_code < 500):
+        return
+    list_address = current_list_address()
+    uncertain = response is None or response.status_code >= 500
+    try:
+        if uncertain and action != 'upsert':
+            subscriber_mirror.mark_dirty(list_address, [member['address'] for member in members])
+        elif action == 'delete':
+            subscriber_mirror.delete(list_address, [member['address'] for member in members])
+        else:
+            if not uncertain and len(members) == 1:
+                try:
+                    # Mailgun echoes the stored member; prefer it over what was sent
+                    members = [{**members[0], **(response.json().get('member') or {})}]
+                except (ValueError, AttributeError):
+                    pass
+            subscriber_mirror.upsert(list_address, members, dirty=uncertain)
+    except Exception as e:
+        current_app.logger.warning("Subscriber mirror write-through failed: %s", e)
+
+def _coalesced(key, fetch):
+    """Runs a read through the single-flight layer, so concurrent identical reads share one Mailgun call."""
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return fetch()
+    return single_flight.do(key, key[0], fetch)
+
 def get_list_members():
     """Fetches all members from the configured Mailgun mailing list."""
+    cache = get_cache()
+    if cache is not None:
+        cache_key = cache.list_key(current_list_address())
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    return _coalesced(('get_list_members', current_list_address()), _fetch_list_members)
+
+def _fetch_list_members():
+    import requests
+    cache = get_cache()
+    if cache is not None:
+        cache_key = cache.list_key(current_list_address())
+        generation = cache.generation(cache_key)
     url = _get_list_members_url()
-    auth = _get_mailgun_auth()
     try:
-        current_app.logger.info(f"Making GET request to Mailgun: {url}")
-        response = requests.get(url, auth=auth)
+        current_app.logger.info("Making GET request to Mailgun: %s", url)
+        response = get_client().get(url, operation='get_list_members')
         response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json(), 200
+        result = response.json()
+        if cache is not None:
+            cache.set(cache_key, result, 200, ttl=cache.list_ttl, generation=generation)
+        return result, 200
     except requests.exceptions.RequestException as e:
-        current_app.logger.error(f"Mailgun API error (get_list_members): {e}")
+        current_app.logger.error("Mailgun API error (get_list_members): %s", e)
         return {"message": f"Error fetching members: {e}"}, getattr(e.response, 'status_code', 500)
 
+def iter_member_pages(cursor=None, page_size=None, subscribed=None):
+    """
+    Yields the list members one Mailgun page at a time.
+
+    Follows the `paging.next` cursors returned by Mailgun's /members/pages
+    endpoint, so only a single page is held in memory at any point.
+    `cursor` is the address of the last member already seen; iteration resumes
+    right after it. Raises requests.exceptions.RequestException on upstream errors.
+    """
+    url = _get_list_members_pages_url()
+    params = {'limit': page_size or current_app.config.get('MAILGUN_PAGE_SIZE', 100)}
+    if cursor:
+        params.update(page='next', address=cursor)
+    if subscribed is not None:
+        params['subscribed'] = str(subscribed).lower()
+
+    while True:
+        current_app.logger.info("Making GET request to Mailgun: %s", url)
+        response = get_client().get(url, params=params, operation='list_member_pages')
+        response.raise_for_status()
+        payload = response.json()
+        items = payload.get('items') or []
+        if not items:
+            return
+        yield items
+        next_url = (payload.get('paging') or {}).get('next')
+        if not next_url:
+            return
+        # The next URL already carries the page, pivot address and limit
+        url, params = next_url, None
+
+def iter_list_members(limit=None, cursor=None, page_size=None, subscribed=None):
+    """Yields individual members across pages, stopping after `limit` members if given."""
+    if limit is not None and page_size is None:
+        # Don't fetch a full page when only a few members are wanted
+        page_size = min(limit, current_app.config.get('MAILGUN_PAGE_SIZE', 100))
+    remaining = limit
+    for items in iter_member_pages(cursor=cursor, page_size=page_size, subscribed=subscribed):
+        if remaining is not None:
+            items = items[:remaining]
+            remaining -= len(items)
+        yield from items
+        if remaining is not None and remaining <= 0:
+            return
+
 def add_list_member(email, name=None, subscribed=True, upsert=True):
     """Adds or updates a member in the configured Mailgun mailing list."""
+    import requests
     url = _get_list_members_url()
-    auth = _get_mailgun_auth()
     data = {
         "address": email,
         "subscribed": str(subscribed).lower(),
@@ -42,29 +179,40 @@ def add_list_member(email, name=None, subscribed=True, upsert=True):
     if name:
         data["name"] = name
 
-    current_app.logger.info(f"Request data for Mailgun: {data}")
-    current_app.logger.info(f"Making POST request to Mailgun: {url}")
+    current_app.logger.info("Making POST request to Mailgun: %s", url)
+    current_app.logger.debug("Request data for Mailgun: %s", data)
 
     try:
         # Mailgun accepts regular form data, no special Content-Type needed
-        response = requests.post(url, auth=auth, data=data)
+        response = None
+        refused = False
+        try:
+            # An upsert can safely be retried; a plain create only on 429 / connect failures
+            response = get_client().post(url, data=data, operation='add_list_member', idempotent=upsert)
+        except MailgunUnavailable:
+            refused = True  # Never sent (open breaker, rate limit): Mailgun and the mirror are unchanged
+            raise
+        finally:
+            invalidate_members(email)
+            if not refused:
+                _write_through(response, [{'address': email, 'name': name, 'subscribed': subscribed}])
 
-        # Log the status and response
-        current_app.logger.info(f"Mailgun response status: {response.status_code}")
-        if response.text:
-            current_app.logger.info(f"Mailgun response: {response.text}")
+        # Log the status, and the body only when debugging (decoding it costs on every call)
+        current_app.logger.info("Mailgun response status: %s", response.status_code)
+        if current_app.logger.isEnabledFor(logging.DEBUG) and response.text:
+            current_app.logger.debug("Mailgun response: %s", response.text)
 
         response.raise_for_status()
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
-        current_app.logger.error(f"Mailgun API error (add_list_member): {e}")
+        current_app.logger.error("Mailgun API error (add_list_member): %s", e)
         error_message = f"Error adding member: {e}"
         status_code = getattr(e.response, 'status_code', 500)
 
         # Log the full response for debugging
         if hasattr(e, 'response') and e.response:
-            current_app.logger.error(f"Error response status: {e.response.status_code}")
-            current_app.logger.error(f"Error response text: {e.response.text}")
+            current_app.logger.error("Error response status: %s", e.response.status_code)
+            current_app.logger.error("Error response text: %s", e.response.text)
 
             try:
                 # Try to get more specific error from Mailgun response
@@ -76,27 +224,91 @@ def add_list_member(email, name=None, subscribed=True, upsert=True):
         return {"message": error_message}, status_code
 
 
+def add_list_members_bulk(members, upsert=True):
+    """
+    Adds up to 1000 members in one call using Mailgun's members.json batch API.
+
+    `members` is a list of dicts with an 'address' and optional 'name',
+    'subscribed' and 'vars' keys.
+    """
+    import requests
+    url = _get_bulk_members_url()
+    data = {
+        "members": json.dumps(members),
+        "upsert": str(upsert).lower()
+    }
+    current_app.logger.info("Making bulk POST request to Mailgun: %s (%s members)", url, len(members))
+
+    try:
+        response = None
+        refused = False
+        try:
+            response = get_client().post(url, data=data, operation='add_list_members_bulk', idempotent=upsert)
+        except MailgunUnavailable:
+            refused = True  # Never sent (open breaker, rate limit): Mailgun and the mirror are unchanged
+            raise
+        finally:
+            invalidate_members(*(member['address'] for member in members))
+            if not refused:
+                _write_through(response, members)
+        response.raise_for_status()
+        return response.json(), response.status_code
+    except requests.exceptions.RequestException as e:
+        current_app.logger.error("Mailgun API error (add_list_members_bulk): %s", e)
+        error_message = f"Error adding members: {e}"
+        status_code = getattr(e.response, 'status_code', 500)
+        if e.response is not None:
+            try:
+                error_message = e.response.json().get('message', error_message)
+            except (ValueError, TypeError, AttributeError):
+                pass
+        return {"message": error_message}, status_code
+
+
 def get_member(member_address):
     """Fetches a specific member from the configured Mailgun mailing list."""
+    cache = get_cache()
+    if cache is not None:
+        cache_key = cache.member_key(current_list_address(), member_address)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    return _coalesced(('get_member', current_list_address(), member_address),
+                      lambda: _fetch_member(member_address))
+
+def _fetch_member(member_address):
+    import requests
+    cache = get_cache()
+    if cache is not None:
+        cache_key = cache.member_key(current_list_address(), member_address)
+        generation = cache.generation(cache_key)
     url = _get_member_url(member_address)
-    auth = _get_mailgun_auth()
     try:
-        current_app.logger.info(f"Making GET request to Mailgun: {url}")
-        response = requests.get(url, auth=auth)
+        current_app.logger.info("Making GET request to Mailgun: %s", url)
+        response = get_client().get(url, operation='get_member')
         response.raise_for_status()
-        return response.json(), 200
+        result = response.json()
+        # A fresh read also repairs the member's mirror row (e.g. one flagged dirty)
+        _write_through(response, [{'address': member_address}])
+        if cache is not None:
+            cache.set(cache_key, result, 200, generation=generation)
+        return result, 200
     except requests.exceptions.RequestException as e:
-        current_app.logger.error(f"Mailgun API error (get_member): {e}")
+        current_app.logger.error("Mailgun API error (get_member): %s", e)
         status_code = getattr(e.response, 'status_code', 500)
         if status_code == 404:
-             return {"message": "Member not found"}, 404
+            # Negative caching: remember that the member doesn't exist (shorter TTL)
+            result = {"message": "Member not found"}
+            if cache is not None:
+                cache.set(cache_key, result, 404, generation=generation)
+            return result, 404
         return {"message": f"Error fetching member: {e}"}, status_code
 
 
 def update_member(member_address, name=None, subscribed=None):
     """Updates a specific member in the configured Mailgun mailing list."""
+    import requests
     url = _get_member_url(member_address)
-    auth = _get_mailgun_auth()
     data = {}
     if name is not None:
         data["name"] = name
@@ -106,18 +318,30 @@ def update_member(member_address, name=None, subscribed=None):
     if not data:
         return {"message": "No update data provided"}, 400
 
-    current_app.logger.info(f"Making PUT request to Mailgun: {url} with data: {data}")
+    current_app.logger.info("Making PUT request to Mailgun: %s", url)
+    current_app.logger.debug("Request data for Mailgun: %s", data)
 
     try:
-        response = requests.put(url, auth=auth, data=data)
-        current_app.logger.info(f"Mailgun response status: {response.status_code}")
-        if response.text:
-            current_app.logger.info(f"Mailgun response: {response.text}")
+        response = None
+        refused = False
+        try:
+            response = get_client().put(url, data=data, operation='update_member')
+        except MailgunUnavailable:
+            refused = True  # Never sent (open breaker, rate limit): Mailgun and the mirror are unchanged
+            raise
+        finally:
+            invalidate_members(member_address)
+            if not refused:
+                _write_through(response, [{'address': member_address, 'name': name, 'subscribed': subscribed}],
+                               'update')
+        current_app.logger.info("Mailgun response status: %s", response.status_code)
+        if current_app.logger.isEnabledFor(logging.DEBUG) and response.text:
+            current_app.logger.debug("Mailgun response: %s", response.text)
 
         response.raise_for_status()
         return response.json(), 200
     except requests.exceptions.RequestException as e:
-        current_app.logger.error(f"Mailgun API error (update_member): {e}")
+        current_app.logger.error("Mailgun API error (update_member): %s", e)
         status_code = getattr(e.response, 'status_code', 500)
         if status_code == 404:
              return {"message": "Member not found"}, 404
@@ -126,16 +350,26 @@ def update_member(member_address, name=None, subscribed=None):
 
 def delete_member(member_address):
     """Deletes a specific member from the configured Mailgun mailing list."""
+    import requests
     url = _get_member_url(member_address)
-    auth = _get_mailgun_auth()
     try:
-        current_app.logger.info(f"Making DELETE request to Mailgun: {url}")
-        response = requests.delete(url, auth=auth)
+        current_app.logger.info("Making DELETE request to Mailgun: %s", url)
+        response = None
+        refused = False
+        try:
+            response = get_client().delete(url, operation='delete_member')
+        except MailgunUnavailable:
+            refused = True  # Never sent (open breaker, rate limit): Mailgun and the mirror are unchanged
+            raise
+        finally:
+            invalidate_members(member_address)
+            if not refused:
+                _write_through(response, [{'address': member_address}], 'delete')
         response.raise_for_status()
         # Mailgun delete returns 200 OK on success
         return response.json(), 200
     except requests.exceptions.RequestException as e:
-        current_app.logger.error(f"Mailgun API error (delete_member): {e}")
+        current_app.logger.error("Mailgun API error (delete_member): %s", e)
         status_code = getattr(e.response, 'status_code', 500)
         if status_code == 404:
              return {"message": "Member not found"}, 404
@@ -0,0 +1,703 @@
+import os
+import json
+import time
+import bisect
+import threading
+import logging
+from flask import current_app, g, request, Response
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; exited workers' files are then left in place
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# Key used to store the metrics registry on the Flask app (app.extensions)
+EXTENSION_KEY = 'metrics'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers cache hits (sub-millisecond) up to Mailgun calls that hit the read timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Snapshot file holding the counters of every worker that has exited
+EXITED_FILE = 'exited.json'
+
+
+def parse_buckets(value):
+    """Parses '0.01,0.1,1' (or a sequence) into sorted histogram bucket bounds."""
+    if not value:
+        return DEFAULT_BUCKETS
+    if isinstance(value, str):
+        value = [item for item in value.split(',') if item.strip()]
+    return tuple(sorted(float(item) for item in value))
+
+
+class _Family:
+    """One named metric with a fixed set of label names; values are kept per label tuple."""
+
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def dump(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Counter(_Family):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self.registry.touch()
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_Family):
+    """Gauge summed over the live processes (e.g. in-flight requests per worker)."""
+
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        self.registry.touch()
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        self.registry.touch()
+        with self._lock:
+            self.values[labels] = value
+
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        self.registry.touch()
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self.values.get(labels)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, the +Inf bucket last, then the sum
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def dump(self):
+        with self._lock:
+            return [[list(labels), list(state)] for labels, state in self.values.items()]
+
+
+class MetricsRegistry:
+    """
+    Prometheus-style counters, gauges and histograms for one process, with
+    aggregation across processes through snapshot files.
+
+    Recording a value only updates a dict under a lock. When `directory` is
+    set, a background thread writes this process's values to
+    `<directory>/<pid>.json` every `flush_interval` seconds (only when
+    something changed), and `collect()` merges the files of all processes:
+    counters and histograms are summed over every file (so counts from
+    restarted workers are kept), gauges over the processes still alive. At
+    scrape time the files of exited workers are folded into one EXITED_FILE,
+    so the directory holds one file per live worker plus that one. All
+    gunicorn workers of one deployment must share the directory; clear it when
+    deploying so counters start from zero.
+
+    Collectors add values that are computed on demand: per-process ones (e.g.
+    the in-process cache counters) are included in the snapshot files, shared
+    ones (e.g. the SQLite write queue) are read once at scrape time.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0, buckets=DEFAULT_BUCKETS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self._families = {}
+        self._collectors = []
+        self._dirty = False
+        self._flusher = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # Values recorded before a fork (gunicorn --preload) belong to the parent
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _family(self, cls, name, help, labelnames, **kwargs):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = cls(self, name, help, labelnames, **kwargs)
+        return family
+
+    def counter(self, name, help, labelnames=()):
+        return self._family(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._family(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=None):
+        return self._family(Histogram, name, help, labelnames, buckets=buckets or self.buckets)
+
+    def add_collector(self, collector, shared=False):
+        """
+        Registers a callable returning (name, kind, help, labels dict, value) tuples.
+
+        `shared` collectors read state common to all processes and are only
+        called when scraping; the others are included in each process's snapshot.
+        """
+        self._collectors.append((collector, shared))
+
+    def touch(self):
+        """Marks the values as changed (called on every update) and starts the flusher if needed."""
+        self._dirty = True
+        if self._flusher is None and self.directory:
+            self._start_flusher()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._dirty = False
+        for family in self._families.values():
+            family._lock = threading.Lock()
+            family.values = {}
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._load_own_file()
+            self._flusher = threading.Thread(target=self._run_flusher, name='metrics-flusher', daemon=True)
+            self._flusher.start()
+
+    def _load_own_file(self):
+        # A previous process with the same pid left counts behind; keep counting from them
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name, data in snapshot.get('metrics', {}).items():
+            family = self._families.get(name)
+            if family is None or family.kind == 'gauge' or data.get('collected'):
+                continue
+            with family._lock:
+                for labels, value in data['samples']:
+                    family.values[tuple(labels)] = value
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    def _collect_local(self):
+        """Values of the per-process collectors, as families keyed by name."""
+        families = {}
+        for collector, shared in self._collectors:
+            if shared:
+                continue
+            _add_collected(families, collector)
+        return families
+
+    def snapshot(self):
+        """This process's values in the snapshot-file format."""
+        metrics = {}
+        for family in list(self._families.values()):
+            metrics[family.name] = {
+                'kind': family.kind,
+                'help': family.help,
+                'labelnames': list(family.labelnames),
+                'buckets': list(family.buckets) if family.kind == 'histogram' else None,
+                'samples': family.dump(),
+            }
+        metrics.update(self._collect_local())
+        return {'pid': os.getpid(), 'time': time.time(), 'metrics': metrics}
+
+    def flush(self, snapshot=None):
+        """Writes this process's snapshot file (atomically, via rename)."""
+        if not self.directory:
+            return
+        self._dirty = False
+        snapshot = snapshot or self.snapshot()
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            _write_json(self.path, snapshot)
+        except OSError as e:
+            log.warning("Could not write metrics snapshot to %s: %s", self.directory, e)
+
+    def _snapshots(self):
+        """Snapshots of every process: this one (fresh) and the others (from their files)."""
+        own = self.snapshot()
+        if not self.directory:
+            return [own]
+        self.flush(own)
+        snapshots = [own]
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return snapshots
+        exited = []
+        for name in names:
+            if not name.endswith('.json') or name in (f"{own['pid']}.json", EXITED_FILE):
+                continue
+            snapshot = _read_json(os.path.join(self.directory, name))
+            if snapshot is None:
+                continue
+            if _pid_alive(snapshot['pid']):
+                snapshots.append(snapshot)
+            else:
+                exited.append(name)
+        if exited and fcntl is not None:
+            self._fold_exited(exited)
+        else:
+            snapshots.extend(filter(None, (_read_json(os.path.join(self.directory, name)) for name in exited)))
+        folded = _read_json(os.path.join(self.directory, EXITED_FILE))
+        if folded is not None:
+            snapshots.append(folded)
+        return snapshots
+
+    def _fold_exited(self, names):
+        """Adds exited workers' counters and histograms to EXITED_FILE and removes their files."""
+        try:
+            fd = os.open(os.path.join(self.directory, '.lock'), os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            log.warning("Could not lock %s to fold exited workers' metrics: %s", self.directory, e)
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            exited_path = os.path.join(self.directory, EXITED_FILE)
+            folded = _read_json(exited_path) or {'pid': None, 'metrics': {}}
+            merged = _merge([folded], gauges=False)
+            paths = []
+            for name in names:
+                path = os.path.join(self.directory, name)
+                snapshot = _read_json(path)  # None if another worker folded it meanwhile
+                if snapshot is not None:
+                    merged = _merge([snapshot], gauges=False, merged=merged)
+                    paths.append(path)
+            if not paths:
+                return
+            _write_json(exited_path, {
+                'pid': None,
+                'time': time.time(),
+                'metrics': {name: dict(data, samples=[[list(labels), value] for labels, value in data['samples'].items()])
+                            for name, data in merged.items()},
+            })
+            for path in paths:
+                os.unlink(path)
+            log.info("Folded the metrics of %d exited worker(s) into %s", len(paths), exited_path)
+        except OSError as e:
+            log.warning("Could not fold exited workers' metrics in %s: %s", self.directory, e)
+        finally:
+            os.close(fd)
+
+    def collect(self):
+        """Merges all processes' values; returns families keyed by name."""
+        merged = {}
+        for snapshot in self._snapshots():
+            alive = snapshot['pid'] == os.getpid() or _pid_alive(snapshot['pid'])
+            merged = _merge([snapshot], gauges=alive, merged=merged)
+        for collector, shared in self._collectors:
+            if shared:
+                shared_families = _add_collected({}, collector)
+                for name, data in shared_families.items():
+                    data['samples'] = {tuple(labels): value for labels, value in data['samples']}
+                    merged[name] = data
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4) of the merged values."""
+        lines = []
+        for name, data in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} {data['kind']}")
+            labelnames = data['labelnames']
+            for labels, value in sorted(data['samples'].items()):
+                pairs = list(zip(labelnames, labels))
+                if data['kind'] == 'histogram':
+                    cumulative = 0
+                    bounds = [_format_value(bound) for bound in data['buckets']] + ['+Inf']
+                    for bound, count in zip(bounds, value[:-1]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(pairs + [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(value[-1])}")
+                    lines.append(f"{name}_count{_format_labels(pairs)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(snapshots, gauges=True, merged=None):
+    """Sums the snapshots' samples into families keyed by name (samples keyed by label tuple)."""
+    merged = {} if merged is None else merged
+    for snapshot in snapshots:
+        for name, data in snapshot['metrics'].items():
+            if data['kind'] == 'gauge' and not gauges:
+                continue
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(data, samples={})
+            samples = target['samples']
+            for labels, value in data['samples']:
+                key = tuple(labels)
+                current = samples.get(key)
+                if current is None:
+                    samples[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    samples[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    samples[key] = current + value
+    return merged
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    """Writes a snapshot file atomically (via rename), readable by this user only."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _add_collected(families, collector):
+    try:
+        collected = list(collector())
+    except Exception as e:
+        log.warning("Metrics collector %s failed: %s", getattr(collector, '__name__', collector), e)
+        return families
+    for name, kind, help, labels, value in collected:
+        family = families.get(name)
+        if family is None:
+            family = families[name] = {'kind': kind, 'help': help, 'labelnames': list(labels),
+                                       'buckets': None, 'samples': [], 'collected': True}
+        family['samples'].append([list(labels.values()), value])
+    return families
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (f'{name}="{_escape(value)}"' for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metrics(MetricsRegistry):
+    """The application's metrics: inbound requests, Mailgun calls and request authentication."""
+
+    def __init__(self, directory=None, flush_interval=1.0, buckets=DEFAULT_BUCKETS):
+        super().__init__(directory, flush_interval, buckets)
+        self.http_requests = self.counter(
+            'http_requests_total', 'HTTP requests handled, by method, route and status.',
+            ('method', 'route', 'status'))
+        self.http_request_duration = self.histogram(
+            'http_request_duration_seconds', 'Time to produce the HTTP response, by method and route.',
+            ('method', 'route'))
+        self.http_requests_in_flight = self.gauge(
+            'http_requests_in_flight', 'HTTP requests currently being handled.')
+        self.mailgun_requests = self.counter(
+            'mailgun_requests_total', 'Mailgun API calls (each attempt), by operation and status '
+            '("error" for transport failures).', ('operation', 'status'))
+        self.mailgun_request_duration = self.histogram(
+            'mailgun_request_duration_seconds', 'Mailgun API call latency per attempt, by operation.',
+            ('operation',))
+        self.mailgun_retries = self.counter(
+            'mailgun_retries_total', 'Mailgun API calls retried, by operation.', ('operation',))
+        self.auth_checks = self.counter(
+            'auth_checks_total', 'Request authentication results, by action, method (signature or token) '
+            'and result.', ('action', 'method', 'result'))
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the registry from a Flask config mapping, or returns None when disabled."""
+        if not config.get('METRICS_ENABLED', True):
+            return None
+        directory = config.get('METRICS_DIR')
+        if directory is None:
+            directory = 'metrics'
+        return cls(
+            directory=directory or None,
+            flush_interval=float(config.get('METRICS_FLUSH_INTERVAL', 1)),
+            buckets=parse_buckets(config.get('METRICS_LATENCY_BUCKETS')),
+        )
+
+    def observe_request(self, method, route, status, duration):
+        self.http_requests.inc(method, route, str(status))
+        self.http_request_duration.observe(duration, method, route)
+
+    def observe_mailgun(self, operation, status, duration):
+        self.mailgun_requests.inc(operation, str(status))
+        self.mailgun_request_duration.observe(duration, operation)
+
+
+def _cache_collector(app):
+    from services import cache  # Imported here: the cache and queue modules import the Mailgun client
+
+    def collect():
+        subscriber_cache = app.extensions.get(cache.EXTENSION_KEY)
+        if subscriber_cache is None:
+            return []
+        stats = subscriber_cache.stats()
+        collected = [
+            (f"subscriber_cache_{name}_total", 'counter', f"Subscriber cache {name.replace('_', ' ')}.", {},
+             stats[name])
+            for name in ('hits', 'negative_hits', 'misses', 'sets', 'stale_sets', 'invalidations', 'backend_errors')
+        ]
+        collected.append(('subscriber_cache_local_entries', 'gauge', 'Entries in the in-process cache layer.', {},
+                          stats['local_entries']))
+        return collected
+    collect.__name__ = 'subscriber_cache'
+    return collect
+
+
+def _write_queue_collector(app):
+    from services import write_queue
+
+    def collect():
+        dispatcher = app.extensions.get(write_queue.EXTENSION_KEY)
+        if dispatcher is None:
+            return []
+        return [('write_queue_jobs', 'gauge', 'Write-queue jobs by status.', {'status': status}, count)
+                for status, count in dispatcher.queue.stats().items()]
+    collect.__name__ = 'write_queue'
+    return collect
+
+
+def _mirror_collector(app):
+    from services import mirror
+
+    def collect():
+        sync = app.extensions.get(mirror.EXTENSION_KEY)
+        if sync is None:
+            return []
+        stats = sync.mirror.stats(app.config['MAILGUN_LIST_ADDRESS'])
+        collected = [
+            ('subscriber_mirror_members', 'gauge', 'Members in the local subscriber mirror.', {}, stats['members']),
+            ('subscriber_mirror_dirty_members', 'gauge', 'Mirror rows awaiting a refresh after an uncertain write.',
+             {}, stats['dirty']),
+        ]
+        if stats['age_seconds'] is not None:
+            collected.append(('subscriber_mirror_age_seconds', 'gauge', 'Seconds since the last completed mirror sync.',
+                              {}, stats['age_seconds']))
+        return collected
+    collect.__name__ = 'mirror'
+    return collect
+
+
+def _single_flight_collector(app):
+    from services import single_flight
+
+    def collect():
+        coalescer = app.extensions.get(single_flight.EXTENSION_KEY)
+        if coalescer is None:
+            return []
+        return [('mailgun_coalesced_reads_total', 'counter',
+                 'Reads answered by joining an identical Mailgun call already in flight.', {'operation': operation},
+                 count)
+                for operation, count in coalescer.stats()['coalesced'].items()]
+    collect.__name__ = 'single_flight'
+    return collect
+
+
+def _write_coalescer_collector(app):
+    from services import write_coalescer
+
+    def collect():
+        coalescer = app.extensions.get(write_coalescer.EXTENSION_KEY)
+        if coalescer is None:
+            return []
+        stats = coalescer.stats()
+        collected = [
+            ('write_coalescer_collapsed_total', 'counter',
+             'Member updates merged into another pending update instead of sent on their own.', {},
+             stats['collapsed']),
+            ('write_coalescer_pending', 'gauge', 'Addresses with a merged update waiting to be sent.', {},
+             stats['pending']),
+            ('write_coalescer_retries_total', 'counter',
+             'Merged updates put back in the queue after a retryable Mailgun failure.', {}, stats['retries']),
+            ('write_coalescer_dropped_total', 'counter',
+             'Merged updates given up on (non-retryable failure or out of attempts).', {}, stats['dropped']),
+        ]
+        collected.extend(('write_coalescer_flushes_total', 'counter', 'Merged updates sent to Mailgun, by status.',
+                          {'status': status}, count)
+                         for status, count in stats['flushes'].items())
+        return collected
+    collect.__name__ = 'write_coalescer'
+    return collect
+
+
+def _webhooks_collector(app):
+    from services import webhooks
+
+    def collect():
+        processor = app.extensions.get(webhooks.EXTENSION_KEY)
+        if processor is None:
+            return []
+        stats = processor.stats()
+        collected = [('webhook_events_received_total', 'counter', 'Verified Mailgun webhook events, by event type.',
+                      {'event': event}, count) for event, count in stats['received'].items()]
+        collected.extend((
+            ('webhook_events_dropped_total', 'counter', 'Webhook events refused with 503 because the buffer was full.',
+             {}, stats['dropped']),
+            ('webhook_events_applied_total', 'counter', 'Webhook events applied to the mirror and cache.', {},
+             stats['applied']),
+            ('webhook_events_failed_total', 'counter', 'Webhook events in batches that failed to apply.', {},
+             stats['failed']),
+            ('webhook_batches_total', 'counter', 'Batches of webhook events applied.', {}, stats['batches']),
+            ('webhook_events_pending', 'gauge', 'Webhook events buffered and waiting to be applied.', {},
+             stats['pending']),
+        ))
+        return collected
+    collect.__name__ = 'webhooks'
+    return collect
+
+
+def _http_cache_collector(app):
+    from api import http_cache
+
+    def collect():
+        cache = app.extensions.get(http_cache.EXTENSION_KEY)
+        if cache is None:
+            return []
+        stats = cache.stats()
+        collected = [
+            ('http_not_modified_total', 'counter', 'GET requests answered 304 from a matching If-None-Match.', {},
+             stats.get('not_modified', 0)),
+            ('http_response_memo_hits_total', 'counter',
+             'JSON responses served from the serialized-body memo instead of being encoded again.', {},
+             stats.get('memo_hits', 0)),
+            ('http_response_memo_bytes', 'gauge', 'Bytes of serialized response bodies held in the memo.', {},
+             stats['memo_bytes']),
+        ]
+        collected.extend(('http_responses_compressed_total', 'counter', 'GET responses sent compressed, by encoding.',
+                          {'encoding': encoding}, stats.get(f'compressed_{encoding}', 0))
+                         for encoding in cache.encodings)
+        return collected
+    collect.__name__ = 'http_cache'
+    return collect
+
+
+def _log_pipeline_collector(app):
+    from services import log_pipeline
+
+    def collect():
+        pipeline = app.extensions.get(log_pipeline.EXTENSION_KEY)
+        if pipeline is None:
+            return []
+        stats = pipeline.stats()
+        return [
+            ('log_records_dropped_total', 'counter', 'Log records dropped before output, by reason.',
+             {'reason': 'queue_full'}, stats['dropped_full']),
+            ('log_records_dropped_total', 'counter', 'Log records dropped before output, by reason.',
+             {'reason': 'sampled'}, stats['sampled']),
+            ('log_queue_depth', 'gauge', 'Log records waiting for the writer thread.', {}, stats['queued']),
+        ]
+    collect.__name__ = 'log_pipeline'
+    return collect
+
+
+def _route(rule):
+    return rule.rule if rule is not None else '<unmatched>'
+
+
+def _before_request():
+    metrics = current_app.extensions[EXTENSION_KEY]
+    g.metrics_start = time.perf_counter()
+    metrics.http_requests_in_flight.inc()
+
+
+def _after_request(response):
+    start = g.get('metrics_start')
+    if start is not None:
+        metrics = current_app.extensions[EXTENSION_KEY]
+        metrics.observe_request(request.method, _route(request.url_rule), response.status_code,
+                                time.perf_counter() - start)
+        g.metrics_recorded = True
+    return response
+
+
+def _teardown_request(error=None):
+    start = g.get('metrics_start')
+    if start is None:
+        return
+    metrics = current_app.extensions[EXTENSION_KEY]
+    metrics.http_requests_in_flight.dec()
+    if not g.get('metrics_recorded'):
+        # after_request never ran: the request failed with an unhandled exception
+        metrics.observe_request(request.method, _route(request.url_rule), 500, time.perf_counter() - start)
+
+
+def metrics_view():
+    """GET /metrics: Prometheus text format, aggregated over all worker processes."""
+    return Response(current_app.extensions[EXTENSION_KEY].render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    """Creates the metrics registry (if enabled), installs the request hooks and the /metrics route."""
+    metrics = Metrics.from_config(app.config)
+    app.extensions[EXTENSION_KEY] = metrics
+    if metrics is None:
+        return None
+    metrics.add_collector(_cache_collector(app))
+    metrics.add_collector(_single_flight_collector(app))
+    metrics.add_collector(_write_coalescer_collector(app))
+    metrics.add_collector(_http_cache_collector(app))
+    metrics.add_collector(_webhooks_collector(app))
+    metrics.add_collector(_log_pipeline_collector(app))
+    metrics.add_collector(_write_queue_collector(app), shared=True)
+    metrics.add_collector(_mirror_collector(app), shared=True)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', metrics_view)
+    return metrics
+
+
+def get_metrics():
+    """Returns the metrics registry for the current app, or None when metrics are disabled."""
+    return current_app.extensions.get(EXTENSION_KEY)
@@ -0,0 +1,578 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from flask import current_app
+from services import mailgun_service, mail_lists
+from services.mail_lists import current_list_address
+from services.rate_limiter import wait_policy
+
+log = logging.getLogger(__name__)
+
+# Key used to store the mirror on the Flask app (app.extensions)
+EXTENSION_KEY = 'mirror'
+
+# Values of the `source` query parameter on the subscriber GET endpoints
+SOURCES = ('mailgun', 'mirror')
+
+# Query parameters that filter the list (served from the mirror only)
+FILTERS = ('subscribed', 'domain', 'prefix', 'name')
+MAX_QUERY_LIMIT = 1000
+
+# Bumped when the schema changes: the mirror is rebuilt from Mailgun rather than migrated
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    list_address TEXT NOT NULL,
+    address TEXT NOT NULL COLLATE NOCASE,
+    name TEXT,
+    subscribed INTEGER NOT NULL DEFAULT 1,
+    vars TEXT,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL NOT NULL,
+    domain TEXT GENERATED ALWAYS AS (lower(substr(address, instr(address, '@') + 1))) VIRTUAL,
+    PRIMARY KEY (list_address, address)
+);
+CREATE INDEX IF NOT EXISTS members_address ON members (address);
+CREATE INDEX IF NOT EXISTS members_subscribed ON members (list_address, subscribed, address);
+CREATE INDEX IF NOT EXISTS members_domain ON members (list_address, domain, address);
+CREATE INDEX IF NOT EXISTS members_name ON members (list_address, name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS sync_state (
+    list_address TEXT PRIMARY KEY,
+    started_at REAL,
+    cursor TEXT,
+    lease_until REAL,
+    completed_at REAL,
+    duration REAL,
+    member_count INTEGER
+);
+"""
+
+# Fields left out of a member (None) keep their stored value; new members default to subscribed
+UPSERT = (
+    "INSERT INTO members (list_address, address, name, subscribed, vars, dirty, synced_at) "
+    "VALUES (:list_address, :address, :name, COALESCE(:subscribed, 1), :vars, :dirty, :synced_at) "
+    "ON CONFLICT (list_address, address) DO UPDATE SET "
+    "name = COALESCE(:name, name), subscribed = COALESCE(:subscribed, subscribed), "
+    "vars = COALESCE(:vars, vars), dirty = :dirty, synced_at = :synced_at"
+)
+
+
+def _to_bool(value):
+    if value is None or isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on', 'y')
+
+
+def _row_values(list_address, member, dirty, synced_at):
+    """UPSERT parameters for a Mailgun member dict."""
+    subscribed = _to_bool(member.get('subscribed'))
+    member_vars = member.get('vars')
+    if member_vars is not None and not isinstance(member_vars, str):
+        member_vars = json.dumps(member_vars)
+    return {
+        'list_address': list_address,
+        'address': member['address'],
+        'name': member.get('name'),
+        'subscribed': None if subscribed is None else int(subscribed),
+        'vars': member_vars,
+        'dirty': int(dirty),
+        'synced_at': synced_at,
+    }
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _where(list_address, subscribed=None, domain=None, prefix=None, name=None):
+    """
+    WHERE clause and parameters for the list filters. Every filter but the name
+    substring is answered from an index; matching is case-insensitive.
+    """
+    clauses = ["list_address = :list_address"]
+    params = {'list_address': list_address}
+    if subscribed is not None:
+        clauses.append("subscribed = :subscribed")
+        params['subscribed'] = int(subscribed)
+    if domain:
+        clauses.append("domain = :domain")
+        params['domain'] = domain.lstrip('@').lower()
+    if prefix:
+        # A prefix LIKE on the NOCASE address column becomes a range scan of the primary key
+        clauses.append("address LIKE :prefix ESCAPE '\\'")
+        params['prefix'] = _escape_like(prefix) + '%'
+    if name:
+        clauses.append("name LIKE :name ESCAPE '\\'")
+        params['name'] = '%' + _escape_like(name) + '%'
+    return ' AND '.join(clauses), params
+
+
+def _to_member(row):
+    """The Mailgun representation of a mirror row."""
+    return {
+        'address': row['address'],
+        'name': row['name'] or '',
+        'subscribed': bool(row['subscribed']),
+        'vars': json.loads(row['vars']) if row['vars'] else {},
+    }
+
+
+class SubscriberMirror:
+    """
+    Local SQLite copy of the Mailgun member list(s).
+
+    Filled by a periodic sync (MirrorSync) and kept current between syncs by
+    write-through from the member writes in services.mailgun_service. Members
+    whose write had an unknown outcome (timeout, 5xx) are flagged `dirty`:
+    single-member reads for them go back to Mailgun until the row is refreshed.
+
+    Like the write queue, each process (gunicorn worker) uses its own
+    connections to a shared WAL-mode database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            conn.executescript("DROP TABLE IF EXISTS members; DROP TABLE IF EXISTS sync_state;")
+        conn.executescript(SCHEMA)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def _connect(self):
+        """Returns this thread's connection, opening a new one after a fork."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # -- write-through -----------------------------------------------------
+
+    def upsert(self, list_address, members, dirty=False):
+        """Stores members (Mailgun dicts; absent fields are left unchanged)."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(UPSERT, [_row_values(list_address, member, dirty, now) for member in members])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, list_address, addresses):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany("DELETE FROM members WHERE list_address = ? AND address = ?",
+                             [(list_address, address) for address in addresses])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def apply_unsubscribes(self, list_address, members):
+        """
+        Marks members unsubscribed from webhook events, given (address, occurred_at) pairs.
+
+        Rows written after the event (a later write-through or sync page) are
+        newer and are left alone, as are members the mirror doesn't have.
+        Returns the number of rows changed.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            changed = conn.executemany(
+                "UPDATE members SET subscribed = 0, synced_at = ? "
+                "WHERE list_address = ? AND address = ? AND synced_at <= ?",
+                [(now, list_address, address, occurred_at) for address, occurred_at in members],
+            ).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return changed
+
+    def mark_dirty(self, list_address, addresses):
+        """Flags existing rows as unreliable until the next refresh (e.g. after a timed-out update or delete)."""
+        now = time.time()
+        self._connect().executemany(
+            "UPDATE members SET dirty = 1, synced_at = ? WHERE list_address = ? AND address = ?",
+            [(now, list_address, address) for address in addresses],
+        )
+
+    # -- reads ---------------------------------------------------------------
+
+    def get(self, list_address, address):
+        """Returns the row for a member, or None if the mirror doesn't have it."""
+        return self._connect().execute(
+            "SELECT * FROM members WHERE list_address = ? AND address = ?", (list_address, address)
+        ).fetchone()
+
+    def list(self, list_address, limit=100):
+        rows = self._connect().execute(
+            "SELECT * FROM members WHERE list_address = ? ORDER BY address LIMIT ?", (list_address, limit)
+        ).fetchall()
+        return [_to_member(row) for row in rows]
+
+    def count(self, list_address, **filters):
+        where, params = _where(list_address, **filters)
+        return self._connect().execute(f"SELECT COUNT(*) FROM members WHERE {where}", params).fetchone()[0]
+
+    def query(self, list_address, limit=100, offset=0, **filters):
+        """Members matching the filters (see _where), ordered by address."""
+        where, params = _where(list_address, **filters)
+        rows = self._connect().execute(
+            f"SELECT * FROM members WHERE {where} ORDER BY address LIMIT :limit OFFSET :offset",
+            dict(params, limit=limit, offset=offset),
+        ).fetchall()
+        return [_to_member(row) for row in rows]
+
+    def age(self, list_address):
+        """Seconds since the last completed sync, or None if the list was never synced."""
+        row = self._connect().execute(
+            "SELECT completed_at FROM sync_state WHERE list_address = ?", (list_address,)
+        ).fetchone()
+        if row is None or row['completed_at'] is None:
+            return None
+        return max(0.0, time.time() - row['completed_at'])
+
+    def serve_member(self, list_address, address, max_staleness):
+        """
+        (result, status, headers) for a member read, or None when Mailgun has to answer
+        (never synced, older than `max_staleness` seconds, or the member's row is dirty).
+        """
+        age = self.age(list_address)
+        if age is None or age > max_staleness:
+            return None
+        row = self.get(list_address, address)
+        headers = {'Age': str(int(age)), 'X-Data-Source': 'mirror'}
+        if row is None:
+            return {"message": "Member not found"}, 404, headers
+        if row['dirty']:
+            return None
+        return {"member": _to_member(row)}, 200, headers
+
+    def serve_list(self, list_address, max_staleness, limit=100):
+        """(result, status, headers) in the shape of Mailgun's /members response, or None when stale."""
+        age = self.age(list_address)
+        if age is None or age > max_staleness:
+            return None
+        headers = {'Age': str(int(age)), 'X-Data-Source': 'mirror'}
+        return {"items": self.list(list_address, limit), "total_count": self.count(list_address)}, 200, headers
+
+    def _unavailable(self, age, max_staleness):
+        """The 503 for a filtered read the mirror can't answer (there is no Mailgun equivalent to fall back to)."""
+        if age is None:
+            message = "The subscriber mirror has not finished its first sync yet"
+        else:
+            message = f"The subscriber mirror is {int(age)}s old, more than max_staleness ({max_staleness:g}s)"
+        return {"message": message}, 503, {'Retry-After': '30'}
+
+    def serve_query(self, list_address, max_staleness, limit=100, offset=0, **filters):
+        """(result, status, headers) for a filtered, paginated list read."""
+        age = self.age(list_address)
+        if age is None or age > max_staleness:
+            return self._unavailable(age, max_staleness)
+        headers = {'Age': str(int(age)), 'X-Data-Source': 'mirror'}
+        return {
+            "items": self.query(list_address, limit, offset, **filters),
+            "total_count": self.count(list_address, **filters),
+            "limit": limit,
+            "offset": offset,
+        }, 200, headers
+
+    def serve_count(self, list_address, max_staleness, **filters):
+        """(result, status, headers) for a count of the members matching the filters."""
+        age = self.age(list_address)
+        if age is None or age > max_staleness:
+            return self._unavailable(age, max_staleness)
+        return {"count": self.count(list_address, **filters)}, 200, {'Age': str(int(age)), 'X-Data-Source': 'mirror'}
+
+    # -- sync bookkeeping ----------------------------------------------------
+
+    def claim_sync(self, list_address, interval, lease_seconds=60.0):
+        """
+        Leases the sync of a list if one is due and no other process holds it.
+
+        Returns (cursor, started_at): `cursor` is the last address applied by an
+        interrupted sync (None to start from the top). Returns None when there's
+        nothing to do.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT * FROM sync_state WHERE list_address = ?", (list_address,)).fetchone()
+            if row is not None and (row['lease_until'] or 0) > now:
+                conn.execute('ROLLBACK')
+                return None
+            if row is not None and row['cursor'] is None and (row['completed_at'] or 0) > now - interval:
+                conn.execute('ROLLBACK')
+                return None
+            cursor = row['cursor'] if row is not None else None
+            started_at = row['started_at'] if cursor is not None else now
+            conn.execute(
+                "INSERT INTO sync_state (list_address, started_at, cursor, lease_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (list_address) DO UPDATE SET started_at = excluded.started_at, "
+                "cursor = excluded.cursor, lease_until = excluded.lease_until",
+                (list_address, started_at, cursor, now + lease_seconds),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor, started_at
+
+    def apply_page(self, list_address, items, fetched_at, lease_seconds=60.0):
+        """
+        Stores one page of members and moves the sync cursor past it.
+
+        Rows written through after the page was fetched are newer than the
+        page and are left alone.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                UPSERT + " WHERE members.synced_at < :fetched_at",
+                [dict(_row_values(list_address, member, False, now), fetched_at=fetched_at) for member in items],
+            )
+            conn.execute("UPDATE sync_state SET cursor = ?, lease_until = ? WHERE list_address = ?",
+                         (items[-1]['address'], now + lease_seconds, list_address))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def finish_sync(self, list_address, started_at):
+        """Drops members Mailgun no longer has (not seen or written since the sync began); returns the count removed."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            removed = conn.execute("DELETE FROM members WHERE list_address = ? AND synced_at < ?",
+                                   (list_address, started_at)).rowcount
+            count = conn.execute("SELECT COUNT(*) FROM members WHERE list_address = ?",
+                                 (list_address,)).fetchone()[0]
+            conn.execute(
+                "UPDATE sync_state SET started_at = NULL, cursor = NULL, lease_until = NULL, completed_at = ?, "
+                "duration = ?, member_count = ? WHERE list_address = ?",
+                (now, now - started_at, count, list_address),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return removed
+
+    def release_sync(self, list_address):
+        """Gives up the lease after a failed sync; the cursor is kept so the next attempt resumes."""
+        self._connect().execute("UPDATE sync_state SET lease_until = NULL WHERE list_address = ?", (list_address,))
+
+    def stats(self, list_address):
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM sync_state WHERE list_address = ?", (list_address,)).fetchone()
+        members, dirty = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(dirty), 0) FROM members WHERE list_address = ?", (list_address,)
+        ).fetchone()
+        age = self.age(list_address)
+        return {
+            'members': members,
+            'dirty': dirty,
+            'age_seconds': round(age, 1) if age is not None else None,
+            'last_sync_duration': round(row['duration'], 3) if row is not None and row['duration'] else None,
+            'sync_in_progress': row is not None and row['cursor'] is not None,
+        }
+
+
+class MirrorSync:
+    """
+    Background thread that refreshes the mirror from Mailgun every `interval` seconds.
+
+    Mailgun has no change feed, so each pass pages through /members/pages, but
+    every page is applied (and the cursor saved) as it arrives: readers see
+    the mirror fill in incrementally and an interrupted pass resumes where it
+    stopped. The pass is leased in the database, so with several workers only
+    one of them talks to Mailgun at a time. The thread is (re)started lazily
+    after a fork.
+    """
+
+    def __init__(self, app, mirror, interval=300.0, lease_seconds=60.0):
+        self.app = app
+        self.mirror = mirror
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Starts the sync thread for this process if it isn't running."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='subscriber-mirror-sync', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                background_wait = self.app.config.get('MAILGUN_RATE_LIMIT_BACKGROUND_MAX_WAIT', 30)
+                with self.app.app_context(), wait_policy(background_wait):
+                    self.sync_once()
+            except Exception as e:
+                log.error("Subscriber mirror sync failed: %s", e)
+            # Check often enough to take over from a worker that died mid-sync
+            self._stopping.wait(min(self.interval, self.lease_seconds))
+
+    def sync_once(self, force=False):
+        """Runs a sync pass for each configured list that is due; returns True if any pass completed."""
+        synced = False
+        for mail_list in mail_lists.get_lists():
+            if self._stopping.is_set():
+                break
+            try:
+                with mail_list.scope():
+                    synced = self._sync_list(mail_list.address, force) or synced
+            except Exception as e:
+                # One list failing (e.g. it was deleted in Mailgun) doesn't hold up the others
+                log.error("Subscriber mirror sync for %s failed: %s", mail_list.address, e)
+        return synced
+
+    def _sync_list(self, list_address, force=False):
+        claimed = self.mirror.claim_sync(list_address, 0 if force else self.interval, self.lease_seconds)
+        if claimed is None:
+            return False
+        cursor, started_at = claimed
+        log.info("Syncing subscriber mirror for %s%s", list_address, f" (resuming after {cursor})" if cursor else '')
+        pages = 0
+        try:
+            member_pages = mailgun_service.iter_member_pages(cursor=cursor)
+            while not self._stopping.is_set():
+                fetched_at = time.time()
+                items = next(member_pages, None)
+                if items is None:
+                    break
+                self.mirror.apply_page(list_address, items, fetched_at, self.lease_seconds)
+                pages += 1
+            else:
+                self.mirror.release_sync(list_address)
+                return False
+            removed = self.mirror.finish_sync(list_address, started_at)
+        except Exception:
+            self.mirror.release_sync(list_address)
+            raise
+        log.info("Subscriber mirror for %s synced: %d page(s), %d removed", list_address, pages, removed)
+        return True
+
+
+def init_app(app):
+    """Creates the subscriber mirror and its sync thread when MIRROR_ENABLED is set."""
+    if not app.config.get('MIRROR_ENABLED'):
+        app.extensions[EXTENSION_KEY] = None
+        return None
+    mirror = SubscriberMirror(app.config.get('MIRROR_PATH', 'subscriber_mirror.sqlite3'))
+    sync = MirrorSync(app, mirror, interval=float(app.config.get('MIRROR_SYNC_INTERVAL', 300)))
+    app.extensions[EXTENSION_KEY] = sync
+    if app.config.get('MIRROR_START_SYNC', True):
+        sync.ensure_started()
+    return sync
+
+
+def get_mirror():
+    """Returns the subscriber mirror for the current app, or None when it is disabled."""
+    sync = current_app.extensions.get(EXTENSION_KEY)
+    return sync.mirror if sync is not None else None
+
+
+def resolve_read(config, source=None, max_staleness=None):
+    """
+    The staleness bound (seconds) a GET may be served from the mirror with, or
+    None when it must go to Mailgun. `source` and `max_staleness` are the request's
+    query parameters; MIRROR_DEFAULT_SOURCE and MIRROR_MAX_STALENESS fill them in.
+    """
+    if source is None:
+        source = config.get('MIRROR_DEFAULT_SOURCE', 'mailgun')
+    if source != 'mirror':
+        return None
+    return max_staleness if max_staleness is not None else float(config.get('MIRROR_MAX_STALENESS', 600))
+
+
+def filtered_read_bound(config, max_staleness=None):
+    """Staleness bound for filtered reads and counts, which always come from the mirror."""
+    return max_staleness if max_staleness is not None else float(config.get('MIRROR_MAX_STALENESS', 600))
+
+
+def _mirror_required():
+    return {"message": "Filtering and counting are served from the subscriber mirror; "
+                       "it is disabled (MIRROR_ENABLED=false)"}, 501
+
+
+def query_members(filters, limit=100, offset=0, max_staleness=None):
+    """Serves a filtered list GET from the mirror: (result, status[, headers])."""
+    sync = current_app.extensions.get(EXTENSION_KEY)
+    if sync is None:
+        return _mirror_required()
+    if current_app.config.get('MIRROR_START_SYNC', True):
+        sync.ensure_started()
+    return sync.mirror.serve_query(current_list_address(),
+                                   filtered_read_bound(current_app.config, max_staleness), limit, offset, **filters)
+
+
+def count_members(filters, max_staleness=None):
+    """Serves GET /count from the mirror: (result, status[, headers])."""
+    sync = current_app.extensions.get(EXTENSION_KEY)
+    if sync is None:
+        return _mirror_required()
+    if current_app.config.get('MIRROR_START_SYNC', True):
+        sync.ensure_started()
+    return sync.mirror.serve_count(current_list_address(),
+                                   filtered_read_bound(current_app.config, max_staleness), **filters)
+
+
+def read_member(member_address, source=None, max_staleness=None):
+    """Serves a member GET from the mirror when asked and fresh enough; None means ask Mailgun."""
+    sync = current_app.extensions.get(EXTENSION_KEY)
+    if sync is None:
+        return None
+    bound = resolve_read(current_app.config, source, max_staleness)
+    if bound is None:
+        return None
+    if current_app.config.get('MIRROR_START_SYNC', True):
+        sync.ensure_started()
+    return sync.mirror.serve_member(current_list_address(), member_address, bound)
+
+
+def read_list(source=None, max_staleness=None):
+    """Serves the list GET from the mirror when asked and fresh enough; None means ask Mailgun."""
+    sync = current_app.extensions.get(EXTENSION_KEY)
+    if sync is None:
+        return None
+    bound = resolve_read(current_app.config, source, max_staleness)
+    if bound is None:
+        return None
+    if current_app.config.get('MIRROR_START_SYNC', True):
+        sync.ensure_started()
+    return sync.mirror.serve_list(current_list_address(), bound)
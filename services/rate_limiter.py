@@ -0,0 +1,269 @@
+import os
+import mmap
+import time
+import struct
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from services.errors import MailgunUnavailable
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; fall back to a per-process bucket
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# Shared bucket state: tokens, last refill (CLOCK_MONOTONIC is system-wide on Linux)
+_STATE = struct.Struct('<dd')
+
+# Per-context override of how long callers may wait for tokens (see wait_policy)
+_max_wait_override = contextvars.ContextVar('mailgun_rate_limit_max_wait', default=None)
+
+
+class RateLimitExceeded(MailgunUnavailable):
+    """Raised when the outbound Mailgun rate limit would require waiting longer than allowed."""
+
+
+def _reserve(tokens, updated, now, rate, capacity, weight, max_wait):
+    """
+    Core token-bucket step shared by the local and the cross-process bucket.
+
+    Returns (new_tokens, wait). A reservation may drive the bucket negative so
+    concurrent waiters queue up behind each other instead of all retrying at
+    once; `wait` is None when the caller would have to wait longer than `max_wait`.
+    """
+    elapsed = now - updated
+    if elapsed < 0:  # Stale state (e.g. from before a reboot)
+        elapsed = 0
+    tokens = min(capacity, tokens + elapsed * rate)
+    if tokens >= weight:
+        return tokens - weight, 0.0
+    wait = (weight - tokens) / rate
+    if wait > max_wait:
+        return tokens, None
+    return tokens - weight, wait
+
+
+class TokenBucket:
+    """In-process token bucket (used when a shared bucket isn't available)."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, weight, max_wait):
+        """Takes `weight` tokens; returns the seconds to wait before sending, or None to refuse."""
+        with self._lock:
+            now = self._clock()
+            self._tokens, wait = _reserve(self._tokens, self._updated, now, self.rate, self.capacity, weight, max_wait)
+            self._updated = now
+            return wait
+
+    def retry_after(self, weight):
+        """Seconds until `weight` tokens would be available."""
+        with self._lock:
+            tokens = min(self.capacity, self._tokens + (self._clock() - self._updated) * self.rate)
+        return max(0.0, (weight - tokens) / self.rate)
+
+    def penalize(self, seconds):
+        """Empties the bucket so no tokens are handed out for `seconds` (upstream told us to back off)."""
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self.rate)
+            self._updated = self._clock()
+
+    def snapshot(self):
+        with self._lock:
+            tokens = min(self.capacity, self._tokens + (self._clock() - self._updated) * self.rate)
+        return {'tokens': round(tokens, 2), 'rate': self.rate, 'capacity': self.capacity, 'shared': False}
+
+
+class SharedTokenBucket:
+    """
+    Token bucket shared by every worker process on the host.
+
+    The bucket state lives in a small memory-mapped file; updates are serialized
+    with flock() across processes and a threading.Lock within a process (flock
+    doesn't exclude threads sharing one file descriptor). Each process opens its
+    own descriptor after fork, because forked children would otherwise share the
+    parent's lock. The file is created with mode 0600 and never through a
+    symlink, and a file owned by another user is refused, so no other local
+    user can drain or inflate the bucket.
+    """
+
+    def __init__(self, path, rate, capacity, clock=time.monotonic):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        stat = os.fstat(fd)
+        if stat.st_uid != os.getuid():
+            os.close(fd)
+            raise PermissionError(f"Rate limit bucket {self.path} is owned by another user")
+        if stat.st_mode & 0o077:
+            os.fchmod(fd, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < _STATE.size:
+                os.ftruncate(fd, _STATE.size)
+                os.pwrite(fd, _STATE.pack(self.capacity, self._clock()), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(fd, _STATE.size)
+        self._fd = fd
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reserve(self, weight, max_wait):
+        """Takes `weight` tokens; returns the seconds to wait before sending, or None to refuse."""
+        with self._locked():
+            tokens, updated = _STATE.unpack_from(self._map)
+            now = self._clock()
+            tokens, wait = _reserve(tokens, updated, now, self.rate, self.capacity, weight, max_wait)
+            _STATE.pack_into(self._map, 0, tokens, now)
+            return wait
+
+    def retry_after(self, weight):
+        """Seconds until `weight` tokens would be available."""
+        with self._locked():
+            tokens, updated = _STATE.unpack_from(self._map)
+        tokens = min(self.capacity, tokens + max(0.0, self._clock() - updated) * self.rate)
+        return max(0.0, (weight - tokens) / self.rate)
+
+    def penalize(self, seconds):
+        """Empties the bucket for every worker so no tokens are handed out for `seconds`."""
+        with self._locked():
+            tokens, _ = _STATE.unpack_from(self._map)
+            _STATE.pack_into(self._map, 0, min(tokens, -seconds * self.rate), self._clock())
+
+    def snapshot(self):
+        with self._locked():
+            tokens, updated = _STATE.unpack_from(self._map)
+        tokens = min(self.capacity, tokens + max(0.0, self._clock() - updated) * self.rate)
+        return {'tokens': round(tokens, 2), 'rate': self.rate, 'capacity': self.capacity, 'shared': True}
+
+
+class RateLimiter:
+    """
+    Outbound rate limiter for Mailgun calls with per-operation weights.
+
+    Writes cost more than reads by default. Callers either wait for tokens (up to
+    `max_wait` seconds) or, when the wait would be longer, get RateLimitExceeded,
+    which the API turns into 503 + Retry-After.
+    """
+
+    def __init__(self, bucket, read_weight=1.0, write_weight=2.0, weights=None, max_wait=1.0):
+        self.bucket = bucket
+        self.read_weight = read_weight
+        self.write_weight = write_weight
+        self.weights = weights or {}
+        self.max_wait = max_wait
+        self.waited = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the limiter from a Flask config mapping, or returns None when disabled."""
+        if not config.get('MAILGUN_RATE_LIMIT_ENABLED', True):
+            return None
+        rate = float(config.get('MAILGUN_RATE_LIMIT_RATE', 20))
+        capacity = float(config.get('MAILGUN_RATE_LIMIT_BURST', 40))
+        path = config.get('MAILGUN_RATE_LIMIT_PATH') or 'mailgun_rate_limit.bucket'
+        if fcntl is not None and config.get('MAILGUN_RATE_LIMIT_SHARED', True):
+            bucket = SharedTokenBucket(path, rate, capacity)
+        else:
+            bucket = TokenBucket(rate, capacity)
+        return cls(
+            bucket,
+            read_weight=float(config.get('MAILGUN_RATE_LIMIT_READ_WEIGHT', 1)),
+            write_weight=float(config.get('MAILGUN_RATE_LIMIT_WRITE_WEIGHT', 2)),
+            weights=parse_weights(config.get('MAILGUN_RATE_LIMIT_WEIGHTS')),
+            max_wait=float(config.get('MAILGUN_RATE_LIMIT_MAX_WAIT', 1)),
+        )
+
+    def weight_for(self, method, operation=None):
+        if operation in self.weights:
+            return self.weights[operation]
+        return self.read_weight if method.upper() in ('GET', 'HEAD') else self.write_weight
+
+    def reserve(self, method, operation=None):
+        """
+        Reserves tokens for one call and returns the seconds to wait before sending
+        it (without sleeping), or raises RateLimitExceeded. Async callers use this
+        and sleep on the event loop.
+        """
+        weight = self.weight_for(method, operation)
+        max_wait = _max_wait_override.get()
+        if max_wait is None:
+            max_wait = self.max_wait
+        wait = self.bucket.reserve(weight, max_wait)
+        if wait is None:
+            self.rejected += 1
+            retry_after = self.bucket.retry_after(weight)
+            raise RateLimitExceeded("Outbound Mailgun rate limit reached, try again later.", retry_after=retry_after)
+        if wait > 0:
+            self.waited += 1
+        return wait
+
+    def acquire(self, method, operation=None):
+        """Blocks until the call may be sent, or raises RateLimitExceeded."""
+        wait = self.reserve(method, operation)
+        if wait > 0:
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """Called when Mailgun answers 429 so every worker backs off, not just this one."""
+        self.bucket.penalize(seconds)
+
+    def snapshot(self):
+        stats = self.bucket.snapshot()
+        stats.update(waited=self.waited, rejected=self.rejected, max_wait=self.max_wait)
+        return stats
+
+
+def parse_weights(value):
+    """Parses 'operation=weight,operation=weight' into a dict."""
+    weights = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, weight = item.split('=', 1)
+            weights[name.strip()] = float(weight)
+    return weights
+
+
+@contextmanager
+def wait_policy(max_wait):
+    """
+    Overrides how long Mailgun calls made in this context may wait for tokens.
+
+    Background work (bulk imports, the write-queue dispatcher) can afford to wait
+    much longer than a request handler; `max_wait=0` always fails fast.
+    """
+    token = _max_wait_override.set(max_wait)
+    try:
+        yield
+    finally:
+        _max_wait_override.reset(token)
@@ -0,0 +1,223 @@
+import time
+import random
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+from services.errors import MailgunUnavailable
+
+log = logging.getLogger(__name__)
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Upstream statuses that are transient and worth retrying
+RETRYABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class CircuitOpenError(MailgunUnavailable):
+    """Raised instead of calling Mailgun while the endpoint's breaker is open."""
+
+
+def parse_retry_after(value, now=None):
+    """Parses a Retry-After header (delta seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment is None:
+        return None
+    return max(0.0, moment.timestamp() - (now if now is not None else time.time()))
+
+
+class RetryPolicy:
+    """Decides whether to retry and how long to wait (full-jitter exponential backoff)."""
+
+    def __init__(self, max_attempts=3, base_delay=0.2, max_delay=2.0, max_retry_after=5.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # A Retry-After longer than this isn't worth holding a worker for
+        self.max_retry_after = max_retry_after
+
+    def compute_delay(self, attempt, retry_after=None):
+        """
+        Returns the delay before retry number `attempt` (1-based), or None if the
+        server asked us to wait longer than we are willing to.
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is None:
+            return backoff
+        if retry_after > self.max_retry_after:
+            return None
+        return max(retry_after, backoff)
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of recent traffic so retries can't amplify load.
+
+    Every request deposits `ratio` tokens and every retry withdraws one. A small
+    per-second allowance lets low-traffic processes retry at all.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=50.0, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._clock = clock
+        self._tokens = max_tokens
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        """Withdraws one retry token; returns False when the budget is exhausted."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def snapshot(self):
+        with self._lock:
+            self._refill()
+            return {'tokens': round(self._tokens, 2), 'exhausted': self.exhausted}
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+
+    Opens after `failure_threshold` consecutive failures and fails fast until
+    `reset_timeout` has passed; then lets a single trial call through
+    (half-open) and closes again if it succeeds.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_in_flight = False
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be sent upstream."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - self._clock()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+            retry_after = max(remaining, 1.0)
+        raise CircuitOpenError(f"Mailgun endpoint '{self.name}' is unavailable (circuit open).", retry_after=retry_after)
+
+    def cancel_call(self):
+        """The call let through by before_call was never sent (e.g. rate limited): frees the half-open trial."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                log.info("Circuit breaker '%s' closed", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = self._clock()
+                self.times_opened += 1
+                log.warning("Circuit breaker '%s' opened after %d failure(s)", self.name, self.failures)
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.opened_at + self.reset_timeout - self._clock()), 2)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+                'retry_in': retry_in,
+            }
+
+
+class Resilience:
+    """Bundles the retry policy, the shared retry budget and one breaker per endpoint."""
+
+    def __init__(self, policy, budget, failure_threshold=5, reset_timeout=30.0):
+        self.policy = policy
+        self.budget = budget
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the resilience layer from a Flask config mapping."""
+        return cls(
+            policy=RetryPolicy(
+                max_attempts=config.get('MAILGUN_RETRY_MAX_ATTEMPTS', 3),
+                base_delay=config.get('MAILGUN_RETRY_BASE_DELAY', 0.2),
+                max_delay=config.get('MAILGUN_RETRY_MAX_DELAY', 2.0),
+                max_retry_after=config.get('MAILGUN_RETRY_MAX_RETRY_AFTER', 5.0),
+            ),
+            budget=RetryBudget(
+                ratio=config.get('MAILGUN_RETRY_BUDGET_RATIO', 0.2),
+                min_per_second=config.get('MAILGUN_RETRY_BUDGET_MIN_PER_SECOND', 1.0),
+            ),
+            failure_threshold=config.get('MAILGUN_BREAKER_FAILURE_THRESHOLD', 5),
+            reset_timeout=config.get('MAILGUN_BREAKER_RESET_TIMEOUT', 30.0),
+        )
+
+    def breaker(self, endpoint):
+        """Returns the breaker for an endpoint, creating it on first use."""
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    endpoint, CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout))
+        return breaker
+
+    def snapshot(self):
+        """Breaker states and retry budget, for monitoring."""
+        return {
+            'breakers': {name: breaker.snapshot() for name, breaker in sorted(self._breakers.items())},
+            'retry_budget': self.budget.snapshot(),
+        }
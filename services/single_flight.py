@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import logging
+from collections import Counter
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+# Key used to store the coalescer on the Flask app (app.extensions)
+EXTENSION_KEY = 'single_flight'
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical reads within a process.
+
+    The first caller for a key (the leader) runs the fetch; callers arriving
+    while it is in flight wait for it and get the same result (or exception)
+    instead of sending their own identical request. Nothing is kept once the
+    call finishes: this only collapses overlapping requests, caching is the
+    subscriber cache's job.
+
+    `do` serves threads (WSGI workers), `do_async` the event loop of the ASGI
+    mode; both count the deduplicated calls per operation. Results are shared
+    between callers and must not be mutated.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.leaders = Counter()
+        self.coalesced = Counter()
+
+    def do(self, key, operation, fetch):
+        """Returns fetch(), or the result of an identical fetch already in flight on another thread."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders[operation] += 1
+            else:
+                self.coalesced[operation] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fetch()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, operation, fetch):
+        """Awaits fetch(), or an identical fetch already in flight on the event loop."""
+        task = self._tasks.get(key)
+        with self._lock:
+            (self.coalesced if task is not None else self.leaders)[operation] += 1
+        if task is None:
+            # A task of its own: the fetch goes on for the others if the leader's request is cancelled
+            task = self._tasks[key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda done: self._task_done(key, done))
+        return await asyncio.shield(task)
+
+    def _task_done(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Mark the exception retrieved even if every waiter went away
+
+    def forget(self, *keys):
+        """Makes the next read of these keys start a new call (after a write: the one in flight may be stale)."""
+        with self._lock:
+            for key in keys:
+                self._calls.pop(key, None)
+                self._tasks.pop(key, None)
+
+    def stats(self):
+        return {
+            'upstream_calls': dict(self.leaders),
+            'coalesced': dict(self.coalesced),
+            'in_flight': len(self._calls) + len(self._tasks),
+        }
+
+
+def init_app(app):
+    """Creates the read coalescer (if MAILGUN_COALESCE_READS) and registers it on the app."""
+    single_flight = SingleFlight() if app.config.get('MAILGUN_COALESCE_READS', True) else None
+    app.extensions[EXTENSION_KEY] = single_flight
+    return single_flight
+
+
+def get_single_flight():
+    """Returns the read coalescer for the current app, or None when coalescing is disabled."""
+    return current_app.extensions.get(EXTENSION_KEY)
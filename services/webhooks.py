@@ -0,0 +1,184 @@
+import os
+import time
+import queue
+import threading
+import logging
+from collections import Counter
+from flask import current_app
+from auth.decorators import ReplayCache
+from services import mailgun_service, mirror, mail_lists
+
+log = logging.getLogger(__name__)
+
+# Key used to store the webhook processor on the Flask app (app.extensions)
+EXTENSION_KEY = 'webhooks'
+
+# Mailgun event types counted by name; anything else is counted as 'other'
+EVENT_TYPES = frozenset(('accepted', 'rejected', 'delivered', 'failed', 'opened', 'clicked', 'unsubscribed',
+                         'complained', 'stored', 'list_member_uploaded', 'list_member_upload_error',
+                         'list_uploaded'))
+
+# Events that change local subscriber state. Mailgun keeps bounced and complaining addresses as list
+# members (it suppresses sending instead), so only unsubscribes are applied to the mirror and cache.
+APPLIED_EVENTS = frozenset(('unsubscribed',))
+
+# Outcomes of WebhookProcessor.accept
+QUEUED = 'queued'
+IGNORED = 'ignored'
+FULL = 'full'
+
+
+class WebhookProcessor:
+    """
+    Buffers verified Mailgun events in memory and applies them in batches.
+
+    The endpoint only verifies the signature and calls `accept`, so Mailgun
+    gets its answer in about a millisecond whatever the load. A worker thread
+    takes up to `batch_size` queued events at a time (waiting `linger`
+    seconds for more after the first), keeps the latest event per member and
+    applies the batch with one mirror transaction and one cache invalidation
+    per list. Events for lists this deployment doesn't serve are ignored.
+    When the buffer is full the endpoint answers 503 and Mailgun retries.
+
+    Buffered events are lost if the process dies; the periodic mirror sync
+    corrects the mirror from Mailgun. State is per process and the worker is
+    (re)started lazily after a fork.
+    """
+
+    def __init__(self, app, lists, max_pending=10000, batch_size=500, linger=0.05, replay_cache=None):
+        self.app = app
+        self.lists = lists
+        self.batch_size = batch_size
+        self.linger = linger
+        self.replay_cache = replay_cache
+        self.counts = Counter()
+        self._queue = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        """Starts the worker thread for this process if it isn't running."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='webhook-processor', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def accept(self, event):
+        """Queues a verified event (Mailgun's `event-data`) if it changes local state; returns the outcome."""
+        kind = event.get('event')
+        self._count(f"received:{kind if kind in EVENT_TYPES else 'other'}")
+        recipient = event.get('recipient')
+        mailing_list = event.get('mailing-list')
+        # Domain-wide unsubscribes carry no mailing list and leave list membership alone
+        served = self.lists.resolve(mailing_list.get('address')) if isinstance(mailing_list, dict) else None
+        if kind not in APPLIED_EVENTS or not isinstance(recipient, str) or served is None:
+            self._count('ignored')
+            return IGNORED
+        try:
+            occurred_at = float(event.get('timestamp') or time.time())
+        except (TypeError, ValueError):
+            occurred_at = time.time()
+        self.ensure_started()
+        try:
+            self._queue.put_nowait((served, recipient, occurred_at))
+        except queue.Full:
+            self._count('dropped')
+            return FULL
+        return QUEUED
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.app.app_context():
+                    self.apply(batch)
+            except Exception as e:
+                log.error("Applying %d webhook event(s) failed: %s", len(batch), e)
+                self._count('failed', len(batch))
+
+    def apply(self, events):
+        """
+        Applies (list, address, occurred_at) unsubscribes: the latest per member,
+        one transaction per list.
+        """
+        latest = {}
+        for mail_list, address, occurred_at in events:
+            key = (mail_list.name, address.lower())
+            if key not in latest or occurred_at > latest[key][2]:
+                latest[key] = (mail_list, address, occurred_at)
+        by_list = {}
+        for mail_list, address, occurred_at in latest.values():
+            by_list.setdefault(mail_list.name, (mail_list, []))[1].append((address, occurred_at))
+        changed = 0
+        subscriber_mirror = mirror.get_mirror()
+        for mail_list, members in by_list.values():
+            with mail_list.scope():
+                try:
+                    if subscriber_mirror is not None:
+                        changed += subscriber_mirror.apply_unsubscribes(mail_list.address, members)
+                finally:
+                    # Cached reads still show these members subscribed; the next read goes to the mirror or Mailgun
+                    mailgun_service.invalidate_members(*(address for address, _ in members))
+        with self._lock:
+            self.counts['applied'] += len(events)
+            self.counts['batches'] += 1
+            self.counts['mirror_updates'] += changed
+        log.info("Applied %d webhook event(s) for %d member(s) on %d list(s) (%d mirror row(s) changed)",
+                 len(events), len(latest), len(by_list), changed)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        received = {name.partition(':')[2]: count for name, count in counts.items() if name.startswith('received:')}
+        return {
+            'pending': self._queue.qsize(),
+            'received': received,
+            'ignored': counts.get('ignored', 0),
+            'dropped': counts.get('dropped', 0),
+            'applied': counts.get('applied', 0),
+            'failed': counts.get('failed', 0),
+            'batches': counts.get('batches', 0),
+            'mirror_updates': counts.get('mirror_updates', 0),
+        }
+
+
+def init_app(app):
+    """Creates the webhook processor when WEBHOOKS_ENABLED is set."""
+    if not app.config.get('WEBHOOKS_ENABLED'):
+        app.extensions[EXTENSION_KEY] = None
+        return None
+    replay_cache = None
+    if app.config.get('SIGNATURE_REPLAY_PROTECTION', True):
+        # Own cache: a burst of events must not crowd out (or be refused by) the API's signatures
+        replay_cache = ReplayCache(max_entries=app.config.get('WEBHOOK_REPLAY_CACHE_SIZE', 500000))
+    processor = WebhookProcessor(
+        app,
+        app.extensions.get(mail_lists.EXTENSION_KEY) or mail_lists.init_app(app),
+        max_pending=int(app.config.get('WEBHOOK_QUEUE_SIZE', 10000)),
+        batch_size=int(app.config.get('WEBHOOK_BATCH_SIZE', 500)),
+        linger=float(app.config.get('WEBHOOK_BATCH_LINGER', 0.05)),
+        replay_cache=replay_cache,
+    )
+    app.extensions[EXTENSION_KEY] = processor
+    return processor
+
+
+def get_processor():
+    """Returns the webhook processor for the current app, or None when webhooks are disabled."""
+    return current_app.extensions.get(EXTENSION_KEY)
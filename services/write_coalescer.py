@@ -0,0 +1,282 @@
+import os
+import time
+import atexit
+import threading
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from services import mailgun_service, mail_lists
+from services.errors import MailgunUnavailable
+
+log = logging.getLogger(__name__)
+
+# Key used to store the coalescer on the Flask app (app.extensions)
+EXTENSION_KEY = 'write_coalescer'
+
+
+def _is_retryable(status_code):
+    """Rate limiting and server/connection errors are worth retrying; other 4xx are not (as in write_queue)."""
+    return status_code == 429 or status_code >= 500
+
+
+class _Batch:
+    __slots__ = ('fields', 'requests', 'deadline', 'attempts')
+
+    def __init__(self, deadline):
+        self.fields = {}
+        self.requests = 0
+        self.deadline = deadline
+        self.attempts = 0
+
+
+class WriteCoalescer:
+    """
+    Merges member updates that arrive within `window` seconds into one Mailgun PUT.
+
+    The first update to an address opens a batch; later updates to the same
+    address are merged into it field by field (last write wins) until the
+    window closes, then a flusher thread sends the merged fields through
+    mailgun_service.update_member. Only one PUT per address is in flight at a
+    time, so updates reach Mailgun in the order they were accepted. Batches
+    are kept per list (services.mail_lists): the list active when an update is
+    submitted is the one it is sent to.
+
+    A PUT that fails with 429, 5xx or an unavailable Mailgun (open breaker,
+    rate limit) is put back in the queue and retried with exponential backoff,
+    up to `max_attempts` sends; updates accepted in the meantime are merged
+    over it. Other failures (e.g. 404) are final and only logged and counted.
+
+    Pending, retrying and in-flight fields can be overlaid on reads (`overlay`), so a
+    worker sees its own accepted updates before Mailgun does. State is per
+    process; the flusher is (re)started lazily after a fork and whatever is
+    still pending is flushed at exit.
+    """
+
+    def __init__(self, app, window=0.25, concurrency=4, max_attempts=5, retry_delay=1.0, retry_max_delay=30.0):
+        self.app = app
+        self.window = window
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.collapsed = 0
+        self.retries = 0
+        self.dropped = 0
+        self.flushes = Counter()
+        self._pending = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._thread = None
+        self._pid = None
+        self._executor = None
+        atexit.register(self.flush_all)
+
+    def ensure_started(self):
+        """Starts the flusher thread (and its send pool) for this process if it isn't running."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        if self._pid is not None and self._pid != os.getpid():
+            # Forked child: the parent's threads may have held the lock at fork time
+            self._lock = threading.Lock()
+            self._changed = threading.Condition(self._lock)
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='write-coalescer-send')
+            self._thread = threading.Thread(target=self._run, name='write-coalescer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    @staticmethod
+    def _key(address):
+        return mail_lists.active_list(), address
+
+    def submit(self, address, fields):
+        """Accepts an update; returns the fields that will be sent for the address so far."""
+        self.ensure_started()
+        key = self._key(address)
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = _Batch(time.monotonic() + self.window)
+                self._changed.notify()
+            else:
+                self.collapsed += 1
+            batch.fields.update(fields)
+            batch.requests += 1
+            return dict(batch.fields)
+
+    def has_pending(self, address):
+        key = self._key(address)
+        return key in self._pending or key in self._in_flight
+
+    def pending_fields(self, address):
+        """Fields accepted for the address but not yet confirmed by Mailgun (newest wins)."""
+        key = self._key(address)
+        with self._lock:
+            fields = dict(self._in_flight.get(key) or {})
+            batch = self._pending.get(key)
+            if batch is not None:
+                fields.update(batch.fields)
+            return fields
+
+    def overlay(self, result, status_code):
+        """
+        Read-your-writes: a copy of a member (`{"member": ...}`) or list (`{"items": [...]}`)
+        read with this worker's accepted updates applied.
+        """
+        if status_code != 200 or not isinstance(result, dict) or not (self._pending or self._in_flight):
+            return result
+        member = result.get('member')
+        if isinstance(member, dict) and self.has_pending(member.get('address')):
+            return {**result, 'member': {**member, **self.pending_fields(member['address'])}}
+        items = result.get('items')
+        if isinstance(items, list) and any(self.has_pending(item.get('address')) for item in items):
+            return {**result, 'items': [{**item, **self.pending_fields(item['address'])}
+                                        if self.has_pending(item.get('address')) else item for item in items]}
+        return result
+
+    def flush(self, address):
+        """
+        Sends the address's pending update now and waits for it (and any update already in flight).
+
+        Called before other writes to the same address so they reach Mailgun after it.
+        """
+        self._flush(self._key(address))
+
+    def _flush(self, key):
+        with self._lock:
+            while key in self._in_flight:
+                self._changed.wait()
+            batch = self._pending.pop(key, None)
+            if batch is None:
+                return
+            self._in_flight[key] = batch.fields
+        self._send(key, batch)
+
+    def flush_all(self):
+        """Sends everything still pending (at exit) from the calling thread."""
+        for key in list(self._pending):
+            try:
+                self._flush(key)
+            except Exception as e:
+                log.error("Coalesced update for %s failed at flush: %s", key[1], e)
+        if self._pending:
+            log.error("%d coalesced update(s) still failing at exit were not sent", len(self._pending))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due = [key for key, batch in self._pending.items()
+                       if batch.deadline <= now and key not in self._in_flight]
+                if not due:
+                    waiting = [batch.deadline for key, batch in self._pending.items()
+                               if key not in self._in_flight]
+                    # Addresses held back by an in-flight PUT are re-checked when it finishes (notify)
+                    self._changed.wait(max(0.0, min(waiting) - now) if waiting else None)
+                    continue
+                batches = []
+                for key in due:
+                    batch = self._pending.pop(key)
+                    self._in_flight[key] = batch.fields
+                    batches.append((key, batch))
+            for key, batch in batches:
+                self._executor.submit(self._send, key, batch)
+
+    def _send(self, key, batch):
+        list_address, address = key
+        retry_after = None
+        result, status_code = {"message": "Send interrupted"}, 500
+        try:
+            with self.app.app_context(), mail_lists.use_list(list_address):
+                result, status_code = mailgun_service.update_member(address, **batch.fields)
+        except MailgunUnavailable as e:
+            result, status_code, retry_after = {"message": e.message}, 503, e.retry_after
+        except Exception as e:
+            result, status_code = {"message": f"Server error: {e}"}, 500
+        finally:
+            batch.attempts += 1
+            retry = _is_retryable(status_code) and batch.attempts < self.max_attempts
+            delay = min(self.retry_delay * 2 ** (batch.attempts - 1), self.retry_max_delay)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            with self._lock:
+                self._in_flight.pop(key, None)
+                self.flushes[str(status_code)] += 1
+                if retry:
+                    # Back in the queue without a gap, so reads keep showing the accepted update
+                    self.retries += 1
+                    self._requeue(key, batch, time.monotonic() + delay)
+                elif status_code != 200:
+                    self.dropped += 1
+                self._changed.notify_all()
+        message = result.get('message') if isinstance(result, dict) else result
+        if retry:
+            log.warning("Coalesced update for %s failed (%s %s); retrying in %.1fs (attempt %d/%d)", address,
+                        status_code, message, delay, batch.attempts + 1, self.max_attempts)
+        elif status_code != 200:
+            log.error("Coalesced update for %s (%d request(s)) failed after %d attempt(s), dropped: %s %s", address,
+                      batch.requests, batch.attempts, status_code, message)
+        return result, status_code
+
+    def _requeue(self, key, batch, deadline):
+        """Puts a failed batch back (lock held); updates accepted while it was in flight win over it."""
+        newer = self._pending.get(key)
+        if newer is None:
+            batch.deadline = deadline
+            self._pending[key] = batch
+            return
+        newer.fields = {**batch.fields, **newer.fields}
+        newer.requests += batch.requests
+        newer.attempts = batch.attempts
+        newer.deadline = max(newer.deadline, deadline)
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'in_flight': len(self._in_flight),
+            'collapsed': self.collapsed,
+            'flushes': dict(self.flushes),
+            'retries': self.retries,
+            'dropped': self.dropped,
+        }
+
+
+def init_app(app):
+    """Creates the write coalescer when WRITE_COALESCE_ENABLED is set."""
+    if not app.config.get('WRITE_COALESCE_ENABLED'):
+        app.extensions[EXTENSION_KEY] = None
+        return None
+    coalescer = WriteCoalescer(
+        app,
+        window=float(app.config.get('WRITE_COALESCE_WINDOW', 0.25)),
+        concurrency=int(app.config.get('WRITE_COALESCE_CONCURRENCY', 4)),
+        max_attempts=int(app.config.get('WRITE_COALESCE_MAX_ATTEMPTS', 5)),
+        retry_delay=float(app.config.get('WRITE_COALESCE_RETRY_DELAY', 1.0)),
+        retry_max_delay=float(app.config.get('WRITE_COALESCE_RETRY_MAX_DELAY', 30.0)),
+    )
+    app.extensions[EXTENSION_KEY] = coalescer
+    return coalescer
+
+
+def get_coalescer():
+    """Returns the write coalescer for the current app, or None when updates are sent directly."""
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def apply_pending(result, status_code, *headers):
+    """Overlays this worker's accepted-but-unsent updates on a read; passes the response through otherwise."""
+    coalescer = get_coalescer()
+    if coalescer is not None:
+        result = coalescer.overlay(result, status_code)
+    return (result, status_code, *headers)
+
+
+def flush_pending(address):
+    """Sends any pending update for the address before another write to it."""
+    coalescer = get_coalescer()
+    if coalescer is not None and coalescer.has_pending(address):
+        coalescer.flush(address)
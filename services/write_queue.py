@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import threading
+import logging
+from flask import current_app
+from services import mailgun_service
+from services.errors import MailgunUnavailable
+from services.rate_limiter import wait_policy
+from services.mail_lists import active_list, use_list
+
+log = logging.getLogger(__name__)
+
+# Key used to store the queue on the Flask app (app.extensions)
+EXTENSION_KEY = 'write_queue'
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    status_code INTEGER,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, next_attempt_at);
+"""
+
+
+def _is_retryable(status_code):
+    """Rate limiting and server/connection errors are worth retrying; other 4xx are not."""
+    return status_code == 429 or status_code >= 500
+
+
+class WriteQueue:
+    """
+    Durable SQLite journal of pending Mailgun writes.
+
+    Each process (gunicorn worker) uses its own connections; jobs are claimed
+    atomically with a lease, so several workers can drain the same journal and
+    jobs held by a crashed worker are picked up again once the lease expires.
+    """
+
+    def __init__(self, path, max_attempts=5, retry_base_delay=2.0, retry_max_delay=300.0,
+                 lease_seconds=60.0, retention_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        """Returns this thread's connection, opening a new one after a fork."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, operation, payload):
+        """Persists a write and returns its job id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (id, operation, payload, status, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, operation, json.dumps(payload), QUEUED, now, now, now),
+        )
+        return job_id
+
+    def get(self, job_id):
+        """Returns the job as a dict, or None if it doesn't exist."""
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row['id'],
+            'operation': row['operation'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'status_code': row['status_code'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+
+    def claim(self, batch_size):
+        """Atomically leases up to `batch_size` due jobs (including jobs with an expired lease)."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT id, operation, payload, attempts FROM jobs "
+                "WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND lease_until < ?) "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (QUEUED, now, RUNNING, now, batch_size),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(RUNNING, now + self.lease_seconds, now, row['id']) for row in rows],
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [
+            {'id': row['id'], 'operation': row['operation'],
+             'payload': json.loads(row['payload']), 'attempts': row['attempts'] + 1}
+            for row in rows
+        ]
+
+    def finish(self, job, result, status_code):
+        """Records the outcome of an attempt, rescheduling retryable failures with backoff."""
+        now = time.time()
+        if 200 <= status_code < 300:
+            status, next_attempt_at = SUCCEEDED, now
+        elif _is_retryable(status_code) and job['attempts'] < self.max_attempts:
+            delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (job['attempts'] - 1))
+            status, next_attempt_at = QUEUED, now + random.uniform(delay / 2, delay)
+        else:
+            status, next_attempt_at = FAILED, now
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, next_attempt_at = ?, lease_until = NULL, status_code = ?, "
+            "result = ?, updated_at = ? WHERE id = ?",
+            (status, next_attempt_at, status_code, json.dumps(result), now, job['id']),
+        )
+        return status
+
+    def purge(self):
+        """Deletes finished jobs older than the retention period."""
+        cutoff = time.time() - self.retention_seconds
+        self._connect().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (SUCCEEDED, FAILED, cutoff)
+        )
+
+    def stats(self):
+        """Returns the number of jobs per state."""
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        stats = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+        stats.update({row['status']: row['n'] for row in rows})
+        return stats
+
+
+class Dispatcher:
+    """
+    Background thread that drains the write queue into Mailgun.
+
+    Jobs are claimed in batches. Upserts in a batch are sent together through
+    the members.json bulk API (one call per list); everything else goes through
+    add_list_member one by one. Jobs queued for another list than the default
+    one carry its address in their payload ('list'). One dispatcher runs per process and is (re)started lazily after a fork.
+    """
+
+    def __init__(self, app, queue, batch_size=50, poll_interval=0.5, use_bulk=True):
+        self.app = app
+        self.queue = queue
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.use_bulk = use_bulk
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Starts the dispatcher thread for this process if it isn't running."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='write-queue-dispatcher', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def notify(self):
+        """Wakes the dispatcher so a new job is picked up without waiting for the next poll."""
+        self._wakeup.set()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def _run(self):
+        last_purge = 0
+        while not self._stopping.is_set():
+            try:
+                background_wait = self.app.config.get('MAILGUN_RATE_LIMIT_BACKGROUND_MAX_WAIT', 30)
+                with self.app.app_context(), wait_policy(background_wait):
+                    processed = self.drain_once()
+                    if time.time() - last_purge > 3600:
+                        self.queue.purge()
+                        last_purge = time.time()
+            except Exception as e:
+                log.error("Write queue dispatcher error: %s", e)
+                processed = 0
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def drain_once(self):
+        """Claims and processes one batch; returns the number of jobs handled."""
+        jobs = self.queue.claim(self.batch_size)
+        if not jobs:
+            return 0
+        bulk = {}
+        single = []
+        for job in jobs:
+            if self.use_bulk and job['operation'] == 'add' and job['payload'].get('upsert', True):
+                bulk.setdefault(job['payload'].get('list'), []).append(job)
+            else:
+                single.append(job)
+
+        for list_address, list_jobs in bulk.items():
+            if len(list_jobs) == 1:
+                single.extend(list_jobs)
+                continue
+            members = []
+            for job in list_jobs:
+                member = {'address': job['payload']['email'], 'subscribed': job['payload'].get('subscribed', True)}
+                # Like add_list_member: without a name the upsert keeps the stored one
+                if job['payload'].get('name'):
+                    member['name'] = job['payload']['name']
+                members.append(member)
+            with use_list(list_address):
+                result, status_code = self._call(mailgun_service.add_list_members_bulk, members, upsert=True)
+            if 400 <= status_code < 500 and not _is_retryable(status_code):
+                # One bad member rejects the whole batch; retry them individually to isolate it
+                single.extend(list_jobs)
+            else:
+                for job in list_jobs:
+                    self.queue.finish(job, result, status_code)
+
+        for job in single:
+            if job['operation'] == 'add':
+                payload = dict(job['payload'])
+                with use_list(payload.pop('list', None)):
+                    result, status_code = self._call(mailgun_service.add_list_member, **payload)
+            else:
+                result, status_code = {"message": f"Unknown operation: {job['operation']}"}, 400
+            state = self.queue.finish(job, result, status_code)
+            if state == FAILED:
+                log.warning("Queued job %s failed after %d attempt(s): %s", job['id'], job['attempts'], status_code)
+        return len(jobs)
+
+    @staticmethod
+    def _call(func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except MailgunUnavailable as e:
+            # Breaker open or rate limited: leave the job queued for a later retry
+            return {"message": e.message}, 503
+        except Exception as e:
+            log.error("Queued write raised: %s", e)
+            return {"message": f"Server error: {e}"}, 500
+
+
+def init_app(app):
+    """Creates the write queue and its dispatcher when queued writes are enabled."""
+    if not app.config.get('WRITE_QUEUE_ENABLED'):
+        app.extensions[EXTENSION_KEY] = None
+        return None
+    queue = WriteQueue(
+        app.config.get('WRITE_QUEUE_PATH', 'write_queue.sqlite3'),
+        max_attempts=app.config.get('WRITE_QUEUE_MAX_ATTEMPTS', 5),
+        retry_base_delay=app.config.get('WRITE_QUEUE_RETRY_DELAY', 2.0),
+    )
+    dispatcher = Dispatcher(
+        app, queue,
+        batch_size=app.config.get('WRITE_QUEUE_BATCH_SIZE', 50),
+        poll_interval=app.config.get('WRITE_QUEUE_POLL_INTERVAL', 0.5),
+        use_bulk=app.config.get('WRITE_QUEUE_USE_BULK', True),
+    )
+    app.extensions[EXTENSION_KEY] = dispatcher
+    if app.config.get('WRITE_QUEUE_START_DISPATCHER', True):
+        dispatcher.ensure_started()
+    return dispatcher
+
+
+def get_dispatcher():
+    """Returns the dispatcher for the current app, or None when queued writes are disabled."""
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def enqueue_add(email, name=None, subscribed=True, upsert=True):
+    """Queues an add_list_member call (for the list active in this context) and returns the job id."""
+    dispatcher = get_dispatcher()
+    payload = {'email': email, 'name': name, 'subscribed': subscribed, 'upsert': upsert}
+    if active_list() is not None:
+        payload['list'] = active_list()
+    job_id = dispatcher.queue.enqueue('add', payload)
+    if current_app.config.get('WRITE_QUEUE_START_DISPATCHER', True):
+        dispatcher.ensure_started()
+        dispatcher.notify()
+    return job_id
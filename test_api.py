@@ -1,6 +1,7 @@
 import time
 import hashlib
 import hmac
+import json
 import requests
 from dotenv import load_dotenv
 import os
@@ -23,6 +24,29 @@ def test_list_subscribers():
     data = response.json()
     assert isinstance(data.get("items"), list)
 
+def test_list_subscribers_not_modified():
+    response = requests.get(BASE_URL + "/")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    response = requests.get(BASE_URL + "/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+
+def test_export_subscribers():
+    response = requests.get(BASE_URL + "/export", params={"limit": 5})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    lines = [line for line in response.text.splitlines() if line]
+    assert len(lines) <= 5
+
+def test_count_subscribers():
+    response = requests.get(BASE_URL + "/count", params={"subscribed": "true"})
+    # Counts come from the subscriber mirror: 501 when it is disabled, 503 until its first sync
+    assert response.status_code in (200, 501, 503)
+    if response.status_code == 200:
+        assert isinstance(response.json()["count"], int)
+
 def test_add_subscriber():
     timestamp, signature = generate_signature("subscribe-add")
     headers = {
@@ -34,6 +58,28 @@ def test_add_subscriber():
     response = requests.post(BASE_URL + "/", headers=headers, data=data)
     assert response.status_code in [200, 201]
 
+def test_add_subscriber_rejects_invalid_payload():
+    response = requests.post(BASE_URL + "/", json={"address": "not-an-email", "subscribed": "maybe"})
+    assert response.status_code == 400
+    errors = response.json()["errors"]
+    assert set(errors) == {"address", "subscribed"}
+
+def test_bulk_import_subscribers():
+    timestamp, signature = generate_signature("subscribe-bulk")
+    headers = {
+        "X-Timestamp": timestamp,
+        "X-Signature": signature,
+        "Content-Type": "text/csv"
+    }
+    data = "address,name\nbulk1@example.com,Bulk One\nbulk2@example.com,Bulk Two\nnot-an-email,Bad\n"
+    response = requests.post(BASE_URL + "/bulk", headers=headers, data=data)
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines() if line]
+    summary = events[-1]
+    assert summary["event"] == "summary"
+    assert summary["valid"] == 2
+    assert summary["invalid"] == 1
+
 def test_get_subscriber():
     response = requests.get(BASE_URL + "/test@example.com")
     assert response.status_code == 200
@@ -41,6 +87,24 @@ def test_get_subscriber():
     assert "member" in data
     assert "address" in data["member"]
 
+def test_get_subscriber_from_mirror():
+    # Served from the local mirror when it is enabled and fresh, from Mailgun otherwise
+    response = requests.get(BASE_URL + "/test@example.com", params={"source": "mirror"})
+    assert response.status_code == 200
+    assert response.json()["member"]["address"] == "test@example.com"
+    response = requests.get(BASE_URL + "/test@example.com", params={"source": "elsewhere"})
+    assert response.status_code == 400
+
+def test_find_subscriptions_across_lists():
+    subscriptions_url = BASE_URL.replace("/subscribers", "/subscriptions")
+    response = requests.get(subscriptions_url + "/test@example.com")
+    # 207 when some list could not be read; each list reports its own status either way
+    assert response.status_code in (200, 207)
+    data = response.json()
+    assert data["address"] == "test@example.com"
+    assert all("status" in entry for entry in data["lists"].values())
+    assert set(data["subscribed"]) <= set(data["lists"])
+
 def test_update_subscriber():
     timestamp, signature = generate_signature("subscribe-update")
     headers = {
@@ -52,6 +116,40 @@ def test_update_subscriber():
     response = requests.put(BASE_URL + "/test@example.com", headers=headers, data=data)
     assert response.status_code == 200
 
+def test_replayed_signature_rejected():
+    timestamp = str(int(time.time()))
+    nonce = os.urandom(8).hex()
+    message = f"{timestamp}subscribe-update{nonce}"
+    headers = {
+        "X-Timestamp": timestamp,
+        "X-Signature": hmac.new(API_SECRET, message.encode(), hashlib.sha256).hexdigest(),
+        "X-Nonce": nonce,
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+    data = {"name": "Test User"}
+    first = requests.put(BASE_URL + "/test@example.com", headers=headers, data=data)
+    assert first.status_code == 200
+    replay = requests.put(BASE_URL + "/test@example.com", headers=headers, data=data)
+    assert replay.status_code == 401
+
+def test_metrics():
+    requests.get(BASE_URL + "/")
+    response = requests.get(BASE_URL.split("/api/")[0] + "/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert "http_requests_total{" in response.text
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+
+def test_webhook_rejects_bad_signature():
+    webhook_url = BASE_URL.replace("/mail/subscribers", "/webhooks/mailgun")
+    payload = {
+        "signature": {"timestamp": str(int(time.time())), "token": os.urandom(25).hex(), "signature": "0" * 64},
+        "event-data": {"event": "unsubscribed", "recipient": "test@example.com"},
+    }
+    response = requests.post(webhook_url, json=payload)
+    # 501 when webhooks are disabled (WEBHOOKS_ENABLED=false)
+    assert response.status_code in (401, 501)
+
 def test_delete_subscriber():
     timestamp, signature = generate_signature("subscribe-delete")
     headers = {
@@ -0,0 +1,58 @@
+import time
+import pytest
+from auth.decorators import authenticate_request
+from auth.tokens import TOKEN_HEADER, TokenMinter
+
+SECRET = 's3cret'
+MEMBER_URL = '/api/v1/mail/subscribers/member000000@example.com'
+
+
+@pytest.fixture
+def minter():
+    return TokenMinter.from_config({'API_SECRET': SECRET, 'AUTH_TOKEN_ACTIONS': 'subscribe-add,subscribe-update'})
+
+
+def _authenticate(token, action, minter):
+    return authenticate_request({TOKEN_HEADER: token}, action, SECRET, minter=minter)
+
+
+def test_token_accepted_for_its_action(minter):
+    token, _ = minter.mint('subscribe-update')
+    assert _authenticate(token, 'subscribe-update', minter) == (True, None, 200)
+
+
+def test_bad_tokens_rejected(minter):
+    now = int(time.time())
+    expired, _ = minter.mint('subscribe-update', now=now - minter.ttl - minter.bucket_seconds)
+    other_action, _ = minter.mint('subscribe-add', now=now)
+    forged = f"{other_action.partition('.')[0]}.{'0' * 64}"
+    assert _authenticate(expired, 'subscribe-update', minter) == (False, "Token expired.", 401)
+    assert _authenticate(other_action, 'subscribe-update', minter) == (False, "Invalid token.", 401)
+    assert _authenticate(forged, 'subscribe-update', minter) == (False, "Invalid token.", 401)
+    assert _authenticate('not-a-token', 'subscribe-update', minter) == (False, "Invalid token.", 401)
+
+
+def test_token_refused_for_action_not_configured(minter):
+    token, _ = minter.mint('subscribe-update')
+    assert _authenticate(token, 'subscribe-delete', minter)[2] == 401
+    with pytest.raises(ValueError):
+        minter.mint('subscribe-delete')
+
+
+def test_token_on_signed_route(make_app):
+    client = make_app(AUTH_TOKEN_ACTIONS='subscribe-add,subscribe-update').test_client()
+    response = client.get('/api/v1/auth/token', query_string={'action': 'subscribe-update'})
+    assert response.status_code == 200
+    token = response.get_json()['token']
+    response = client.put(MEMBER_URL, headers={TOKEN_HEADER: token}, data={'name': 'Token User'})
+    assert response.status_code == 200
+    response = client.put(MEMBER_URL, headers={TOKEN_HEADER: token[:-1] + '0'}, data={'name': 'Nobody'})
+    assert response.status_code == 401
+
+
+def test_default_config_mints_no_tokens_for_signed_routes(make_app):
+    client = make_app(AUTH_TOKEN_ACTIONS='subscribe-add').test_client()
+    response = client.get('/api/v1/auth/token', query_string={'action': 'subscribe-update'})
+    assert response.status_code == 400
+    token, _ = TokenMinter(SECRET, actions=('subscribe-update',)).mint('subscribe-update')
+    assert client.put(MEMBER_URL, headers={TOKEN_HEADER: token}, data={'name': 'Nobody'}).status_code == 401
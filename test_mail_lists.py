@@ -0,0 +1,104 @@
+import threading
+import pytest
+from flask import Flask
+from auth.tokens import TOKEN_HEADER, TokenMinter
+from conftest import LIST_ADDRESS
+from services import mail_lists, mailgun_service, write_coalescer, write_queue
+from services.errors import MailgunUnavailable
+from services.mail_lists import MailLists
+
+LISTS = 'news=news@example.com,promo=promo@example.com'
+MEMBER = 'alice@example.com'
+
+
+def test_fan_out_scopes_each_call_to_its_list():
+    app = Flask(__name__)
+    app.config['MAILGUN_LIST_ADDRESS'] = LIST_ADDRESS
+    registry = MailLists(app, {'news': 'news@example.com', 'promo': 'promo@example.com'}, LIST_ADDRESS)
+
+    def call():
+        address = mail_lists.current_list_address()
+        if address == 'promo@example.com':
+            raise MailgunUnavailable("Circuit open")
+        return {'list': address, 'active': mail_lists.active_list(), 'thread': threading.current_thread().name}, 200
+
+    results = registry.fan_out(call, registry)
+    assert list(results) == ['default', 'news', 'promo']
+    assert results['default'][0]['list'] == LIST_ADDRESS
+    assert results['default'][0]['active'] is None  # The default list keeps the unscoped behaviour
+    assert results['news'][0]['list'] == results['news'][0]['active'] == 'news@example.com'
+    assert results['news'][0]['thread'].startswith('mail-lists-fanout')
+    assert results['promo'] == ({'message': "Circuit open"}, 503)
+    assert mail_lists.active_list() is None  # Nothing leaks into the caller's context
+
+
+@pytest.fixture
+def client(make_app, monkeypatch):
+    """(test client, add_list_member calls) for an app serving three lists; adds to 'promo' fail."""
+    calls = []
+
+    def add_list_member(email, name=None, subscribed=True, upsert=False):
+        list_address = mail_lists.current_list_address()
+        calls.append((list_address, email))
+        if list_address == 'promo@example.com':
+            return {"message": "Mailgun error"}, 502
+        return {"message": "Mailing list member has been created", "member": {"address": email}}, 200
+
+    monkeypatch.setattr(mailgun_service, 'add_list_member', add_list_member)
+    return make_app(MAILGUN_LISTS=LISTS).test_client(), calls
+
+
+def test_subscriptions_report_207_when_one_list_fails(client):
+    client, calls = client
+    response = client.post('/api/v1/mail/subscriptions', json={'address': MEMBER, 'lists': ['news', 'promo']})
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body['failed'] == ['promo']
+    assert body['lists']['news']['status'] == 200
+    assert body['lists']['promo'] == {'status': 502, 'message': "Mailgun error"}
+    assert sorted(calls) == [('news@example.com', MEMBER), ('promo@example.com', MEMBER)]
+
+    response = client.post('/api/v1/mail/subscriptions', json={'address': MEMBER, 'lists': ['news', 'default']})
+    assert response.status_code == 200
+    assert response.get_json()['failed'] == []
+
+
+def test_unknown_list_is_refused(client):
+    client, calls = client
+    response = client.post('/api/v1/mail/subscriptions', json={'address': MEMBER, 'lists': ['news', 'nope']})
+    assert response.status_code == 400
+    assert 'nope' in response.get_json()['errors']['lists']
+    assert client.get('/api/v1/mail/lists/nope/subscribers/').status_code == 404
+    assert client.get(f'/api/v1/mail/subscriptions/{MEMBER}', query_string={'lists': 'nope'}).status_code == 404
+    assert not calls
+
+
+def test_queued_add_carries_its_list(make_app, tmp_path):
+    app = make_app(write_queue, MAILGUN_LISTS=LISTS, WRITE_QUEUE_ENABLED=True,
+                   WRITE_QUEUE_PATH=str(tmp_path / 'queue.sqlite3'), WRITE_QUEUE_START_DISPATCHER=False)
+    client = app.test_client()
+    assert client.post('/api/v1/mail/lists/news/subscribers/', json={'address': MEMBER}).status_code == 202
+    assert client.post('/api/v1/mail/subscribers/', json={'address': 'bob@example.com'}).status_code == 202
+    jobs = app.extensions[write_queue.EXTENSION_KEY].queue.claim(10)
+    payloads = {job['payload']['email']: job['payload'] for job in jobs}
+    assert payloads[MEMBER]['list'] == 'news@example.com'
+    assert 'list' not in payloads['bob@example.com']  # The dispatcher sends these to the default list
+
+
+def test_coalesced_update_is_kept_per_list(make_app):
+    app = make_app(write_coalescer, MAILGUN_LISTS=LISTS, AUTH_TOKEN_ACTIONS='subscribe-update',
+                   WRITE_COALESCE_ENABLED=True, WRITE_COALESCE_WINDOW=60)
+    coalescer = app.extensions[write_coalescer.EXTENSION_KEY]
+    try:
+        token, _ = TokenMinter('s3cret', actions=('subscribe-update',)).mint('subscribe-update')
+        response = app.test_client().put(f'/api/v1/mail/lists/news/subscribers/{MEMBER}',
+                                         headers={TOKEN_HEADER: token}, data={'name': 'Alice'})
+        assert response.status_code == 202
+        assert list(coalescer._pending) == [('news@example.com', MEMBER)]
+        # A coalesced update queued for the list is visible in that list's reads only
+        registry = app.extensions[mail_lists.EXTENSION_KEY]
+        seen = registry.fan_out(lambda: ({'pending': coalescer.pending_fields(MEMBER)}, 200), registry)
+        assert {name: result['pending'] for name, (result, _) in seen.items()} == {
+            'default': {}, 'news': {'name': 'Alice'}, 'promo': {}}
+    finally:
+        coalescer._pending.clear()  # Not sent: nothing for the exit flush to deliver
@@ -0,0 +1,130 @@
+import os
+import asyncio
+import fcntl
+import threading
+import pytest
+from auth.decorators import ReplayCache, RECORDED, REPLAYED, STALE, FULL
+from api.throttling import MemoryStore
+from services import mailgun_client, mailgun_service, mirror
+from services.cache import LRUCache, SubscriberCache
+from services.errors import MailgunUnavailable
+from services.mailgun_client import MailgunClient
+from services.async_mailgun_client import AsyncMailgunClient
+from services.rate_limiter import RateLimiter, RateLimitExceeded, SharedTokenBucket, TokenBucket
+from services.resilience import Resilience, HALF_OPEN, CLOSED
+
+
+def _half_open_client():
+    resilience = Resilience.from_config({'MAILGUN_BREAKER_FAILURE_THRESHOLD': 1})
+    breaker = resilience.breaker('get_member')
+    breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout  # Reset timeout elapsed: the next call is the trial
+    limiter = RateLimiter(TokenBucket(rate=1, capacity=1), max_wait=0)
+    limiter.penalize(60)  # Mailgun said Retry-After: 60
+    return MailgunClient('key-test', 'http://127.0.0.1', resilience=resilience, rate_limiter=limiter), breaker
+
+
+def test_rate_limited_trial_frees_half_open_breaker(mailgun_url):
+    client, breaker = _half_open_client()
+    with pytest.raises(RateLimitExceeded):
+        client.request('GET', mailgun_url, operation='get_member')
+    assert breaker.state == HALF_OPEN
+    # The trial was never sent, so the next call gets to be the trial instead of CircuitOpenError
+    client.rate_limiter = None
+    response = client.request('GET', mailgun_url, operation='get_member')
+    assert response.status_code == 200
+    assert breaker.state == CLOSED
+
+
+def test_write_refused_by_open_breaker_leaves_mirror_unchanged(make_app):
+    app = make_app(MAILGUN_BREAKER_FAILURE_THRESHOLD=1)
+    app.extensions[mailgun_client.EXTENSION_KEY].resilience.breaker('add_list_member').record_failure()
+    with app.app_context():
+        with pytest.raises(MailgunUnavailable):
+            mailgun_service.add_list_member('ghost@example.com', name='Ghost')
+        subscriber_mirror = mirror.get_mirror()
+        # Never sent, so no dirty "maybe added" row for /count and list reads to pick up
+        assert subscriber_mirror.get('list@example.com', 'ghost@example.com') is None
+        assert subscriber_mirror.count('list@example.com') == 0
+
+
+def test_full_replay_cache_drops_oldest_bucket():
+    cache = ReplayCache(bucket_seconds=10, max_entries=2)
+    now = 1000
+    assert cache.check_and_add(now - 50, 'a', now=now) == RECORDED
+    assert cache.check_and_add(now - 20, 'b', now=now) == RECORDED
+    # Full: the oldest bucket goes instead of refusing new requests
+    assert cache.check_and_add(now, 'c', now=now) == RECORDED
+    assert cache.evicted == 1
+    assert cache.check_and_add(now - 20, 'b', now=now) == REPLAYED
+    # 'a' was forgotten, so its timestamp can no longer be checked
+    assert cache.check_and_add(now - 50, 'a', now=now) == STALE
+    assert cache.check_and_add(now - 55, 'd', now=now) == STALE
+
+
+def test_replay_cache_full_of_current_timestamps():
+    cache = ReplayCache(bucket_seconds=10, max_entries=2)
+    now = 1000
+    assert cache.check_and_add(now, 'a', now=now) == RECORDED
+    assert cache.check_and_add(now, 'b', now=now) == RECORDED
+    assert cache.check_and_add(now, 'c', now=now) == FULL
+    assert cache.check_and_add(now, 'a', now=now) == REPLAYED
+
+
+def test_throttle_store_drops_least_recently_seen_keys():
+    store = MemoryStore(max_keys=2)
+    store.hit('a', 2, 60, 0)
+    store.hit('b', 2, 60, 0)
+    store.hit('a', 2, 60, 1)
+    store.hit('c', 2, 60, 2)
+    # 'a' keeps its count; only the idle 'b' was dropped
+    assert store.hit('a', 2, 60, 3) == (False, 2)
+    assert store.hit('b', 2, 60, 3) == (True, 1)
+
+
+def test_cache_skips_result_fetched_before_invalidation():
+    cache = SubscriberCache(LRUCache(maxsize=1))
+    key = cache.member_key('list@example.com', 'a@example.com')
+    generation = cache.generation(key)
+    cache.invalidate(key)  # A write lands while the read is in flight
+    cache.set(key, {'member': {'name': 'old'}}, 200, generation=generation)
+    assert cache.get(key) is None
+    # Forgotten generations still invalidate reads that started before them
+    generation = cache.generation(key)
+    cache.invalidate(key)
+    cache.invalidate('other')
+    cache.set(key, {'member': {'name': 'old'}}, 200, generation=generation)
+    assert cache.get(key) is None
+    cache.set(key, {'member': {'name': 'new'}}, 200, generation=cache.generation(key))
+    assert cache.get(key) == ({'member': {'name': 'new'}}, 200)
+
+
+def test_shared_bucket_lock_does_not_block_event_loop(mailgun_url, tmp_path):
+    bucket = SharedTokenBucket(str(tmp_path / 'bucket'), rate=100, capacity=100)
+    client = AsyncMailgunClient('key-test', 'http://127.0.0.1', rate_limiter=RateLimiter(bucket))
+    bucket.reserve(0, 0)  # Creates the file
+    holder = os.open(bucket.path, os.O_RDWR)
+    fcntl.flock(holder, fcntl.LOCK_EX)  # Another worker holds the bucket
+    threading.Timer(0.3, fcntl.flock, (holder, fcntl.LOCK_UN)).start()
+
+    async def scenario():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        try:
+            response = await client.request('GET', mailgun_url, operation='get_member')
+        finally:
+            ticker.cancel()
+            await client.aclose()
+        return response.status, ticks
+
+    status, ticks = asyncio.run(scenario())
+    os.close(holder)
+    assert status == 200
+    assert ticks >= 10  # The loop kept running while the request waited for the lock
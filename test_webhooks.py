@@ -0,0 +1,109 @@
+import hmac
+import time
+import hashlib
+import pytest
+from api.webhooks import RETRY_AFTER
+from auth.decorators import ReplayCache, check_webhook_signature
+from conftest import LIST_ADDRESS
+from services import mirror, webhooks
+
+SIGNING_KEY = 'whsec-test'
+MEMBER = 'alice@example.com'
+
+
+def _sign(timestamp, token, key=SIGNING_KEY):
+    return hmac.new(key.encode(), f"{timestamp}{token}".encode(), hashlib.sha256).hexdigest()
+
+
+def _event(token, recipient=MEMBER, kind='unsubscribed', timestamp=None):
+    timestamp = timestamp or int(time.time())
+    return {
+        'signature': {'timestamp': str(timestamp), 'token': token, 'signature': _sign(timestamp, token)},
+        'event-data': {'event': kind, 'recipient': recipient, 'timestamp': timestamp,
+                       'mailing-list': {'address': LIST_ADDRESS}},
+    }
+
+
+def test_webhook_signature_checks():
+    now = 1700000000
+    good = _sign(now, 'token-1')
+    assert check_webhook_signature(SIGNING_KEY, str(now), 'token-1', good, now=now) == ('ok', None, 200)
+    assert check_webhook_signature(SIGNING_KEY, str(now), 'token-1', _sign(now, 'token-1', 'other'),
+                                   now=now)[::2] == ('invalid', 401)
+    assert check_webhook_signature(SIGNING_KEY, str(now), 'token-1', good, now=now + 3600)[::2] == ('expired', 401)
+    assert check_webhook_signature(SIGNING_KEY, None, 'token-1', good, now=now)[::2] == ('missing', 401)
+    cache = ReplayCache()
+    assert check_webhook_signature(SIGNING_KEY, str(now), 'token-1', good, now=now, replay_cache=cache)[0] == 'ok'
+    assert check_webhook_signature(SIGNING_KEY, str(now), 'token-1', good, now=now,
+                                   replay_cache=cache)[::2] == ('replayed', 401)
+
+
+@pytest.fixture
+def webhook_app(make_app):
+    app = make_app(webhooks, WEBHOOKS_ENABLED=True, MAILGUN_WEBHOOK_SIGNING_KEY=SIGNING_KEY, WEBHOOK_QUEUE_SIZE=1)
+    processor = app.extensions[webhooks.EXTENSION_KEY]
+    processor.ensure_started = lambda: None  # No worker: queued events stay put until the test takes them
+    return app, processor
+
+
+def test_endpoint_rejects_bad_and_replayed_signatures(webhook_app):
+    app, processor = webhook_app
+    client = app.test_client()
+    forged = _event('token-forged')
+    forged['signature']['signature'] = _sign(forged['signature']['timestamp'], 'token-forged', 'other')
+    assert client.post('/api/v1/webhooks/mailgun', json=forged).status_code == 401
+    expired = _event('token-old', timestamp=int(time.time()) - 3600)
+    assert client.post('/api/v1/webhooks/mailgun', json=expired).status_code == 401
+    assert client.post('/api/v1/webhooks/mailgun', json={'event-data': {}}).status_code == 400
+
+    event = _event('token-1')
+    assert client.post('/api/v1/webhooks/mailgun', json=event).status_code == 200
+    response = client.post('/api/v1/webhooks/mailgun', json=event)
+    assert response.status_code == 401
+    assert response.get_json()['message'] == "Signature already used."
+    assert processor.stats()['pending'] == 1
+
+
+def test_full_buffer_answers_503_and_accepts_mailgun_retry(webhook_app):
+    app, processor = webhook_app
+    client = app.test_client()
+    assert client.post('/api/v1/webhooks/mailgun', json=_event('token-1')).status_code == 200
+    retried = _event('token-2', recipient='bob@example.com')
+    response = client.post('/api/v1/webhooks/mailgun', json=retried)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == RETRY_AFTER
+    assert processor.stats()['dropped'] == 1
+
+    processor._queue.get_nowait()  # The worker drains the buffer
+    # Same token as the refused delivery: not a replay, since it was never processed
+    assert client.post('/api/v1/webhooks/mailgun', json=retried).status_code == 200
+    assert processor._queue.get_nowait()[1] == 'bob@example.com'
+
+
+def test_events_not_changing_state_are_ignored(webhook_app):
+    _, processor = webhook_app
+    event = _event('token-1')['event-data']
+    domain_wide = {key: value for key, value in event.items() if key != 'mailing-list'}
+    assert processor.accept({**event, 'event': 'delivered'}) == webhooks.IGNORED
+    assert processor.accept({**event, 'mailing-list': {'address': 'other@example.com'}}) == webhooks.IGNORED
+    assert processor.accept(domain_wide) == webhooks.IGNORED
+    assert processor.stats()['pending'] == 0
+
+
+def test_apply_skips_events_older_than_mirror_row(webhook_app):
+    app, processor = webhook_app
+    mail_list = processor.lists.resolve(LIST_ADDRESS)
+    with app.app_context():
+        subscriber_mirror = mirror.get_mirror()
+        subscriber_mirror.upsert(LIST_ADDRESS, [{'address': MEMBER, 'name': 'Alice', 'subscribed': True}])
+        synced_at = subscriber_mirror.get(LIST_ADDRESS, MEMBER)['synced_at']
+
+        # Unsubscribed before the row was written (e.g. resubscribed since): left alone
+        processor.apply([(mail_list, MEMBER, synced_at - 60)])
+        assert subscriber_mirror.get(LIST_ADDRESS, MEMBER)['subscribed'] == 1
+        assert processor.stats()['mirror_updates'] == 0
+
+        # The latest event per member wins within a batch
+        processor.apply([(mail_list, MEMBER, synced_at + 60), (mail_list, MEMBER, synced_at - 60)])
+        assert subscriber_mirror.get(LIST_ADDRESS, MEMBER)['subscribed'] == 0
+        assert processor.stats()['mirror_updates'] == 1
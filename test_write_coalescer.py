@@ -0,0 +1,111 @@
+import pytest
+from flask import Flask
+from services import mail_lists, mailgun_service
+from services.write_coalescer import WriteCoalescer
+
+ADDRESS = 'alice@example.com'
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Stubs mailgun_service.update_member; returns the sent (list, address, fields) and the statuses to answer."""
+    calls, statuses = [], []
+
+    def update_member(address, **fields):
+        calls.append((mail_lists.active_list(), address, fields))
+        status_code = statuses.pop(0) if statuses else 200
+        return {"message": "stub", "member": {"address": address, **fields}}, status_code
+
+    monkeypatch.setattr(mailgun_service, 'update_member', update_member)
+    return calls, statuses
+
+
+@pytest.fixture
+def coalescer():
+    # Long window and retry delay: the flusher thread never fires, the tests flush explicitly
+    coalescer = WriteCoalescer(Flask(__name__), window=60, concurrency=1, max_attempts=3, retry_delay=60)
+    yield coalescer
+    assert not coalescer._pending, "test left updates behind for the exit flush"
+
+
+def test_updates_in_window_merge_last_write_wins(coalescer, sent):
+    calls, _ = sent
+    coalescer.submit(ADDRESS, {'name': 'Alice', 'subscribed': True})
+    assert coalescer.submit(ADDRESS, {'name': 'Alicia'}) == {'name': 'Alicia', 'subscribed': True}
+    coalescer.flush(ADDRESS)
+    assert calls == [(None, ADDRESS, {'name': 'Alicia', 'subscribed': True})]
+    assert coalescer.stats()['collapsed'] == 1
+    assert coalescer.stats()['flushes'] == {'200': 1}
+
+
+def test_batches_are_kept_per_list(coalescer, sent):
+    calls, _ = sent
+    coalescer.submit(ADDRESS, {'name': 'Default'})
+    with mail_lists.use_list('other@example.com'):
+        coalescer.submit(ADDRESS, {'name': 'Other'})
+        assert not coalescer.stats()['collapsed']
+        coalescer.flush(ADDRESS)
+    coalescer.flush(ADDRESS)
+    assert calls == [('other@example.com', ADDRESS, {'name': 'Other'}), (None, ADDRESS, {'name': 'Default'})]
+
+
+def test_overlay_shows_accepted_updates(coalescer, sent):
+    coalescer.submit(ADDRESS, {'name': 'Alicia'})
+    member = {'address': ADDRESS, 'name': 'Alice', 'subscribed': True}
+    other = {'address': 'bob@example.com', 'name': 'Bob'}
+    assert coalescer.overlay({'member': member}, 200) == {'member': {**member, 'name': 'Alicia'}}
+    assert coalescer.overlay({'items': [member, other]}, 200) == {'items': [{**member, 'name': 'Alicia'}, other]}
+    assert coalescer.overlay({'message': 'Not found'}, 404) == {'message': 'Not found'}
+    coalescer.flush(ADDRESS)
+    assert coalescer.overlay({'member': member}, 200) == {'member': member}
+
+
+@pytest.mark.parametrize('status_code', [429, 500, 503])
+def test_retryable_failure_is_requeued(coalescer, sent, status_code):
+    calls, statuses = sent
+    statuses.append(status_code)
+    coalescer.submit(ADDRESS, {'name': 'Alicia'})
+    coalescer.flush(ADDRESS)
+    assert coalescer.has_pending(ADDRESS)
+    assert coalescer.stats()['retries'] == 1
+    # Still overlaid on reads while it waits for the retry
+    assert coalescer.pending_fields(ADDRESS) == {'name': 'Alicia'}
+    coalescer.flush(ADDRESS)
+    assert calls == [(None, ADDRESS, {'name': 'Alicia'})] * 2
+    assert not coalescer.has_pending(ADDRESS)
+    assert coalescer.stats()['dropped'] == 0
+
+
+def test_update_accepted_during_failed_send_wins_over_it(coalescer, sent, monkeypatch):
+    calls, _ = sent
+    stub = mailgun_service.update_member
+
+    def update_member(address, **fields):
+        if not calls:
+            coalescer.submit(address, {'name': 'Newer'})  # Arrives while the first PUT is in flight
+            stub(address, **fields)
+            return {"message": "Too many requests"}, 429
+        return stub(address, **fields)
+
+    monkeypatch.setattr(mailgun_service, 'update_member', update_member)
+    coalescer.submit(ADDRESS, {'name': 'Older', 'subscribed': False})
+    coalescer.flush(ADDRESS)
+    assert coalescer.pending_fields(ADDRESS) == {'name': 'Newer', 'subscribed': False}
+    coalescer.flush(ADDRESS)
+    assert calls[-1] == (None, ADDRESS, {'name': 'Newer', 'subscribed': False})
+
+
+def test_client_error_and_exhausted_retries_are_dropped(coalescer, sent):
+    calls, statuses = sent
+    statuses.append(404)
+    coalescer.submit(ADDRESS, {'name': 'Ghost'})
+    coalescer.flush(ADDRESS)
+    assert not coalescer.has_pending(ADDRESS)
+    statuses.extend([503] * coalescer.max_attempts)
+    coalescer.submit(ADDRESS, {'name': 'Alicia'})
+    for _ in range(coalescer.max_attempts):
+        coalescer.flush(ADDRESS)
+    assert not coalescer.has_pending(ADDRESS)
+    assert len(calls) == 1 + coalescer.max_attempts
+    assert coalescer.stats()['retries'] == coalescer.max_attempts - 1
+    assert coalescer.stats()['dropped'] == 2